@@ -1,18 +1,92 @@
+from functools import partial
+
+import pandas as pd
 from flask import Flask
 from flask_caching import Cache
 
 # Configure caching
 cache = Cache(config={'CACHE_TYPE': 'SimpleCache'})  # Use 'SimpleCache' for development
 
-def create_app():
+def create_app(config=None):
     app = Flask(__name__)
-    cache.init_app(app)  # Initialize Flask-Caching
 
     # Configuration (if needed)
     # app.config['SECRET_KEY'] = 'your_secret_key'  # For sessions, etc.
+    app.config.from_mapping(
+        DATASET_PATH="data/spotify_tracks_dataset.csv",
+        DATASET_LOADER=None,     # Callable returning the DataFrame; defaults to load_data(DATASET_PATH)
+        DATASET_WARM_UP=False,   # Load the dataset in a background thread right away
+        DATASET_DELTA_DIR="data/deltas",  # Batches of new tracks added by `flask ingest`, or None
+        DATASET_DELTA_POLL=30,   # Seconds between two checks for new batches
+        DATASET_STREAMING=False,  # Aggregate DATASET_PATH chunk by chunk instead of loading it (see app.streaming)
+        DATASET_CHUNK_SIZE=500_000,
+        DATASET_SHARED_PATH=None,  # Memory-mapped Arrow file shared by the workers of a host (see app.shared)
+        PANDAS_COPY_ON_WRITE=True,  # Writes through a view of the shared frame copy the column first
+        ARTIFACT_CACHE_TYPE='filesystem',  # Chart cache shared by workers: 'filesystem', 'redis' or None
+        ARTIFACT_CACHE_DIR="data/artifacts",
+        ARTIFACT_CACHE_MAX_BYTES=256 * 1024 * 1024,
+        ARTIFACT_CACHE_REDIS_URL="redis://localhost:6379/0",
+        CHART_ENGINE_WORKERS=None,        # Pool size used to compute several charts at once (default: CPU count)
+        CHART_ENGINE_EXECUTOR='thread',   # 'thread' or 'process'
+        CHART_ENGINE_TIMEOUT=120,         # Seconds a single chart may take, or None
+        FIGURE_FLOAT_DTYPE='float32',     # Precision of the figure arrays: 'float32' or 'float64'
+        FIGURE_BINARY_ARRAYS=True,        # Send numeric arrays as base64 typed arrays (plotly.js >= 2.28)
+        FIGURE_BINARY_MIN_SIZE=16,
+        PREDICTION_MODEL_PATH="data/models/popularity.json",  # Fitted popularity model (see app.prediction), or None
+        METRICS_ENABLED=False,    # Per-stage timings, Server-Timing headers and /metrics (see app.metrics)
+        PROFILER_ENABLED=False,   # Sample the stacks of every thread, served on /metrics/profile
+        PROFILER_INTERVAL=0.01,   # Seconds between two samples
+    )
+    if config:
+        app.config.update(config)
+
+    cache.init_app(app)  # Initialize Flask-Caching
+
+    if app.config['PANDAS_COPY_ON_WRITE']:
+        pd.set_option('mode.copy_on_write', True)
+
+    from .serialization import encoder
+    encoder.init_app(app)
+
+    from .metrics import SamplingProfiler, metrics
+    metrics.init_app(app)
+    if app.config['PROFILER_ENABLED']:
+        app.extensions['profiler'] = SamplingProfiler(app.config['PROFILER_INTERVAL']).start()
+
+    # Second cache tier shared by all worker processes
+    from .artifacts import create_artifact_cache
+    app.extensions['artifact_cache'] = create_artifact_cache(app.config)
+
+    from .engine import ChartEngine
+    app.extensions['chart_engine'] = ChartEngine.from_config(app.config)
+
+    # The dataset is owned by the app and loaded lazily, never at import time
+    from .models import load_data
+    from .registry import DatasetRegistry
+    from .shared import SharedDataset
+    from .streaming import aggregate_file
+    loader = app.config['DATASET_LOADER']
+    if loader is None and app.config['DATASET_STREAMING']:
+        loader = partial(aggregate_file, app.config['DATASET_PATH'], app.config['DATASET_CHUNK_SIZE'])
+    elif loader is None:
+        loader = partial(load_data, app.config['DATASET_PATH'])
+    if app.config['DATASET_SHARED_PATH'] and not app.config['DATASET_STREAMING']:
+        source_path = None if app.config['DATASET_LOADER'] else app.config['DATASET_PATH']
+        loader = app.extensions['shared_dataset'] = SharedDataset(app.config['DATASET_SHARED_PATH'], loader,
+                                                                  source_path)
+    registry = DatasetRegistry(loader, app.config['DATASET_DELTA_DIR'], app.config['DATASET_DELTA_POLL'])
+    registry.init_app(app)
+    if app.config['DATASET_WARM_UP']:
+        registry.warm_up()
+
+    from .prediction import PredictionService
+    PredictionService(app.config['PREDICTION_MODEL_PATH']).init_app(app)
 
     # Import and register blueprints (for modularity)
     from .routes import main as main_blueprint
     app.register_blueprint(main_blueprint)
 
-    return app
\ No newline at end of file
+    from . import commands
+    commands.init_app(app)
+
+    return app
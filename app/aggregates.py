@@ -0,0 +1,375 @@
+import numpy as np
+import pandas as pd
+
+GENRE_COLUMN = 'track_genre'
+
+# Statistics kept for every numeric feature, in column order.
+FEATURE_STATS = ['count', 'mean', 'median', 'q1', 'q3', 'min', 'max']
+
+
+# Known bounds of the features, used for fixed histogram grids (see ``histogram`` and ``streaming``)
+FEATURE_RANGES = {
+    'popularity': (0, 100),
+    'duration_ms': (0, 6_000_000),
+    'danceability': (0, 1),
+    'energy': (0, 1),
+    'key': (-1, 11),
+    'loudness': (-60, 5),
+    'mode': (0, 1),
+    'speechiness': (0, 1),
+    'acousticness': (0, 1),
+    'instrumentalness': (0, 1),
+    'liveness': (0, 1),
+    'valence': (0, 1),
+    'tempo': (0, 250),
+    'time_signature': (0, 7),
+}
+
+
+def numeric_features(df):
+    """
+    Returns the names of the numeric columns of a DataFrame (booleans excluded).
+    """
+    return df.select_dtypes(include=['number']).columns.tolist()
+
+
+def build_genre_stats(df):
+    """
+    Computes the per-genre statistics table shared by all genre charts.
+
+    The frame is grouped once; every statistic comes out of cythonised aggregations
+    over that grouping instead of a separate ``groupby`` per chart.
+
+    Args:
+        df: The tracks DataFrame.
+
+    Returns:
+        A DataFrame indexed by genre with ``(feature, stat)`` columns, where ``stat`` is one of
+        FEATURE_STATS, plus ``('explicit', 'share')`` and ``('tracks', 'count')``.
+    """
+    features = numeric_features(df)
+    grouped = df.groupby(GENRE_COLUMN, observed=True, sort=True)
+
+    moments = grouped[features].agg(['count', 'mean', 'min', 'max'])
+    quantiles = grouped[features].quantile([0.25, 0.5, 0.75]).unstack()
+    quantiles.columns = quantiles.columns.set_levels(['q1', 'median', 'q3'], level=1)
+
+    stats = pd.concat([moments, quantiles], axis=1)
+    stats = stats.reindex(columns=pd.MultiIndex.from_product([features, FEATURE_STATS]))
+    stats[('tracks', 'count')] = grouped.size()
+    if 'explicit' in df.columns:
+        stats[('explicit', 'share')] = grouped['explicit'].mean()
+
+    stats.index = stats.index.astype(str)
+    stats.index.name = GENRE_COLUMN
+    return ready_for_threads(stats.sort_index())  # Category order is not alphabetical once batches are appended
+
+
+def ready_for_threads(table):
+    """
+    Builds the lookup tables of the row and column indexes of a DataFrame shared between threads.
+
+    pandas fills them on the first lookup, which is not thread safe (concurrent first lookups
+    on a MultiIndex can raise KeyError or return the wrong columns). Returns the table.
+    """
+    for index in (table.index, table.columns):
+        if len(index):
+            index.get_loc(index[0])
+    return table
+
+
+def genre_order(stats, feature, stat='mean', ascending=False):
+    """
+    Returns the genres sorted by one statistic of the table, e.g. for ``category_orders``.
+    """
+    return stats[(feature, stat)].sort_values(ascending=ascending).index.tolist()
+
+
+def build_box_summary(df, feature, stats, max_outliers=50):
+    """
+    Summarises the distribution of a feature per genre for a precomputed box plot.
+
+    Quartiles come from the genre statistics table. Whiskers follow Tukey's rule: they
+    end at the most extreme values within 1.5 IQR of the box. Values beyond the whiskers
+    are outliers; at most ``max_outliers`` of them are kept per genre, evenly spaced in
+    rank so that the sample always includes the extremes and is identical between runs.
+
+    Args:
+        df: The tracks DataFrame.
+        feature: The numeric column to summarise.
+        stats: The table returned by ``build_genre_stats`` for the same frame.
+        max_outliers: Maximum number of outliers kept per genre.
+
+    Returns:
+        A DataFrame indexed by genre with ``q1``, ``median``, ``q3``, ``mean``, ``lowerfence``,
+        ``upperfence`` and ``outliers`` (an array of values) columns.
+    """
+    q1 = stats[(feature, 'q1')].to_numpy()
+    q3 = stats[(feature, 'q3')].to_numpy()
+    iqr = q3 - q1
+    n_genres = len(stats)
+
+    codes = pd.Categorical(df[GENRE_COLUMN], categories=stats.index).codes
+    values = df[feature].to_numpy(dtype='float64')
+    valid = (codes >= 0) & ~np.isnan(values)
+    codes, values = codes[valid], values[valid]
+
+    inside = (values >= (q1 - 1.5 * iqr)[codes]) & (values <= (q3 + 1.5 * iqr)[codes])
+    whiskers = pd.DataFrame({'code': codes[inside], 'value': values[inside]}).groupby('code')['value']
+    lowerfence = whiskers.min().reindex(range(n_genres)).to_numpy()
+    upperfence = whiskers.max().reindex(range(n_genres)).to_numpy()
+
+    out_codes, out_values = codes[~inside], values[~inside]
+    order = np.lexsort((out_values, out_codes))
+    out_codes, out_values = out_codes[order], out_values[order]
+    bounds = np.searchsorted(out_codes, np.arange(n_genres + 1))
+    outliers = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        group = out_values[start:stop]
+        if len(group) > max_outliers:
+            group = group[np.linspace(0, len(group) - 1, max_outliers).round().astype(int)]
+        outliers.append(group)
+
+    return pd.DataFrame({
+        'q1': q1,
+        'median': stats[(feature, 'median')].to_numpy(),
+        'q3': q3,
+        'mean': stats[(feature, 'mean')].to_numpy(),
+        'lowerfence': np.where(np.isnan(lowerfence), q1, lowerfence),
+        'upperfence': np.where(np.isnan(upperfence), q3, upperfence),
+        'outliers': outliers,
+    }, index=stats.index)
+
+
+def density_grid(df, x, y, bins=100, x_range=None, y_range=None):
+    """
+    Counts tracks on a regular 2D grid with one vectorised histogram.
+
+    Args:
+        df: The tracks DataFrame.
+        x: Column on the horizontal axis.
+        y: Column on the vertical axis.
+        bins: Number of bins per axis.
+        x_range: ``(min, max)`` of the grid on x; tracks outside are ignored. Defaults to the data range.
+        y_range: Same as ``x_range`` for y.
+
+    Returns:
+        A dict with the bin centers ``x`` and ``y``, the counts ``z`` (one row per y bin, as
+        Plotly heatmaps expect) and the ``x_range``/``y_range`` that were used.
+    """
+    x_values = df[x].to_numpy(dtype='float64')
+    y_values = df[y].to_numpy(dtype='float64')
+    valid = ~(np.isnan(x_values) | np.isnan(y_values))
+    x_values, y_values = x_values[valid], y_values[valid]
+
+    def data_range(values):
+        return (float(values.min()), float(values.max())) if len(values) else (0.0, 1.0)
+
+    x_range = tuple(map(float, x_range)) if x_range is not None else data_range(x_values)
+    y_range = tuple(map(float, y_range)) if y_range is not None else data_range(y_values)
+    counts, x_edges, y_edges = np.histogram2d(x_values, y_values, bins=bins, range=[x_range, y_range])
+
+    return {
+        'x': (x_edges[:-1] + x_edges[1:]) / 2,
+        'y': (y_edges[:-1] + y_edges[1:]) / 2,
+        'z': counts.T.astype('int64'),
+        'x_range': list(x_range),
+        'y_range': list(y_range),
+    }
+
+
+def stratified_sample(df, columns, per_group, seed=0, by=GENRE_COLUMN):
+    """
+    Draws up to ``per_group`` random tracks from every group, deterministically.
+
+    Rows are shuffled once with a seeded generator and the first ``per_group`` rows of each
+    group are kept, so the sample is identical between runs and workers.
+
+    Returns:
+        A DataFrame with ``columns`` and the ``by`` column, in original row order.
+    """
+    order = np.random.default_rng(seed).permutation(len(df))
+    codes = pd.Categorical(df[by]).codes[order]
+    rank = pd.Series(codes).groupby(codes).cumcount().to_numpy()
+    keep = np.sort(order[rank < per_group])
+    return df.iloc[keep][list(dict.fromkeys(list(columns) + [by]))]
+
+
+def select_genres(table, genres=None):
+    """
+    Restricts a per-genre table to ``genres``, keeping its order (all genres when None).
+    """
+    if genres is None:
+        return table
+    return table[table.index.isin(list(genres))]
+
+
+def histogram(df, feature, bins=50, value_range=None):
+    """
+    Counts the values of a feature on ``bins`` equal-width bins.
+
+    Args:
+        df: The tracks DataFrame.
+        feature: The numeric column.
+        bins: Number of bins.
+        value_range: ``(min, max)`` of the bins. Defaults to ``FEATURE_RANGES`` for known
+            features and to the data range otherwise.
+
+    Returns:
+        A dict with the bin ``edges`` and the ``counts``.
+    """
+    values = df[feature].to_numpy(dtype='float64')
+    values = values[~np.isnan(values)]
+    if value_range is None:
+        value_range = FEATURE_RANGES.get(feature) or ((values.min(), values.max()) if len(values) else (0, 1))
+    counts, edges = np.histogram(values, bins=bins, range=tuple(map(float, value_range)))
+    return {'edges': edges, 'counts': counts}
+
+
+DISTRIBUTION_MODES = ('fixed', 'adaptive')
+
+# Groupings of a distribution (see distribution_counts)
+DISTRIBUTION_GROUPS = ('genre', 'explicit')
+
+# Rows binned at once by build_distributions, bounding its temporary arrays
+DISTRIBUTION_CHUNK_ROWS = 1_000_000
+
+
+def distribution_edges(values, bins=50, mode='fixed', value_range=None):
+    """
+    Returns the bin edges of a feature.
+
+    Args:
+        values: The feature values (NaN ignored).
+        bins: Number of bins.
+        mode: ``'fixed'``: equal-width bins over ``value_range``, by default FEATURE_RANGES
+            or the data range (as ``histogram``); ``'adaptive'``: bins at the quantiles of
+            the values, holding about as many tracks each (bins of tied values merge, so
+            there may be fewer).
+        value_range: ``(min, max)`` of fixed bins.
+    """
+    values = values[~np.isnan(values)]
+    if mode == 'adaptive':
+        if not len(values):
+            return np.array([0.0, 1.0])
+        edges = np.unique(np.quantile(values, np.linspace(0, 1, bins + 1)))
+        return edges if len(edges) > 1 else np.array([edges[0], edges[0] + 1.0])
+    if value_range is None:
+        value_range = (values.min(), values.max()) if len(values) else (0, 1)
+    low, high = map(float, value_range)
+    if low == high:
+        low, high = low - 0.5, high + 0.5  # As np.histogram
+    return np.linspace(low, high, bins + 1)
+
+
+def bin_indices(values, edges, uniform=True):
+    """
+    Returns the bin of each value, -1 when it is NaN or outside the edges. The last bin
+    includes its right edge, as in ``np.histogram``.
+    """
+    bins = len(edges) - 1
+    if uniform:
+        # Same arithmetic and edge corrections as np.histogram, so the counts match it exactly
+        with np.errstate(invalid='ignore'):
+            scaled = (values - edges[0]) * (bins / (edges[-1] - edges[0]))
+            indices = np.where(np.isnan(scaled), -1, np.floor(np.nan_to_num(scaled, nan=-1.0))).astype('int64')
+        indices[indices == bins] = bins - 1
+        inside = (indices >= 0) & (indices < bins)
+        checked = np.clip(indices, 0, bins - 1)
+        indices[inside & (values < edges[checked])] -= 1
+        indices[inside & (values >= edges[checked + 1]) & (indices != bins - 1)] += 1
+    else:
+        indices = np.searchsorted(edges, values, side='right') - 1
+        indices[values == edges[-1]] = bins - 1
+    with np.errstate(invalid='ignore'):
+        indices[~((values >= edges[0]) & (values <= edges[-1]))] = -1
+    return indices
+
+
+def build_distributions(df, features, bins=50, mode='fixed', edges=None):
+    """
+    Counts every feature on its bins (see ``distribution_edges``), or on the given ``edges``
+    (one array per feature, e.g. those of another table), split by genre and by the explicit
+    flag.
+
+    All the features are counted with a single ``np.bincount`` per chunk of rows, over one
+    code per (feature, genre, explicit, bin).
+
+    Returns:
+        A dict with ``features``, their ``edges`` (one array each), the ``genres`` and
+        ``counts``: an int64 array of shape (features, genres, 2, bins), the third axis being
+        not explicit / explicit. Features with fewer bins (adaptive mode) are zero-padded.
+    """
+    codes, genres = pd.factorize(df[GENRE_COLUMN], sort=True)
+    genres = pd.Index(np.asarray(genres).astype(str))
+    explicit = df['explicit'].to_numpy(dtype=bool) if 'explicit' in df.columns else np.zeros(len(df), dtype=bool)
+    groups = codes.astype('int64') * 2 + explicit
+    n_groups = len(genres) * 2
+
+    columns = [df[feature].to_numpy(dtype='float64', na_value=np.nan) for feature in features]
+    if edges is None:
+        edges = [distribution_edges(values, bins, mode, FEATURE_RANGES.get(feature) if mode == 'fixed' else None)
+                 for feature, values in zip(features, columns)]
+    size = len(features) * n_groups * bins
+    counts = np.zeros(size, dtype='int64')
+    for start in range(0, len(df), DISTRIBUTION_CHUNK_ROWS):
+        stop = start + DISTRIBUTION_CHUNK_ROWS
+        chunk_groups = groups[start:stop]
+        chunk_codes = []
+        for index, (values, feature_edges) in enumerate(zip(columns, edges)):
+            bin_index = bin_indices(values[start:stop], feature_edges, uniform=mode == 'fixed')
+            valid = (bin_index >= 0) & (chunk_groups >= 0)
+            chunk_codes.append(((index * n_groups + chunk_groups[valid]) * bins + bin_index[valid]))
+        if chunk_codes:
+            counts += np.bincount(np.concatenate(chunk_codes), minlength=size)
+    return {'features': list(features), 'edges': edges, 'genres': genres,
+            'counts': counts.reshape(len(features), len(genres), 2, bins)}
+
+
+def merge_distributions(table, added):
+    """
+    Adds the counts of ``added``, built on the same features and edges, to those of
+    ``table``; genres of either are kept. Returns a new table.
+    """
+    genres = table['genres'].union(added['genres'])
+    shape = table['counts'].shape
+    counts = np.zeros((shape[0], len(genres)) + shape[2:], dtype='int64')
+    counts[:, genres.get_indexer(table['genres'])] += table['counts']
+    counts[:, genres.get_indexer(added['genres'])] += added['counts']
+    return {**table, 'genres': genres, 'counts': counts}
+
+
+def distribution_counts(table, feature, by=None, genres=None):
+    """
+    Extracts the distribution of one feature from a ``build_distributions`` table.
+
+    Args:
+        table: The table.
+        feature: One of its features.
+        by: None for one group of all tracks, ``'genre'`` for one group per genre, or
+            ``'explicit'`` for the non-explicit and explicit tracks.
+        genres: Genres to count, all when None.
+
+    Returns:
+        A dict with the bin ``edges``, the group ``names`` and the ``counts`` (groups x bins).
+    """
+    index = table['features'].index(feature)
+    edges = table['edges'][index]
+    counts = table['counts'][index, :, :, :len(edges) - 1]
+    names = table['genres']
+    if genres is not None:
+        keep = names.get_indexer(list(genres))
+        keep = keep[keep >= 0]
+        counts, names = counts[keep], names[keep]
+    if by == 'genre':
+        return {'edges': edges, 'names': list(names), 'counts': counts.sum(axis=1)}
+    if by == 'explicit':
+        return {'edges': edges, 'names': ['not explicit', 'explicit'], 'counts': counts.sum(axis=0)}
+    return {'edges': edges, 'names': ['all'], 'counts': counts.sum(axis=(0, 1))[None, :]}
+
+
+def top_tracks(df, top_n=10):
+    """
+    Returns the ``top_n`` most popular tracks (first occurrence wins ties).
+    """
+    return df.nlargest(top_n, 'popularity')
@@ -0,0 +1,245 @@
+import hashlib
+import os
+import secrets
+import tempfile
+
+from flask import current_app
+
+from .locks import acquire_lock_file, release_lock_file
+
+
+class ArtifactCache:
+    """
+    Byte store shared by every worker, used as the second cache tier for charts.
+
+    Keys already contain the dataset fingerprint, so entries never go stale; they only
+    need to be evicted to bound the space used.
+    """
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def acquire(self, name, timeout):
+        """
+        Takes the lock ``name`` shared by the workers for at most ``timeout`` seconds.
+
+        Returns an owner token, which ``release`` needs, or None when another worker holds
+        the lock. Backends without locks always grant it, so every worker computes (see
+        ``singleflight.shared_flight``).
+        """
+        return secrets.token_hex(16)
+
+    def release(self, name, token):
+        """
+        Releases a lock taken with ``acquire``, unless it expired and another worker took it.
+        """
+
+
+class FileSystemArtifactCache(ArtifactCache):
+    """
+    Stores artifacts as files in a directory shared by the workers of a host.
+
+    Writes go to a temporary file that is renamed into place, so readers never see a
+    partial artifact, even with several processes writing the same key. The modification
+    time of a file records its last use; when the directory grows past ``max_bytes``
+    the least recently used files are removed.
+
+    The size of the directory is tracked in memory from the writes of this process, so a
+    write does not scan the directory. It is measured again (counting the writes of the
+    other workers) when the estimate passes ``max_bytes`` and every RESCAN_WRITES writes.
+
+    Args:
+        directory: Directory holding the artifacts (created if needed).
+        max_bytes: Size above which the least recently used artifacts are evicted.
+    """
+
+    # Writes after which the size of the directory is measured again
+    RESCAN_WRITES = 200
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._size = None  # Estimated size of the artifacts, None until measured
+        self._writes = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)  # Mark as recently used
+        except FileNotFoundError:
+            pass
+        return value
+
+    def set(self, key, value):
+        path = self._path(key)
+        try:
+            replaced = os.path.getsize(path)
+        except FileNotFoundError:
+            replaced = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self._writes += 1
+        if self._size is not None:
+            self._size += len(value) - replaced
+        if self._size is None or self._size > self.max_bytes or self._writes >= self.RESCAN_WRITES:
+            self.evict()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+        self._size = 0
+
+    def acquire(self, name, timeout):
+        # A lock file holding the token; one older than the timeout was left by a worker
+        # that died and is taken over
+        return acquire_lock_file(self._path(name) + '.lock', timeout)
+
+    def release(self, name, token):
+        release_lock_file(self._path(name) + '.lock', token)
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(('.tmp', '.lock')):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def size(self):
+        """
+        Returns the total size of the stored artifacts in bytes.
+        """
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """
+        Removes the least recently used artifacts until the store fits in ``max_bytes``.
+        """
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            for _, size, path in sorted(entries):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                if total <= self.max_bytes:
+                    break
+        self._size, self._writes = total, 0
+
+
+# Deletes a lock only while it holds the token of the caller (KEYS[1]: lock, ARGV[1]: token)
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisArtifactCache(ArtifactCache):
+    """
+    Stores artifacts in Redis (or any server speaking its protocol).
+
+    Size bounds and LRU eviction are left to the server (``maxmemory`` with the
+    ``allkeys-lru`` policy).
+
+    Args:
+        client: A ``redis.Redis``-compatible client (``get``, ``set``, ``delete``, ``eval``,
+            ``scan_iter``).
+        prefix: Prefix of every key, so several deployments can share a server.
+    """
+
+    def __init__(self, client, prefix='music-insights:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        import redis  # Optional dependency, only needed for this backend
+
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, value)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def acquire(self, name, timeout):
+        # SET NX with an expiry: the lock of a worker that died expires by itself
+        token = secrets.token_hex(16)
+        if self.client.set(self.prefix + name, token, nx=True, px=int(timeout * 1000)):
+            return token
+        return None
+
+    def release(self, name, token):
+        # Compare and delete in one step: an expired lock now held by another worker is kept
+        self.client.eval(RELEASE_SCRIPT, 1, self.prefix + name, token)
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+def create_artifact_cache(config):
+    """
+    Builds the artifact cache described by the application config, or None when disabled.
+    """
+    backend = config.get('ARTIFACT_CACHE_TYPE')
+    if not backend:
+        return None
+    if backend == 'filesystem':
+        return FileSystemArtifactCache(config['ARTIFACT_CACHE_DIR'], config['ARTIFACT_CACHE_MAX_BYTES'])
+    if backend == 'redis':
+        return RedisArtifactCache.from_url(config['ARTIFACT_CACHE_REDIS_URL'])
+    raise ValueError(f"Unknown ARTIFACT_CACHE_TYPE '{backend}'")
+
+
+def get_artifact_cache():
+    """
+    Returns the artifact cache of the current application, or None.
+    """
+    return current_app.extensions.get('artifact_cache')
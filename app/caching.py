@@ -0,0 +1,238 @@
+import functools
+import hashlib
+import inspect
+import json
+import math
+import random
+import time
+
+from flask import current_app
+
+from . import cache
+from .artifacts import get_artifact_cache
+from .metrics import metrics
+from .serialization import encoder
+from .singleflight import SingleFlight, shared_flight
+from .snapshot import as_snapshot
+
+# Share of the timeout taken off each memory entry at random, so that entries stored
+# together (a dashboard computed at once) do not all expire at the same moment
+EXPIRY_JITTER = 0.1
+
+# A memory entry read after this share of its lifetime is refreshed in the background
+# while the current value is served, so entries in use do not expire
+REFRESH_AHEAD = 0.8
+
+# Seconds a worker may hold the shared lock of a chart it computes before the others
+# stop waiting for it
+CHART_LOCK_TIMEOUT = 60
+
+# Charts being computed in this process
+chart_flights = SingleFlight('chart')
+
+
+def normalize_params(params):
+    """
+    Returns a canonical JSON encoding of chart parameters.
+
+    Keys are sorted and list values (such as a genre subset) are de-duplicated and sorted,
+    so equivalent requests share a cache entry.
+    """
+    canonical = {}
+    for name, value in params.items():
+        if isinstance(value, (list, tuple, set, frozenset)):
+            value = sorted(set(value))
+        canonical[name] = value
+    return json.dumps(canonical, sort_keys=True, separators=(',', ':'), default=str)
+
+
+def chart_cache_key(name, version, params):
+    """
+    Builds the cache key of a chart from its name, the version of the data it reads, its
+    parameters and the figure encoding in use.
+    """
+    digest = hashlib.sha1(normalize_params(params).encode()).hexdigest()[:16]
+    return f"chart:{name}:{version}:{encoder.format}:{digest}"
+
+
+def encode_chart(result):
+    """
+    Serialises a chart result ``(graph_json, interpretation)`` for the artifact cache.
+    The figure JSON is stored as is, after a one-line header.
+    """
+    graph_json, interpretation = result
+    return json.dumps({'interpretation': interpretation}).encode() + b'\n' + graph_json.encode()
+
+
+def decode_chart(payload):
+    """
+    Reverses ``encode_chart``.
+    """
+    header, graph_json = payload.split(b'\n', 1)
+    return graph_json.decode(), json.loads(header)['interpretation']
+
+
+def jittered(timeout):
+    """
+    Returns ``timeout`` less a random share of up to EXPIRY_JITTER of it (0 stays 0: no expiry).
+    """
+    return timeout * (1 - EXPIRY_JITTER * random.random())
+
+
+def _remember(key, result, timeout):
+    # Stores a chart in the Flask cache along with the time after which it is refreshed
+    lifetime = jittered(timeout)
+    refresh_at = time.time() + REFRESH_AHEAD * lifetime if lifetime else math.inf
+    cache.set(key, (result, refresh_at), timeout=math.ceil(lifetime))
+
+
+def _lookup_chart(key, timeout):
+    # Returns the cached chart (or None) and whether it is due for a refresh
+    entry = cache.get(key)
+    metrics.cache_lookup('chart', 'memory', entry is not None)
+    if entry is not None:
+        result, refresh_at = entry
+        return result, time.time() >= refresh_at
+    return _lookup_shared_chart(key, timeout), False
+
+
+def _lookup_shared_chart(key, timeout):
+    artifacts = get_artifact_cache()
+    if artifacts is None:
+        return None
+    payload = artifacts.get(key)
+    metrics.cache_lookup('chart', 'shared', payload is not None)
+    if payload is None:
+        return None
+    result = decode_chart(payload)
+    _remember(key, result, timeout)
+    return result
+
+
+def lookup_chart(key, timeout=3600):
+    """
+    Returns a cached chart result, or None.
+
+    The per-process Flask cache is checked first, then the shared artifact cache; a hit in
+    the latter is copied into the former.
+    """
+    return _lookup_chart(key, timeout)[0]
+
+
+def store_chart(key, result, timeout=3600):
+    """
+    Stores a chart result in both cache tiers.
+
+    The Flask cache keeps it for a jittered ``timeout`` (see ``jittered``); the artifact
+    cache until it is evicted.
+    """
+    artifacts = get_artifact_cache()
+    if artifacts is not None:
+        artifacts.set(key, encode_chart(result))
+    _remember(key, result, timeout)
+
+
+def load_chart(key, compute, timeout=3600):
+    """
+    Returns the chart of ``key`` from the artifact cache, or computes and stores it, once.
+
+    Concurrent calls for the same key share one computation: the other threads of the
+    process wait for it (``chart_flights``) and the other workers for its result to appear
+    in the artifact cache (``singleflight.shared_flight``).
+
+    Args:
+        key: The chart cache key.
+        compute: Callable returning the chart result on a miss.
+        timeout: Lifetime of the entry in the Flask cache.
+    """
+    def compute_and_store():
+        result = compute()
+        store_chart(key, result, timeout)
+        return result
+
+    return chart_flights.run(key, lambda: shared_flight(
+        get_artifact_cache(), key, lambda: _lookup_shared_chart(key, timeout), compute_and_store, CHART_LOCK_TIMEOUT))
+
+
+def dataset_version(snapshot, params):
+    """
+    Default version of a chart's input: the fingerprint of the whole dataset.
+    """
+    return snapshot.fingerprint
+
+
+def genres_version(snapshot, params):
+    """
+    Version of a chart that only reads the genres of its ``genres`` parameter (all when None).
+    """
+    return snapshot.genres_version(params.get('genres'))
+
+
+def cached_chart(timeout=3600, version=dataset_version):
+    """
+    Caches the result of an ``analyze_*`` function per dataset version and arguments.
+
+    Unlike ``cache.cached(key_prefix=...)``, the key includes the version of the dataset
+    passed as first argument and every other argument (defaults included), so
+    ``analyze_music_features_by_genre(df, 'energy')`` never returns the danceability chart.
+    ``version(snapshot, params)`` gives that version: by default the dataset fingerprint, or
+    ``genres_version`` for charts reading only some genres, whose entries then survive
+    the ingestion of tracks of other genres.
+
+    Results are looked up in the per-process Flask cache first, then in the shared artifact
+    cache (see ``artifacts``) when the application has one, so a chart computed by one
+    worker is reused by the others and survives restarts.
+    Cache misses are timed per stage when metrics are enabled (see ``metrics.Metrics.chart``).
+    A chart missing from the caches is computed once however many requests ask for it at
+    the same time (see ``load_chart``), and a cached chart read late in its lifetime is
+    refreshed in the background, the cached value being returned meanwhile.
+    The undecorated function stays available as ``uncached``, ``data_version`` returns the
+    version a call depends on and ``cache_key`` the key it would use, so callers computing
+    charts elsewhere (see ``engine``) can share the same entries.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+        data_param = next(iter(signature.parameters))
+
+        def bind(data, *args, **kwargs):
+            snapshot = as_snapshot(data)
+            bound = signature.bind(snapshot, *args, **kwargs)
+            bound.apply_defaults()
+            params = {name: value for name, value in bound.arguments.items() if name != data_param}
+            return snapshot, params
+
+        def data_version(data, *args, **kwargs):
+            return version(*bind(data, *args, **kwargs))
+
+        def cache_key(data, *args, **kwargs):
+            snapshot, params = bind(data, *args, **kwargs)
+            return chart_cache_key(func.__name__, version(snapshot, params), params)
+
+        @functools.wraps(func)
+        def wrapper(data, *args, **kwargs):
+            snapshot = as_snapshot(data)
+            key = cache_key(snapshot, *args, **kwargs)
+
+            def compute():
+                with metrics.chart(func.__name__):
+                    return func(snapshot, *args, **kwargs)
+
+            result, refresh = _lookup_chart(key, timeout)
+            if result is None:
+                return load_chart(key, compute, timeout)
+            if refresh:
+                app = current_app._get_current_object()
+
+                def reload():
+                    with app.app_context():
+                        return load_chart(key, compute, timeout)
+
+                chart_flights.refresh(key, reload)
+            return result
+
+        wrapper.uncached = func
+        wrapper.data_version = data_version
+        wrapper.cache_key = cache_key
+        wrapper.timeout = timeout
+        return wrapper
+    return decorator
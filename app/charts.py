@@ -0,0 +1,198 @@
+import json
+import math
+from collections import namedtuple
+
+from . import models
+from .indexes import RowFilter
+
+# Parsers turn a raw query-string value into a normalised parameter, or raise ValueError.
+# They receive the current DatasetSnapshot to validate names against the data.
+
+
+def feature_param(value, snapshot):
+    if value not in snapshot.features:
+        raise ValueError(f"unknown feature '{value}'")
+    return value
+
+
+def genres_param(value, snapshot):
+    genres = sorted({genre.strip() for genre in value.split(',') if genre.strip()})
+    unknown = [genre for genre in genres if genre not in snapshot.genre_stats.index]
+    if unknown:
+        raise ValueError(f"unknown genres: {', '.join(unknown)}")
+    return genres or None
+
+
+def int_param(low, high):
+    def parse(value, snapshot):
+        number = int(value)
+        if not low <= number <= high:
+            raise ValueError(f"must be between {low} and {high}")
+        return number
+    return parse
+
+
+def choice_param(*choices):
+    def parse(value, snapshot):
+        if value not in choices:
+            raise ValueError(f"must be one of {', '.join(choices)}")
+        return value
+    return parse
+
+
+Chart = namedtuple('Chart', ['function', 'params'])
+
+GENRE_SUBSET = {'genres': genres_param}
+TOP_N = {'top_n': int_param(1, 500)}
+CORRELATION = {'method': choice_param('pearson', 'spearman')}
+DENSITY = {'mode': choice_param('density', 'points'), 'sample_per_genre': int_param(0, 1000)}
+
+# Every chart that can be requested from /api/charts/<name>, with the query parameters it accepts.
+CHARTS = {
+    'genre_popularity': Chart(models.analyze_genre_popularity, {**GENRE_SUBSET, **TOP_N}),
+    'music_features_by_genre': Chart(models.analyze_music_features_by_genre,
+                                     {'feature': feature_param, **GENRE_SUBSET, **TOP_N}),
+    'sales_correlations': Chart(models.analyze_sales_correlations, CORRELATION),
+    'explicit_content': Chart(models.analyze_explicit_content, GENRE_SUBSET),
+    'duration_by_genre': Chart(models.analyze_duration_by_genre, GENRE_SUBSET),
+    'feature_correlation_heatmap': Chart(models.analyze_feature_correlation_heatmap, CORRELATION),
+    'tempo_by_genre': Chart(models.analyze_tempo_by_genre, GENRE_SUBSET),
+    'energy_vs_danceability': Chart(models.analyze_energy_vs_danceability, DENSITY),
+    'popularity_over_time': Chart(models.analyze_popularity_over_time, {}),
+    'top_artists_by_popularity': Chart(models.analyze_top_artists_by_popularity,
+                                       {**TOP_N, **GENRE_SUBSET, 'min_tracks': int_param(1, 10000)}),
+    'valence_vs_popularity': Chart(models.analyze_valence_vs_popularity, DENSITY),
+    'top_popular_tracks': Chart(models.analyze_top_popular_tracks, TOP_N),
+    'energy_by_genre': Chart(models.analyze_energy_by_genre, GENRE_SUBSET),
+    'loudness_vs_energy': Chart(models.analyze_loudness_vs_energy, DENSITY),
+    'acousticness_distribution': Chart(models.analyze_acousticness_distribution, {}),
+}
+
+
+# Charts shown on /dashboard, in page order, with the parameters they are shown with.
+DASHBOARD_CHARTS = [
+    ('genre_popularity', {}),
+    ('music_features_by_genre', {'feature': 'danceability'}),
+    ('sales_correlations', {}),
+    ('explicit_content', {}),
+    ('duration_by_genre', {}),
+    ('feature_correlation_heatmap', {}),
+    ('tempo_by_genre', {}),
+    ('energy_vs_danceability', {}),
+    ('popularity_over_time', {}),
+    ('top_artists_by_popularity', {}),
+    ('valence_vs_popularity', {}),
+    ('top_popular_tracks', {}),
+    ('energy_by_genre', {}),
+    ('loudness_vs_energy', {}),
+    ('acousticness_distribution', {}),
+]
+
+
+class ChartParameterError(ValueError):
+    """
+    Raised when a chart is requested with an unknown or invalid parameter.
+    """
+
+
+# Row filter parameters accepted by every chart besides its own (see parse_filter)
+FILTER_PARAMS = ('genre', 'explicit')
+RANGE_SUFFIXES = ('_min', '_max')
+
+
+def is_filter_param(param):
+    return param in FILTER_PARAMS or param.endswith(RANGE_SUFFIXES)
+
+
+def parse_filter(args, snapshot):
+    """
+    Builds the row filter of a request from its filter parameters.
+
+    ``genre`` is a comma-separated list of genres, ``explicit`` is ``true`` or ``false``, and
+    ``<feature>_min`` / ``<feature>_max`` bound a numeric feature (inclusive, finite), e.g.
+    ``?genre=pop&explicit=true&popularity_min=71``. Empty values are ignored.
+
+    Returns:
+        An ``indexes.RowFilter``, or None when the request has no filter parameters.
+    """
+    genres, explicit, bounds = None, None, {}
+    for param, value in args.items():
+        if not is_filter_param(param) or value == '':
+            continue
+        try:
+            if param == 'genre':
+                genres = genres_param(value, snapshot)
+            elif param == 'explicit':
+                if value.lower() not in ('true', 'false', '1', '0'):
+                    raise ValueError("must be true or false")
+                explicit = value.lower() in ('true', '1')
+            else:
+                feature, bound = param[:-4], param[-3:]
+                feature_param(feature, snapshot)
+                number = float(value)
+                if not math.isfinite(number):
+                    raise ValueError("must be a finite number")
+                bounds.setdefault(feature, [-math.inf, math.inf])[bound == 'max'] = number
+        except ValueError as e:
+            raise ChartParameterError(f"{param}: {e}") from e
+
+    if genres is None and explicit is None and not bounds:
+        return None
+    return RowFilter(genres, explicit, [(feature, low, high) for feature, (low, high) in bounds.items()])
+
+
+def parse_chart_params(name, args, snapshot):
+    """
+    Validates and normalises the query parameters of a chart request.
+
+    Args:
+        name: The chart name, a key of CHARTS.
+        args: Mapping of raw parameter values (e.g. ``request.args``).
+        snapshot: The DatasetSnapshot the chart will be computed from.
+
+    Returns:
+        A dict of keyword arguments for the chart function. Parameters that are not given
+        are left out, so the function defaults apply. Row filter parameters are left to
+        ``parse_filter``.
+    """
+    parsers = CHARTS[name].params
+    unknown = sorted(param for param in set(args) - set(parsers) if not is_filter_param(param))
+    if unknown:
+        raise ChartParameterError(f"unknown parameters: {', '.join(unknown)}")
+
+    params = {}
+    for param, parse in parsers.items():
+        if param in args:
+            try:
+                value = parse(args[param], snapshot)
+            except ValueError as e:
+                raise ChartParameterError(f"{param}: {e}") from e
+            if value is not None:
+                params[param] = value
+    return params
+
+
+def chart_document(name, version, params, filters, tracks, graph_json, interpretation):
+    """
+    Builds the JSON body of a chart, as served by ``/api/charts/<name>`` and exported by
+    ``export``: its name, data version, parameters, row filters, number of tracks,
+    interpretation and figure.
+
+    Returns:
+        The body as bytes. The figure JSON is spliced in rather than parsed again.
+    """
+    body = '{"name":%s,"version":%s,"params":%s,"filter":%s,"tracks":%d,"interpretation":%s,"figure":%s}' % (
+        json.dumps(name), json.dumps(version), json.dumps(params), json.dumps(filters), tracks,
+        json.dumps(interpretation.strip()), graph_json)
+    return body.encode()
+
+
+def render_chart(name, snapshot, params=None):
+    """
+    Computes (or fetches from the cache) a chart by name.
+
+    Returns:
+        The figure JSON and the interpretation string.
+    """
+    return CHARTS[name].function(snapshot, **(params or {}))
+
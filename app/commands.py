@@ -0,0 +1,167 @@
+import os
+import time
+
+import click
+import pandas as pd
+from flask import current_app
+from flask.cli import with_appcontext
+
+from . import storage
+from .charts import DASHBOARD_CHARTS
+from .engine import EXECUTORS, ChartEngine, get_chart_engine
+from .export import export_dashboard
+from .registry import get_dataset, get_registry
+from .shared import is_shared_fresh, map_shared
+
+
+@click.command('warm-cache')
+@click.option('--workers', type=int, default=None, help="Charts computed at once (default: CHART_ENGINE_WORKERS).")
+@click.option('--executor', type=click.Choice(EXECUTORS), default=None,
+              help="Worker pool type (default: CHART_ENGINE_EXECUTOR).")
+@with_appcontext
+def warm_cache_command(workers, executor):
+    """
+    Computes every dashboard chart so that the cache is filled before traffic arrives.
+
+    With a shared artifact cache (ARTIFACT_CACHE_TYPE) the results are reused by every
+    worker, e.g. run ``flask --app run warm-cache`` before starting gunicorn.
+    Charts are computed concurrently by the chart engine (see ``engine.ChartEngine``).
+    """
+    default = get_chart_engine()
+    engine = ChartEngine(workers or default.max_workers, executor or default.executor, default.timeout)
+
+    snapshot = get_dataset()
+    start = time.perf_counter()
+    failed = 0
+    for result in engine.render(snapshot, DASHBOARD_CHARTS):
+        if result.error is None:
+            click.echo(f"{result.name:<30}{result.seconds:>8.2f}s")
+        else:
+            failed += 1
+            click.echo(f"{result.name:<30}  failed: {result.error}", err=True)
+    click.echo(f"Warmed {len(DASHBOARD_CHARTS) - failed} charts for dataset {snapshot.fingerprint} "
+               f"in {time.perf_counter() - start:.2f}s")
+    if failed:
+        raise click.exceptions.Exit(1)
+
+
+@click.command('ingest')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--warm/--no-warm', default=True,
+              help="Compute the dashboard charts of the new dataset version in the shared cache.")
+@with_appcontext
+def ingest_command(paths, warm):
+    """
+    Adds batches of new tracks (CSV or Parquet files with the dataset columns).
+
+    Every file is validated against the schema before any is stored. The batches are saved
+    to DATASET_DELTA_DIR, where the running workers pick them up within DATASET_DELTA_POLL
+    seconds and update their data incrementally, without a restart.
+    """
+    registry = get_registry()
+    if not registry.delta_dir:
+        raise click.UsageError("DATASET_DELTA_DIR is not set")
+    batches = []
+    for path in paths:
+        try:
+            batches.append(storage.read_batch(path))
+        except storage.SchemaError as e:
+            raise click.ClickException(f"{path}: {e}")
+
+    for path, batch in zip(paths, batches):
+        genres = sorted(batch['track_genre'].astype(str).unique())
+        if warm:
+            registry.append(batch)
+        else:
+            storage.write_delta(batch, registry.delta_dir)
+        click.echo(f"{path}: {len(batch)} tracks in {len(genres)} genres ({', '.join(genres[:5])}"
+                   f"{', ...' if len(genres) > 5 else ''})")
+
+    if warm:
+        snapshot = get_dataset()
+        results = get_chart_engine().render(snapshot, DASHBOARD_CHARTS)
+        failed = [result.name for result in results if result.error is not None]
+        click.echo(f"Dataset {snapshot.fingerprint}: {len(snapshot)} tracks, "
+                   f"{len(results) - len(failed)} dashboard charts warmed")
+        if failed:
+            click.echo(f"Failed charts: {', '.join(failed)}", err=True)
+
+
+@click.command('export-static')
+@click.option('--output', default='build/dashboard', show_default=True, type=click.Path(file_okay=False),
+              help="Directory of the export; a previous export there is updated.")
+@click.option('--workers', type=int, default=None, help="Charts computed at once (default: CHART_ENGINE_WORKERS).")
+@click.option('--executor', type=click.Choice(EXECUTORS), default='process', show_default=True,
+              help="Worker pool type.")
+@click.option('--force', is_flag=True, help="Export every chart, even those whose inputs did not change.")
+@click.option('--prune', is_flag=True, help="Delete the chart files of previous exports.")
+@with_appcontext
+def export_static_command(output, workers, executor, force, prune):
+    """
+    Exports the dashboard as static files (see ``export.export_dashboard``): one
+    content-hashed, pre-compressed JSON file per chart, the dashboard shell and a manifest.
+
+    Only the charts whose inputs changed since the previous export are computed.
+    """
+    default = get_chart_engine()
+    engine = ChartEngine(workers or default.max_workers, executor, default.timeout)
+    snapshot = get_dataset()
+    start = time.perf_counter()
+    manifest = export_dashboard(snapshot, output, engine, force=force, prune=prune)
+    for failure in manifest['failed']:
+        click.echo(f"{failure['id']}  failed: {failure['error']}", err=True)
+    click.echo(f"Dataset {snapshot.fingerprint}: {len(manifest['exported'])} charts exported, "
+               f"{len(manifest['unchanged'])} unchanged, to {output} in {time.perf_counter() - start:.2f}s")
+    if manifest['failed']:
+        raise click.exceptions.Exit(1)
+
+
+@click.command('memory-report')
+@with_appcontext
+def memory_report_command():
+    """
+    Shows the bytes used by each column of the served dataset, next to a plain
+    ``pd.read_csv`` of DATASET_PATH (see ``storage.memory_report``).
+    """
+    snapshot = get_dataset()
+    path = current_app.config['DATASET_PATH']
+    before = pd.read_csv(path) if os.path.exists(path) else snapshot.frame.head(0)
+    report = storage.memory_report(before, snapshot.frame)
+    click.echo(report.to_string())
+    if current_app.config['DATASET_STREAMING']:
+        click.echo("DATASET_STREAMING is on: 'after' is the reservoir sample only", err=True)
+
+
+@click.command('publish-dataset')
+@with_appcontext
+def publish_dataset_command():
+    """
+    Rewrites the dataset file shared by the workers (DATASET_SHARED_PATH), aggregates included.
+
+    Workers write it themselves when it is missing or older than DATASET_PATH; run this
+    command before starting them so that none has to; workers starting meanwhile wait for
+    it. Running workers keep the version they mapped until they reload.
+    """
+    shared = current_app.extensions.get('shared_dataset')
+    if shared is None:
+        raise click.UsageError("DATASET_SHARED_PATH is not set (or DATASET_STREAMING is on)")
+    start = time.perf_counter()
+    with shared.publish_lock() as waited:
+        if waited and is_shared_fresh(shared.path, shared.source()):
+            # A starting worker has just written it from the same source
+            snapshot = map_shared(shared.path)
+            click.echo(f"Dataset {snapshot.fingerprint}: {shared.path} was just written by a worker")
+            return
+        snapshot = shared.publish()
+    if snapshot is None:
+        raise click.ClickException("The dataset could not be loaded")
+    click.echo(f"Dataset {snapshot.fingerprint}: {len(snapshot)} tracks written to {shared.path} "
+               f"({os.path.getsize(shared.path) / 1e6:.1f} MB) in {time.perf_counter() - start:.2f}s")
+
+
+def init_app(app):
+    app.cli.add_command(warm_cache_command)
+    app.cli.add_command(ingest_command)
+    app.cli.add_command(export_static_command)
+    app.cli.add_command(memory_report_command)
+    app.cli.add_command(publish_dataset_command)
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+
+from .aggregates import numeric_features
+
+METHODS = ('pearson', 'spearman')
+
+
+class CorrelationStats:
+    """
+    Running sufficient statistics of the pairwise Pearson correlations of some columns.
+
+    For every pair of columns (i, j) it keeps, over the rows where both are present, the
+    count and the sums of x_i, x_i² and x_i·x_j. These sums are additive, so a batch of new
+    rows is folded in with ``update`` in O(new rows), without rescanning the history, and
+    ``pearson`` gives the same matrix as ``DataFrame.corr()`` (pairwise complete rows).
+
+    Values are shifted by the means of the first batch before being summed, which keeps the
+    sums small and the result accurate in float64.
+
+    Args:
+        columns: Names of the columns.
+        shift: Value subtracted from each column before summing.
+    """
+
+    def __init__(self, columns, shift):
+        k = len(columns)
+        self.columns = list(columns)
+        self.shift = np.asarray(shift, dtype='float64')
+        self.count = np.zeros((k, k))           # rows where both i and j are present
+        self.sum = np.zeros((k, k))             # sum of x_i over those rows
+        self.sum_squares = np.zeros((k, k))     # sum of x_i² over those rows
+        self.sum_products = np.zeros((k, k))    # sum of x_i·x_j
+
+    @classmethod
+    def from_frame(cls, df, columns=None):
+        """
+        Builds the statistics of ``columns`` (all numeric columns by default) of a DataFrame.
+        """
+        columns = numeric_features(df) if columns is None else list(columns)
+        shift = np.nan_to_num(df[columns].mean().to_numpy(dtype='float64'))
+        return cls(columns, shift).update(df)
+
+    def copy(self):
+        other = CorrelationStats(self.columns, self.shift)
+        other.count, other.sum = self.count.copy(), self.sum.copy()
+        other.sum_squares, other.sum_products = self.sum_squares.copy(), self.sum_products.copy()
+        return other
+
+    def update(self, df):
+        """
+        Adds the rows of a DataFrame having the same columns. Returns self.
+        """
+        values = df[self.columns].to_numpy(dtype='float64', na_value=np.nan) - self.shift
+        present = ~np.isnan(values)
+        values = np.where(present, values, 0.0)
+        mask = present.astype('float64')
+
+        self.count += mask.T @ mask
+        self.sum += values.T @ mask
+        self.sum_squares += (values * values).T @ mask
+        self.sum_products += values.T @ values
+        return self
+
+    def updated(self, df):
+        """
+        Returns new statistics including the rows of ``df``; these are left unchanged.
+        """
+        return self.copy().update(df)
+
+    def merge(self, other):
+        """
+        Returns the statistics of the union of the rows of two instances.
+        """
+        if other.columns != self.columns:
+            raise ValueError("Cannot merge correlation statistics of different columns")
+        merged = self.copy()
+        # Sums around other.shift are moved to self.shift: x - a = (x - b) + (b - a)
+        delta = other.shift - self.shift
+        d_i = delta[:, None]
+        d_j = delta[None, :]
+        merged.count += other.count
+        merged.sum += other.sum + d_i * other.count
+        merged.sum_squares += other.sum_squares + 2 * d_i * other.sum + d_i ** 2 * other.count
+        merged.sum_products += other.sum_products + d_i * other.sum.T + d_j * other.sum + d_i * d_j * other.count
+        return merged
+
+    def pearson(self):
+        """
+        Returns the Pearson correlation matrix as a DataFrame (NaN where undefined).
+        """
+        n = self.count
+        covariance = n * self.sum_products - self.sum * self.sum.T
+        variance_i = n * self.sum_squares - self.sum ** 2
+        variance_j = variance_i.T
+        with np.errstate(invalid='ignore', divide='ignore'):
+            corr = covariance / np.sqrt(variance_i * variance_j)
+        corr = np.clip(corr, -1, 1)
+        corr[(n < 2) | (variance_i <= 0) | (variance_j <= 0)] = np.nan
+        np.fill_diagonal(corr, np.where(np.diag(variance_i) > 0, 1.0, np.nan))
+        return pd.DataFrame(corr, index=self.columns, columns=self.columns)
+
+
+def spearman(df, columns=None):
+    """
+    Returns the Spearman rank correlation matrix of ``columns`` (all numeric columns by default).
+
+    Ranks change globally when rows are added, so unlike Pearson this is recomputed from the
+    whole frame: it is the Pearson correlation of the (average) ranks.
+    """
+    columns = numeric_features(df) if columns is None else list(columns)
+    ranks = df[columns].rank()
+    return CorrelationStats.from_frame(ranks, columns).pearson()
@@ -0,0 +1,168 @@
+import os
+import time
+from collections import namedtuple
+from functools import lru_cache
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import plotly.express as px
+from flask import current_app
+
+from .caching import lookup_chart, store_chart
+from .charts import CHARTS
+from .metrics import metrics
+
+# Outcome of one chart job. Exactly one of graph_json (with interpretation) and error is set.
+ChartResult = namedtuple('ChartResult', ['name', 'params', 'graph_json', 'interpretation', 'error', 'seconds'])
+
+EXECUTORS = ('thread', 'process')
+
+# Snapshot of the current process pool worker, set once by _init_worker
+_worker_snapshot = None
+
+
+def _init_worker(snapshot):
+    global _worker_snapshot
+    _worker_snapshot = snapshot
+
+
+@lru_cache(maxsize=None)
+def _prepare_plotly():
+    # plotly.express reads the shared default template through child objects built on first
+    # access, which fails when two threads get there at once: build them before the threads start
+    px.scatter(x=[0], y=[0])
+    px.bar(x=[0], y=[0])
+
+
+def _run_in_worker(name, params):
+    return _run(_worker_snapshot, name, params)
+
+
+def _run(snapshot, name, params):
+    # Workers compute without touching the caches, which belong to the application
+    start = time.perf_counter()
+    function = CHARTS[name].function
+    with metrics.chart(function.__name__):
+        result = function.uncached(snapshot, **params)
+    return result, time.perf_counter() - start
+
+
+class ChartEngine:
+    """
+    Computes several charts concurrently on a pool of workers.
+
+    Charts already in the cache are returned directly; the others are computed by the pool
+    and stored in both cache tiers, so they are shared with ``/api/charts/<name>``.
+
+    A job failing or running longer than ``timeout`` seconds does not affect the others: it
+    is reported as a ``ChartResult`` with an ``error``. A timed-out job cannot be stopped;
+    its result is discarded.
+
+    Args:
+        max_workers: Size of the pool (defaults to the number of CPUs).
+        executor: ``'thread'`` suits the numpy/pandas aggregations, which release the GIL;
+            ``'process'`` also parallelises the pure-Python figure building and serialisation,
+            at the cost of sending the dataset once to every worker.
+        timeout: Seconds a job may run once started, or None for no limit.
+    """
+
+    poll_interval = 0.05
+
+    def __init__(self, max_workers=None, executor='thread', timeout=None):
+        if executor not in EXECUTORS:
+            raise ValueError(f"executor must be one of {', '.join(EXECUTORS)}")
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.executor = executor
+        self.timeout = timeout
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get('CHART_ENGINE_WORKERS'), config.get('CHART_ENGINE_EXECUTOR', 'thread'),
+                   config.get('CHART_ENGINE_TIMEOUT'))
+
+    def _pool(self, snapshot, n_jobs):
+        workers = min(self.max_workers, n_jobs)
+        if self.executor == 'process':
+            return ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(snapshot,))
+        _prepare_plotly()
+        return ThreadPoolExecutor(workers, thread_name_prefix='chart-engine')
+
+    def _submit(self, pool, snapshot, name, params):
+        if self.executor == 'process':
+            return pool.submit(_run_in_worker, name, params)
+        return pool.submit(_run, snapshot, name, params)
+
+    def render(self, snapshot, jobs):
+        """
+        Computes (or fetches from the cache) a list of charts.
+
+        Args:
+            snapshot: The DatasetSnapshot to compute the charts from.
+            jobs: ``(name, params)`` pairs, e.g. ``charts.DASHBOARD_CHARTS``.
+
+        Returns:
+            A list of ChartResult, in the order of ``jobs``.
+        """
+        results = [None] * len(jobs)
+        missing = {}
+        for index, (name, params) in enumerate(jobs):
+            if name not in CHARTS:
+                results[index] = ChartResult(name, params, None, None, f"unknown chart '{name}'", 0.0)
+                continue
+            function = CHARTS[name].function
+            key = function.cache_key(snapshot, **params)
+            cached = lookup_chart(key, function.timeout)
+            if cached is not None:
+                results[index] = ChartResult(name, params, *cached, None, 0.0)
+            else:
+                missing[index] = key
+
+        if missing:
+            self._compute(snapshot, jobs, missing, results)
+        return results
+
+    def _compute(self, snapshot, jobs, missing, results):
+        pool = self._pool(snapshot, len(missing))
+        try:
+            pending = {self._submit(pool, snapshot, *jobs[index]): index for index in missing}
+            started = {}
+            while pending:
+                done, _ = wait(pending, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                now = time.perf_counter()
+                for future in done:
+                    index = pending.pop(future)
+                    results[index] = self._collect(future, jobs[index], missing[index],
+                                                   now - started.get(future, now))
+                if self.timeout is None:
+                    continue
+                for future, index in list(pending.items()):
+                    if not future.running():
+                        continue  # Still queued: its time has not started
+                    started.setdefault(future, now)
+                    if now - started[future] > self.timeout:
+                        future.cancel()
+                        del pending[future]
+                        name, params = jobs[index]
+                        results[index] = ChartResult(name, params, None, None,
+                                                     f"timed out after {self.timeout}s", now - started[future])
+        finally:
+            # Do not wait for timed-out jobs; queued jobs are dropped
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _collect(self, future, job, key, waited):
+        name, params = job
+        try:
+            (graph_json, interpretation), seconds = future.result()
+        except BrokenProcessPool as e:
+            return ChartResult(name, params, None, None, f"worker process died: {e}", waited)
+        except Exception as e:
+            return ChartResult(name, params, None, None, f"{type(e).__name__}: {e}", waited)
+        store_chart(key, (graph_json, interpretation), CHARTS[name].function.timeout)
+        return ChartResult(name, params, graph_json, interpretation, None, seconds)
+
+
+def get_chart_engine():
+    """
+    Returns the chart engine of the current application.
+    """
+    return current_app.extensions['chart_engine']
@@ -0,0 +1,162 @@
+"""
+Static export of the dashboard, to serve it from a CDN or any static file server without
+a Python process.
+
+``export_dashboard`` writes to an output directory:
+
+* ``charts/<name>.<hash>.json``: the body ``/api/charts/<name>`` would return for each
+  dashboard chart, named after a hash of its content, with ``.gz`` (and ``.br`` when brotli
+  is installed) siblings compressed once, as read by ``gzip_static``-style servers. The
+  files never change, so they can be cached forever;
+* ``dashboard.html``: the dashboard shell linking these files, to be served with
+  ``Cache-Control: no-cache`` (it changes with every export), and ``static/``, its assets;
+* ``manifest.json``: the dataset version and, for each chart, its parameters, cache key and
+  files.
+
+A chart whose cache key (chart, parameters, data version and figure encoding, see
+``caching.chart_cache_key``) is unchanged since the previous export is not computed
+again; the others are computed in parallel by a ``ChartEngine``. The files of previous
+exports are kept, so that shells already downloaded keep working, unless ``prune`` is set.
+"""
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+
+from flask import current_app, render_template
+
+from .caching import normalize_params
+from .charts import CHARTS, DASHBOARD_CHARTS, chart_document
+from .responses import available_encodings, compress, content_tag
+from .serialization import encoder
+
+MANIFEST = 'manifest.json'
+SHELL = 'dashboard.html'
+CHARTS_DIR = 'charts'
+EXTENSIONS = {'gzip': '.gz', 'br': '.br'}
+
+
+def _write(path, body):
+    # Atomic, so a server never reads a half-written file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(body)
+    os.replace(tmp_path, path)
+
+
+def _write_variants(path, body):
+    # Writes a file and its compressed variants; returns their paths by encoding
+    _write(path, body)
+    files = {'identity': path}
+    for encoding in available_encodings():
+        if encoding in EXTENSIONS:
+            files[encoding] = path + EXTENSIONS[encoding]
+            _write(files[encoding], compress(body, encoding))
+    return files
+
+
+def read_manifest(output_dir):
+    """
+    Returns the manifest of the export in ``output_dir``, or None.
+    """
+    try:
+        with open(os.path.join(output_dir, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _entry_id(name, params):
+    return f"{name}:{normalize_params(params)}"
+
+
+def _is_current(entry, key, output_dir):
+    return (entry is not None and entry['key'] == key and
+            all(os.path.exists(os.path.join(output_dir, path)) for path in entry['files'].values()))
+
+
+def export_dashboard(snapshot, output_dir, engine, jobs=DASHBOARD_CHARTS, force=False, prune=False):
+    """
+    Exports the dashboard charts and shell computed from ``snapshot`` to ``output_dir``.
+
+    Must run within an application context (the shell is rendered from its templates).
+
+    Args:
+        snapshot: The DatasetSnapshot to compute the charts from.
+        output_dir: The export directory; a previous export there is updated.
+        engine: The ``engine.ChartEngine`` computing the charts that changed.
+        jobs: ``(name, params)`` pairs of the exported charts, in page order.
+        force: Export every chart, changed or not.
+        prune: Delete the chart files no longer referenced by the manifest.
+
+    Returns:
+        The new manifest. Its ``exported``, ``unchanged`` and ``failed`` lists give the
+        chart entries written, skipped and failed by this export; a failed chart keeps the
+        files of the previous export, if any.
+    """
+    charts_dir = os.path.join(output_dir, CHARTS_DIR)
+    os.makedirs(charts_dir, exist_ok=True)
+    previous = {} if force else {entry['id']: entry for entry in (read_manifest(output_dir) or {}).get('charts', [])}
+
+    entries, changed, unchanged = [], {}, []
+    for name, params in jobs:
+        function = CHARTS[name].function
+        key = function.cache_key(snapshot, **params)
+        entry_id = _entry_id(name, params)
+        if _is_current(previous.get(entry_id), key, output_dir):
+            entries.append(previous[entry_id])
+            unchanged.append(entry_id)
+        else:
+            entries.append(None)
+            changed[len(entries) - 1] = (name, params, key)
+
+    exported, failed = [], []
+    results = engine.render(snapshot, [(name, params) for name, params, _ in changed.values()])
+    for (index, (name, params, key)), result in zip(changed.items(), results):
+        entry_id = _entry_id(name, params)
+        if result.error is not None:
+            failed.append({'id': entry_id, 'error': result.error})
+            entries[index] = previous.get(entry_id)
+            continue
+        version = CHARTS[name].function.data_version(snapshot, **params)
+        body = chart_document(name, version, params, {}, len(snapshot), result.graph_json, result.interpretation)
+        path = os.path.join(CHARTS_DIR, f"{name}.{content_tag(body)}.json")
+        files = _write_variants(os.path.join(output_dir, path), body)
+        entries[index] = {'id': entry_id, 'name': name, 'params': params, 'key': key, 'version': version,
+                          'bytes': len(body),
+                          'files': {encoding: os.path.relpath(file, output_dir) for encoding, file in files.items()}}
+        exported.append(entry_id)
+
+    urls = {entry['id']: entry['files']['identity'] for entry in entries if entry is not None}
+    _write_shell(output_dir, urls)
+
+    manifest = {
+        'dataset': snapshot.fingerprint,
+        'format': encoder.format,
+        'generated': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'shell': SHELL,
+        'charts': [entry for entry in entries if entry is not None],
+    }
+    _write(os.path.join(output_dir, MANIFEST), json.dumps(manifest, indent=2).encode())
+    if prune:
+        _prune(charts_dir, manifest)
+    return {**manifest, 'exported': exported, 'unchanged': unchanged, 'failed': failed}
+
+
+def _write_shell(output_dir, urls):
+    def chart_url(name, **params):
+        return urls.get(_entry_id(name, params), '')
+
+    with current_app.test_request_context('/dashboard'):
+        page = render_template(SHELL, chart_url=chart_url, static_export=True).encode()
+    _write_variants(os.path.join(output_dir, SHELL), page)
+    static_folder = current_app.static_folder
+    if static_folder and os.path.isdir(static_folder):
+        shutil.copytree(static_folder, os.path.join(output_dir, 'static'), dirs_exist_ok=True)
+
+
+def _prune(charts_dir, manifest):
+    referenced = {os.path.basename(path) for entry in manifest['charts'] for path in entry['files'].values()}
+    for filename in os.listdir(charts_dir):
+        if filename not in referenced:
+            os.remove(os.path.join(charts_dir, filename))
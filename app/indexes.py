@@ -0,0 +1,456 @@
+from collections import namedtuple
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+from .aggregates import GENRE_COLUMN
+
+
+# Above this share of the rows, even the most selective condition of a filter matches so many
+# rows that one vectorised pass over the index arrays is faster than gathering row ids
+SCAN_FRACTION = 0.1
+
+
+class RowFilter(namedtuple('RowFilter', ['genres', 'explicit', 'ranges'])):
+    """
+    A selection of tracks: all its conditions must hold.
+
+    Attributes:
+        genres: Sorted tuple of genres to keep, or None for every genre.
+        explicit: True or False to keep only (non-)explicit tracks, or None.
+        ranges: Sorted tuple of ``(feature, low, high)``; ``low <= feature <= high`` must hold
+            (either bound may be infinite). Tracks missing the feature are dropped.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, genres=None, explicit=None, ranges=()):
+        genres = tuple(sorted(set(genres))) if genres else None
+        ranges = tuple(sorted((feature, float(low), float(high)) for feature, low, high in ranges))
+        return super().__new__(cls, genres, explicit, ranges)
+
+    @property
+    def key(self):
+        """
+        Canonical text form of the filter, used in versions and cache keys.
+        """
+        parts = []
+        if self.genres is not None:
+            parts.append(f"genre={','.join(self.genres)}")
+        if self.explicit is not None:
+            parts.append(f"explicit={int(self.explicit)}")
+        parts.extend(f"{feature}=[{low!r},{high!r}]" for feature, low, high in self.ranges)
+        return ';'.join(parts)
+
+    def as_params(self):
+        """
+        The filter as JSON-friendly parameters, e.g. to echo it in a response.
+        """
+        params = {}
+        if self.genres is not None:
+            params['genre'] = list(self.genres)
+        if self.explicit is not None:
+            params['explicit'] = self.explicit
+        for feature, low, high in self.ranges:
+            if np.isfinite(low):
+                params[f"{feature}_min"] = low
+            if np.isfinite(high):
+                params[f"{feature}_max"] = high
+        return params
+
+    def mask(self, df):
+        """
+        Boolean mask of the rows of ``df`` matching the filter, by a full scan. This is the
+        reference ``FilterIndex.rows`` is checked against.
+        """
+        mask = np.ones(len(df), dtype=bool)
+        if self.genres is not None:
+            mask &= df[GENRE_COLUMN].astype(str).isin(self.genres).to_numpy()
+        if self.explicit is not None:
+            mask &= df['explicit'].to_numpy(dtype=bool) == self.explicit
+        for feature, low, high in self.ranges:
+            mask &= df[feature].between(low, high).to_numpy(dtype=bool, na_value=False)
+        return mask
+
+
+class FilterIndex:
+    """
+    Precomputed indexes answering a RowFilter without scanning the whole frame.
+
+    * genres: the row ids of each genre, stored contiguously (grouped by genre, in row
+      order) with the offset of each genre, and the genre code of each row;
+    * ``explicit``: a bitmap (one bit per row);
+    * numeric features: the row ids sorted by value and the sorted values, so a range is
+      two binary searches. These are built the first time a feature is filtered on.
+
+    ``rows`` starts from the condition matching the fewest rows, whose row ids come straight
+    out of an index, and only checks the other conditions on those candidates. A selective
+    filter therefore costs O(matching rows), whatever the size of the catalogue. Broad
+    filters (see SCAN_FRACTION) are evaluated in one vectorised pass over the index arrays.
+
+    Args:
+        df: The tracks DataFrame; it must not change while the index is in use.
+    """
+
+    def __init__(self, df):
+        self._df = df
+        self.size = len(df)
+
+        genres = df[GENRE_COLUMN].astype(str)
+        codes, self.genres = pd.factorize(genres.to_numpy(), sort=True)
+        self._genre_codes = codes.astype('int32')
+        row_dtype = 'int32' if self.size < 2**31 else 'int64'
+        self._genre_rows = np.argsort(codes, kind='stable').astype(row_dtype)
+        counts = np.bincount(codes, minlength=len(self.genres))
+        self._genre_offsets = np.concatenate([[0], np.cumsum(counts)])
+        self._genre_lookup = {genre: code for code, genre in enumerate(self.genres)}
+
+        self._explicit_bits = None
+        self._explicit_count = 0
+        if 'explicit' in df.columns:
+            explicit = df['explicit'].to_numpy(dtype=bool)
+            self._explicit_bits = np.packbits(explicit)
+            self._explicit_count = int(explicit.sum())
+
+        self._sorted = {}
+
+    # -- per-condition indexes -------------------------------------------------------------
+
+    def _genre_codes_of(self, genres):
+        return np.array([self._genre_lookup[genre] for genre in genres if genre in self._genre_lookup],
+                        dtype='int64')
+
+    def _sorted_feature(self, feature):
+        # Row ids by increasing value (missing values last) and the values in that order.
+        # Two threads may build the same arrays at once; either result is correct.
+        entry = self._sorted.get(feature)
+        if entry is None:
+            values = self._df[feature].to_numpy()
+            if values.dtype.kind not in 'iuf':
+                values = self._df[feature].to_numpy(dtype='float64', na_value=np.nan)
+            order = np.argsort(values, kind='stable').astype(self._genre_rows.dtype)
+            entry = self._sorted[feature] = (order, values[order], values)
+        return entry
+
+    def _range_bounds(self, feature, low, high):
+        order, sorted_values, _ = self._sorted_feature(feature)
+        start = np.searchsorted(sorted_values, low, side='left')
+        stop = np.searchsorted(sorted_values, high, side='right')  # NaN sorts after +inf
+        return start, stop
+
+    def _explicit_rows(self, explicit):
+        bits = np.unpackbits(self._explicit_bits, count=self.size).astype(bool)
+        return np.flatnonzero(bits if explicit else ~bits)
+
+    def _is_explicit(self, rows):
+        return ((self._explicit_bits[rows >> 3] >> (7 - (rows & 7))) & 1).astype(bool)
+
+    def _scan(self, candidates):
+        mask = np.ones(self.size, dtype=bool)
+        for _, kind, value in candidates:
+            if kind == 'genres':
+                wanted = np.zeros(len(self.genres), dtype=bool)
+                wanted[value] = True
+                mask &= wanted[self._genre_codes]
+            elif kind == 'explicit':
+                bits = np.unpackbits(self._explicit_bits, count=self.size).astype(bool)
+                mask &= bits if value else ~bits
+            else:
+                feature, _, _, low, high = value
+                values = self._sorted_feature(feature)[2]
+                mask &= (values >= low) & (values <= high)
+        return mask
+
+    # -- queries ---------------------------------------------------------------------------
+
+    def count(self, row_filter):
+        return len(self.rows(row_filter))
+
+    def rows(self, row_filter):
+        """
+        Returns the ids (positions) of the rows matching ``row_filter``, in increasing order.
+        """
+        # Candidate sets, each with its size, known without materialising it
+        candidates = []
+        if row_filter.genres is not None:
+            codes = self._genre_codes_of(row_filter.genres)
+            size = int((self._genre_offsets[codes + 1] - self._genre_offsets[codes]).sum())
+            candidates.append((size, 'genres', codes))
+        if row_filter.explicit is not None:
+            if self._explicit_bits is None:
+                raise ValueError("the dataset has no 'explicit' column")
+            size = self._explicit_count if row_filter.explicit else self.size - self._explicit_count
+            candidates.append((size, 'explicit', row_filter.explicit))
+        for feature, low, high in row_filter.ranges:
+            start, stop = self._range_bounds(feature, low, high)
+            candidates.append((max(stop - start, 0), 'range', (feature, start, stop, low, high)))
+
+        if not candidates:
+            return np.arange(self.size)
+        candidates.sort(key=lambda candidate: candidate[0])
+        if candidates[0][0] > SCAN_FRACTION * self.size:
+            return np.flatnonzero(self._scan(candidates))
+
+        # Row ids of the most selective condition...
+        _, kind, value = candidates[0]
+        if kind == 'genres':
+            rows = np.concatenate([self._genre_rows[self._genre_offsets[code]:self._genre_offsets[code + 1]]
+                                   for code in value] or [np.array([], dtype=self._genre_rows.dtype)])
+        elif kind == 'explicit':
+            rows = self._explicit_rows(value)
+        else:
+            feature, start, stop, _, _ = value
+            rows = self._sorted_feature(feature)[0][start:max(start, stop)]
+
+        # ...checked against the others
+        for _, kind, value in candidates[1:]:
+            if not len(rows):
+                break
+            if kind == 'genres':
+                wanted = np.zeros(len(self.genres), dtype=bool)
+                wanted[value] = True
+                rows = rows[wanted[self._genre_codes[rows]]]
+            elif kind == 'explicit':
+                explicit = self._is_explicit(rows)
+                rows = rows[explicit if value else ~explicit]
+            else:
+                feature, _, _, low, high = value
+                values = self._sorted_feature(feature)[2][rows]
+                rows = rows[(values >= low) & (values <= high)]
+        return np.sort(rows)
+
+
+# Separator of the collaborators in the ``artists`` column, e.g. "Artist A;Artist B"
+ARTIST_SEPARATOR = ';'
+
+
+def split_artists(df):
+    """
+    Splits the collaborations of the ``artists`` column into (track, artist) pairs.
+
+    Only the distinct ``artists`` values are split, with vectorised string operations, and
+    the pairs of every track are then gathered with array indexing.
+
+    Returns:
+        ``(rows, artists, names)``: for each pair, the row id of the track and the code of
+        the artist, and the artist names indexed by code.
+    """
+    artists = df['artists']
+    if isinstance(artists.dtype, pd.CategoricalDtype):
+        value_codes, values = artists.cat.codes.to_numpy(), artists.cat.categories
+    else:
+        value_codes, values = pd.factorize(artists.to_numpy())
+    parts = pd.Series(np.asarray(values, dtype=str)).str.split(ARTIST_SEPARATOR).explode().str.strip()
+    lengths = np.bincount(parts.index.to_numpy(), minlength=len(values))
+    part_codes, names = pd.factorize(parts.to_numpy())
+    part_codes[parts.to_numpy() == ''] = -1
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+
+    tracks = np.flatnonzero(value_codes >= 0)
+    counts = lengths[value_codes[tracks]]
+    rows = np.repeat(tracks, counts)
+    # Position of each pair among the parts: start of its value + rank within the track
+    ranks = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+    artists = part_codes[np.repeat(starts[value_codes[tracks]], counts) + ranks]
+    keep = artists >= 0
+    return rows[keep], artists[keep], np.asarray(names, dtype=object)
+
+
+class ArtistIndex:
+    """
+    Per-artist popularity statistics, crediting every collaborator of a track.
+
+    Artists are integer codes. The index keeps, for the whole dataset and for each genre,
+    the number of tracks, the popularity sum and the best popularity of each artist, and
+    (when built from a frame) the row ids of the tracks of each artist. ``top`` selects the
+    best artists with a partial sort, so it costs O(artists of the selected genres).
+
+    Args:
+        df: The tracks DataFrame, or None for ``from_genre_totals``.
+    """
+
+    def __init__(self, df=None):
+        if df is None:
+            return
+        rows, artists, names = split_artists(df)
+        popularity = df['popularity'].to_numpy(dtype='float64')[rows]
+        genre_codes, genres = pd.factorize(df[GENRE_COLUMN].astype(str).to_numpy(), sort=True)
+
+        # Row ids of each artist, stored contiguously
+        order = np.argsort(artists, kind='stable')
+        self.names = names
+        self._artist_rows = rows[order].astype('int32' if len(df) < 2**31 else 'int64')
+        self._artist_offsets = np.concatenate([[0], np.cumsum(np.bincount(artists, minlength=len(names)))])
+        self._set_genre_totals(genre_codes[rows], artists, popularity, genres)
+
+    @classmethod
+    def from_genre_totals(cls, totals):
+        """
+        Builds an index (without row ids) from the output of ``genre_totals``, e.g. summed
+        over the chunks of a dataset streamed in pieces.
+        """
+        index = cls()
+        genres = totals.index.get_level_values(0).astype(str)
+        genre_codes, genre_names = pd.factorize(genres, sort=True)
+        artist_codes, index.names = pd.factorize(totals.index.get_level_values(1).astype(str).to_numpy())
+        index.names = np.asarray(index.names, dtype=object)
+        index._artist_rows = index._artist_offsets = None
+        index._set_genre_totals(genre_codes, artist_codes, None, genre_names, totals)
+        return index
+
+    def appended(self, batch, offset):
+        """
+        Returns the index of the dataset with the tracks of ``batch`` added as rows
+        ``offset`` onwards; this index is left unchanged.
+
+        Only the batch is split into artists: its totals are added to the existing entries
+        and its row ids to those of each artist, so the cost grows with the batch and the
+        number of (genre, artist) entries, not with the number of tracks.
+        """
+        added = ArtistIndex(batch)
+        codes = pd.Index(self.names).get_indexer(added.names)
+        unseen = codes < 0
+        codes[unseen] = len(self.names) + np.arange(unseen.sum())
+
+        index = ArtistIndex()
+        index.names = np.concatenate([self.names, added.names[unseen]])
+        genres = self.genres.union(added.genres)
+        genre_codes, artists, count, total, best = [], [], [], [], []
+        for source, artist_codes in ((self, None), (added, codes)):
+            genre_map = genres.get_indexer(source.genres)
+            genre_codes.append(np.repeat(genre_map, np.diff(source._genre_offsets)))
+            artists.append(source._entry_artist if artist_codes is None else artist_codes[source._entry_artist])
+            count.append(source._entry_count)
+            total.append(source._entry_sum)
+            best.append(source._entry_max)
+        totals = pd.DataFrame({'count': np.concatenate(count), 'sum': np.concatenate(total),
+                               'max': np.concatenate(best)})
+        index._set_genre_totals(np.concatenate(genre_codes), np.concatenate(artists), None, genres, totals)
+
+        if self._artist_rows is None:
+            index._artist_rows = index._artist_offsets = None
+            return index
+        # Row ids of each artist: the existing ones, then those of the batch (a stable sort
+        # keeps them in increasing order)
+        row_artists = np.concatenate([np.repeat(np.arange(len(self.names)), np.diff(self._artist_offsets)),
+                                      np.repeat(codes, np.diff(added._artist_offsets))])
+        rows = np.concatenate([self._artist_rows.astype('int64'), added._artist_rows + offset])
+        order = np.argsort(row_artists, kind='stable')
+        index._artist_rows = rows[order].astype('int32' if offset + len(batch) < 2**31 else 'int64')
+        index._artist_offsets = np.concatenate([[0], np.cumsum(np.bincount(row_artists, minlength=len(index.names)))])
+        return index
+
+    def _set_genre_totals(self, genre_codes, artists, popularity, genres, totals=None):
+        # Entries sorted by (genre, artist), with the offset of each genre
+        keys = genre_codes.astype('int64') * len(self.names) + artists
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        if totals is None:
+            count = np.bincount(inverse)
+            total = np.bincount(inverse, weights=popularity)
+            order = np.argsort(inverse, kind='stable')
+            best = np.maximum.reduceat(popularity[order], np.concatenate([[0], np.cumsum(count)[:-1]]))
+        else:
+            count = np.bincount(inverse, weights=totals['count'].to_numpy()).astype('int64')
+            total = np.bincount(inverse, weights=totals['sum'].to_numpy())
+            best = np.full(len(unique_keys), -np.inf)
+            np.maximum.at(best, inverse, totals['max'].to_numpy(dtype='float64'))
+
+        self.genres = pd.Index(genres)
+        self._entry_artist = unique_keys % len(self.names)
+        self._entry_count, self._entry_sum, self._entry_max = count, total, best
+        self._genre_offsets = np.searchsorted(unique_keys // len(self.names), np.arange(len(genres) + 1))
+
+        # Whole-dataset totals
+        n = len(self.names)
+        self.count = np.bincount(self._entry_artist, weights=count, minlength=n).astype('int64')
+        self.sum = np.bincount(self._entry_artist, weights=total, minlength=n)
+        self.max = np.full(n, -np.inf)
+        np.maximum.at(self.max, self._entry_artist, best)
+
+    def genre_totals(self):
+        """
+        The per-genre statistics as a DataFrame indexed by (genre, artist), with the
+        ``count``, ``sum`` and ``max`` of the popularity.
+        """
+        genre_codes = np.repeat(np.arange(len(self.genres)), np.diff(self._genre_offsets))
+        index = pd.MultiIndex.from_arrays([self.genres[genre_codes], self.names[self._entry_artist]],
+                                          names=[GENRE_COLUMN, 'artists'])
+        return pd.DataFrame({'count': self._entry_count, 'sum': self._entry_sum, 'max': self._entry_max},
+                            index=index)
+
+    def rows(self, artist):
+        """
+        Row ids of the tracks of an artist (collaborations included), in increasing order.
+        """
+        code = np.flatnonzero(self.names == artist)
+        if not len(code) or self._artist_rows is None:
+            return np.array([], dtype='int64')
+        return self._artist_rows[self._artist_offsets[code[0]]:self._artist_offsets[code[0] + 1]]
+
+    def _statistics(self, genres):
+        # (artist codes, count, sum, max) over some genres
+        codes = [self.genres.get_loc(genre) for genre in genres if genre in self.genres]
+        slices = [slice(self._genre_offsets[code], self._genre_offsets[code + 1]) for code in codes]
+        if len(slices) == 1:
+            entries = slices[0]
+            return (self._entry_artist[entries], self._entry_count[entries], self._entry_sum[entries],
+                    self._entry_max[entries])
+        entries = np.concatenate([np.arange(s.start, s.stop) for s in slices] or [np.array([], dtype='int64')])
+        artists, inverse = np.unique(self._entry_artist[entries], return_inverse=True)
+        best = np.full(len(artists), -np.inf)
+        np.maximum.at(best, inverse, self._entry_max[entries])
+        return (artists, np.bincount(inverse, weights=self._entry_count[entries]).astype('int64'),
+                np.bincount(inverse, weights=self._entry_sum[entries]), best)
+
+    @cached_property
+    def _name_ranks(self):
+        # Rank of each artist code in name order, to break ties without comparing strings
+        ranks = np.empty(len(self.names), dtype='int64')
+        ranks[np.argsort(self.names.astype(str), kind='stable')] = np.arange(len(self.names))
+        return ranks
+
+    @cached_property
+    def _ranking(self):
+        # Every artist code, best first, over the whole dataset
+        return np.lexsort((self._name_ranks, -self.count, -(self.sum / np.maximum(self.count, 1))))
+
+    def top(self, k, min_tracks=1, genres=None):
+        """
+        The ``k`` artists with the best mean popularity; ties go to the artist with more
+        tracks, then by name.
+
+        Args:
+            k: Number of artists to return.
+            min_tracks: Only artists with at least that many tracks are ranked.
+            genres: Only count the tracks of these genres (all genres when None).
+
+        Returns:
+            A DataFrame indexed by artist with the ``count``, ``mean`` and ``max`` popularity.
+        """
+        if genres is None:
+            # The ranking is computed once: read it in growing blocks until k artists qualify
+            ranking, end = self._ranking, 4 * k
+            while True:
+                block = ranking[:end]
+                artists = block[self.count[block] >= min_tracks][:k]
+                if len(artists) == k or end >= len(ranking):
+                    break
+                end *= 4
+            count, total, best = self.count[artists], self.sum[artists], self.max[artists]
+        else:
+            artists, count, total, best = self._statistics(genres)
+            eligible = count >= min_tracks
+            artists, count, total, best = artists[eligible], count[eligible], total[eligible], best[eligible]
+            mean = total / np.maximum(count, 1)
+            if k < len(mean):
+                # Partial selection, keeping every artist tied with the k-th one
+                threshold = np.partition(mean, len(mean) - k)[len(mean) - k]
+                selected = np.flatnonzero(mean >= threshold)
+            else:
+                selected = np.arange(len(mean))
+            selected = selected[np.lexsort((self._name_ranks[artists[selected]], -count[selected],
+                                            -mean[selected]))][:k]
+            artists, count, total, best = artists[selected], count[selected], total[selected], best[selected]
+        return pd.DataFrame({'count': count, 'mean': total / np.maximum(count, 1), 'max': best},
+                            index=pd.Index(self.names[artists], name='artists'))
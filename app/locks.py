@@ -0,0 +1,72 @@
+"""
+Locks shared by the processes of a host, as files created exclusively (O_CREAT|O_EXCL).
+
+A lock file holds a random owner token, so that only its owner releases it, and a lock
+older than its timeout, left by a process that died, is taken over.
+
+Taking over or releasing a lock cannot compare and delete it atomically: the lock is
+moved aside, checked and put back when it turned out to be another owner's. If a third
+process creates a lock in the short window before it is put back, the lock put back is
+dropped and two processes hold the lock. Its users only take it to avoid duplicated
+work (computing a chart, publishing the shared dataset file, both written atomically),
+so the worst outcome of that race is the work being done twice.
+"""
+import os
+import secrets
+import time
+
+
+def acquire_lock_file(path, timeout):
+    """
+    Takes the lock ``path``, a file created exclusively that holds a random owner token.
+
+    A lock older than ``timeout`` seconds was left by a process that died and is taken
+    over. Returns the token, which ``release_lock_file`` needs, or None when another
+    process holds the lock.
+    """
+    token = secrets.token_hex(16)
+    for _ in range(2):
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                with open(path) as f:
+                    owner = f.read()
+                if time.time() - os.path.getmtime(path) < timeout or not _remove_lock_file(path, owner):
+                    return None
+            except FileNotFoundError:
+                pass
+            continue
+        with os.fdopen(fd, 'w') as f:
+            f.write(token)
+        return token
+    return None
+
+
+def release_lock_file(path, token):
+    """
+    Releases a lock taken by ``acquire_lock_file``, unless another process took it over.
+    """
+    _remove_lock_file(path, token)
+
+
+def _remove_lock_file(path, token):
+    # The lock is first moved aside, atomically, then removed if it still holds ``token``;
+    # another owner's lock is put back, unless a new lock was created meanwhile (see the
+    # module docstring)
+    aside = f"{path}.{secrets.token_hex(8)}.tmp"
+    try:
+        os.rename(path, aside)
+    except FileNotFoundError:
+        return False
+    try:
+        with open(aside) as f:
+            owned = f.read() == token
+        if not owned:
+            try:
+                os.link(aside, path)
+            except FileExistsError:
+                pass
+        return owned
+    finally:
+        os.remove(aside)
@@ -0,0 +1,322 @@
+"""
+Instrumentation of the request hot path: per-stage timings, cache hit rates and latency
+histograms, exposed as ``Server-Timing`` headers and on ``/metrics`` (Prometheus text format).
+
+Everything is off unless ``METRICS_ENABLED`` is set: ``stage`` and ``chart`` then return a
+shared no-op context manager, so the instrumented code only pays an attribute lookup.
+"""
+import bisect
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+
+from flask import request
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Stages of a chart: ``aggregate`` and ``serialize`` are timed where they happen (snapshot
+# builders, figure_to_json); ``figure`` is the rest of the chart function
+CHART_STAGES = ('aggregate', 'figure', 'serialize')
+
+HELP = {
+    'http_request_duration_seconds': ('histogram', "Time to answer a request, by route"),
+    'chart_seconds': ('histogram', "Time to compute a chart (cache misses only)"),
+    'chart_stage_seconds': ('histogram', "Time spent in each stage of a chart computation"),
+    'stage_seconds': ('histogram', "Time spent in stages outside chart computations"),
+    'cache_requests_total': ('counter', "Cache lookups, by cache, tier and result"),
+    'cache_coalesced_total': ('counter', "Cache misses that waited for another computation, by cache and tier"),
+}
+
+_DISABLED = nullcontext()
+
+# Server-Timing entries of the current request, and the chart being computed, if any
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+_current_chart = contextvars.ContextVar('current_chart', default=None)
+
+
+class _Histogram:
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self, buckets):
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+
+class _ChartTiming:
+    __slots__ = ('name', 'stages', 'depth')
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = dict.fromkeys(CHART_STAGES, 0.0)
+        self.depth = 0
+
+
+class _Stage:
+    # Times a stage: inside a chart, only the outermost stage counts (a box summary reading
+    # the genre statistics is one aggregation)
+    __slots__ = ('metrics', 'name', 'chart', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.chart = _current_chart.get()
+        if self.chart is not None:
+            self.chart.depth += 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        if self.chart is None:
+            self.metrics.observe('stage_seconds', elapsed, stage=self.name)
+            self.metrics.server_timing(self.name, elapsed)
+            return
+        self.chart.depth -= 1
+        if self.chart.depth == 0:
+            self.chart.stages[self.name] = self.chart.stages.get(self.name, 0.0) + elapsed
+
+
+class _Chart:
+    __slots__ = ('metrics', 'timing', 'token', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.timing = _ChartTiming(name)
+
+    def __enter__(self):
+        self.token = _current_chart.set(self.timing)
+        self.start = time.perf_counter()
+        return self.timing
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        _current_chart.reset(self.token)
+        stages = self.timing.stages
+        stages['figure'] = max(elapsed - sum(stages.values()), 0.0)
+        name = self.timing.name
+        self.metrics.observe('chart_seconds', elapsed, chart=name)
+        for stage, seconds in stages.items():
+            self.metrics.observe('chart_stage_seconds', seconds, chart=name, stage=stage)
+            self.metrics.server_timing(stage, seconds, name)
+
+
+class Metrics:
+    """
+    Thread-safe registry of counters and latency histograms.
+
+    Args:
+        enabled: Record anything at all; when False every call returns immediately.
+        buckets: Upper bounds of the histogram buckets, in seconds.
+    """
+
+    def __init__(self, enabled=False, buckets=BUCKETS):
+        self.configure(enabled, buckets)
+
+    def configure(self, enabled=False, buckets=BUCKETS):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._histograms = {}  # name -> {labels: _Histogram}
+        self._counters = {}    # name -> {labels: value}
+
+    def init_app(self, app):
+        """
+        Configures the registry from ``METRICS_ENABLED`` and, when enabled, times every
+        request and adds its ``Server-Timing`` header.
+        """
+        self.configure(app.config['METRICS_ENABLED'])
+        if not self.enabled:
+            return
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    # -- recording --------------------------------------------------------------------
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram(self.buckets)
+            histogram.counts[index] += 1
+            histogram.sum += seconds
+
+    def increment(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def stage(self, name):
+        """
+        Context manager timing a stage (e.g. ``'aggregate'``, ``'serialize'``). Within a
+        ``chart``, the time is attributed to that chart.
+        """
+        return _Stage(self, name) if self.enabled else _DISABLED
+
+    def chart(self, name):
+        """
+        Context manager timing the computation of a chart and its stages.
+        """
+        return _Chart(self, name) if self.enabled else _DISABLED
+
+    def cache_lookup(self, cache, tier, hit):
+        """
+        Counts a lookup in a cache tier (``'memory'`` or ``'shared'``).
+        """
+        if not self.enabled:
+            return
+        result = 'hit' if hit else 'miss'
+        self.increment('cache_requests_total', cache=cache, tier=tier, result=result)
+        self.server_timing(f"cache-{tier}", None, f"{cache} {result}")
+
+    def server_timing(self, name, seconds, description=None):
+        """
+        Adds an entry to the ``Server-Timing`` header of the current request, if any.
+        """
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((name, seconds, description))
+
+    def _start_request(self):
+        request.environ['metrics.start'] = time.perf_counter()
+        _request_timings.set([])
+
+    def _finish_request(self, response):
+        elapsed = time.perf_counter() - request.environ['metrics.start']
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        self.observe('http_request_duration_seconds', elapsed, route=route, method=request.method,
+                     status=str(response.status_code))
+        timings = _request_timings.get() or []
+        response.headers['Server-Timing'] = ', '.join(
+            [format_server_timing(*timing) for timing in timings] + [format_server_timing('total', elapsed)])
+        _request_timings.set(None)
+        return response
+
+    # -- exposition -------------------------------------------------------------------
+
+    def render(self):
+        """
+        Returns every series in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                _header(lines, name)
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{_labels(labels)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                _header(lines, name)
+                for labels, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(self.buckets + (float('inf'),), histogram.counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(labels)} {histogram.sum!r}")
+                    lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+
+def format_server_timing(name, seconds=None, description=None):
+    entry = name
+    if seconds is not None:
+        entry += f";dur={seconds * 1000:.2f}"
+    if description is not None:
+        entry += f';desc="{description}"'
+    return entry
+
+
+def _header(lines, name):
+    kind, text = HELP.get(name, ('untyped', name))
+    lines.append(f"# HELP {name} {text}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler: a daemon thread records the Python stack of every other thread
+    every ``interval`` seconds. The stacks are kept in the "collapsed" format read by
+    flamegraph.pl and speedscope (``frame;frame;frame count``).
+
+    Nothing runs until ``start`` is called (``PROFILER_ENABLED``).
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self._stacks = Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if not self.running:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            samples = [_collapse(frame) for thread, frame in sys._current_frames().items() if thread != own]
+            with self._lock:
+                self._stacks.update(samples)
+
+    def collapsed(self, reset=False):
+        """
+        Returns the sampled stacks, one ``frame;frame;... count`` line each, most frequent first.
+        """
+        with self._lock:
+            stacks = self._stacks.most_common()
+            if reset:
+                self._stacks.clear()
+        return ''.join(f"{stack} {count}\n" for stack, count in stacks)
+
+
+def _collapse(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+# Registry shared by the application, configured by create_app
+metrics = Metrics()
@@ -1,43 +1,184 @@
+import numpy as np
 import pandas as pd
-from datasets import load_dataset
 import plotly.express as px
 import plotly.graph_objects as go
 import os
-from . import cache
+from . import storage
+from .aggregates import genre_order, select_genres
+from .caching import cached_chart, genres_version
+from .serialization import figure_to_json
+from .snapshot import as_snapshot
 
-def load_data(local_path="data/spotify_tracks_dataset.csv"):
+HF_DATASET = "maharshipandya/spotify-tracks-dataset"
+
+def load_data(local_path="data/spotify_tracks_dataset.csv", cache_path=None, columns=storage.ANALYSIS_COLUMNS):
     """
     Loads the Spotify Tracks dataset.
-    Downloads the dataset from Hugging Face if it doesn't exist locally.
+
+    Reads the typed Parquet cache stored next to ``local_path`` when it is up to date.
+    Otherwise the legacy CSV is parsed with the explicit schema and the cache is rebuilt.
+    Downloads the dataset from Hugging Face if neither exists locally.
+
+    Args:
+        local_path: Path of the legacy CSV export.
+        cache_path: Path of the columnar cache (defaults to ``local_path`` with a ``.parquet`` suffix).
+        columns: Columns to return, all when None. By default ``storage.LAZY_COLUMNS``, which
+            no analysis reads, are left out; the cache always holds every column.
+
+    Returns:
+        A DataFrame typed according to ``storage.SCHEMA``, or None if the download failed.
     """
-    if not os.path.exists(local_path):
-        print("Dataset not found locally. Downloading from Hugging Face...")
+    if cache_path is None:
+        cache_path = storage.cache_path_for(local_path)
+
+    if os.path.exists(local_path):
+        fingerprint = storage.source_fingerprint(local_path)
+        if storage.is_cache_fresh(cache_path, fingerprint):
+            print("Loading dataset from local cache...")
+            return storage.read_cache(cache_path, columns)
+
+        print("Loading dataset from local file...")
+        df = storage.read_csv_typed(local_path)
         try:
-            dataset = load_dataset("maharshipandya/spotify-tracks-dataset")
-            df = pd.DataFrame(dataset['train'])
+            storage.write_cache(df, cache_path, fingerprint)
+        except OSError as e:
+            print(f"Could not write dataset cache: {e}")
+        return _select(df, columns)
+
+    fingerprint = {'source': HF_DATASET}
+    if storage.is_cache_fresh(cache_path, fingerprint):
+        print("Loading dataset from local cache...")
+        return storage.read_cache(cache_path, columns)
+
+    print("Dataset not found locally. Downloading from Hugging Face...")
+    try:
+        # Imported lazily: the datasets package is slow to import and only needed here.
+        from datasets import load_dataset
+
+        dataset = load_dataset(HF_DATASET)
+        df = storage.apply_schema(pd.DataFrame(dataset['train']))
+        storage.write_cache(df, cache_path, fingerprint)
+        print(f"Dataset downloaded and saved to {cache_path}")
+    except Exception as e:
+        print(f"Error downloading or saving dataset: {e}")
+        return None
 
-            # Create the 'data' directory if it doesn't exist
-            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    return _select(df, columns)
 
-            df.to_csv(local_path, index=False)
-            print(f"Dataset downloaded and saved to {local_path}")
-        except Exception as e:
-            print(f"Error downloading or saving dataset: {e}")
-            return None
+
+def _select(df, columns):
+    return df if columns is None else df[[column for column in df.columns if column in columns]]
+
+def precomputed_box_figure(summary, title, labels, order=None, color_by_genre=True):
+    """
+    Builds a box plot from a per-genre summary (see ``aggregates.build_box_summary``).
+
+    Only quartiles, whiskers and the sampled outliers are sent to the browser, so the
+    figure size depends on the number of genres, not on the number of tracks.
+
+    Args:
+        summary: The per-genre box summary.
+        title: The figure title.
+        labels: Dict with the 'x' and 'y' axis labels used in hover texts.
+        order: Genres in display order (defaults to the summary order).
+        color_by_genre: Draw one colored box per genre instead of a single trace.
+
+    Returns:
+        A Plotly figure.
+    """
+    if order is not None:
+        summary = summary.loc[order]
+    genres = summary.index.tolist()
+    palette = px.colors.qualitative.Plotly
+    colors = [palette[i % len(palette)] for i in range(len(genres))] if color_by_genre else [palette[0]] * len(genres)
+    box_stats = ['q1', 'median', 'q3', 'mean', 'lowerfence', 'upperfence']
+
+    fig = go.Figure()
+    if color_by_genre:
+        for genre, color, row in zip(genres, colors, summary.itertuples()):
+            fig.add_trace(go.Box(x=[genre], name=genre, marker_color=color, boxpoints=False,
+                                 **{stat: [getattr(row, stat)] for stat in box_stats}))
     else:
-        print("Loading dataset from local file...")
-        df = pd.read_csv(local_path)
+        fig.add_trace(go.Box(x=genres, name=labels['y'], marker_color=colors[0], boxpoints=False,
+                             **{stat: summary[stat].tolist() for stat in box_stats}))
+
+    counts = summary['outliers'].map(len).to_numpy()
+    if counts.sum():
+        fig.add_trace(go.Scatter(
+            x=np.repeat(genres, counts),
+            y=np.concatenate(summary['outliers'].tolist()),
+            mode='markers',
+            marker=dict(size=3, color=np.repeat(colors, counts)),
+            name='Valeurs aberrantes',
+            hovertemplate=f"{labels['x']}=%{{x}}<br>{labels['y']}=%{{y}}<extra></extra>",
+            showlegend=False
+        ))
+
+    fig.update_layout(title=title, xaxis=dict(categoryorder='array', categoryarray=genres))
+    return fig
+
+def density_scatter_figure(snapshot, x, y, title, labels, sample_per_genre=0, color_by_genre=False):
+    """
+    Draws the relationship between two features as a 2D density heatmap.
+
+    The heatmap has a fixed number of cells, so the figure size does not depend on the number
+    of tracks. A stratified sample of at most ``sample_per_genre`` tracks per genre can be
+    overlaid as points. The features are recorded in ``layout.meta`` so the dashboard can
+    request finer bins from ``/api/density`` when the user zooms in.
+
+    Args:
+        snapshot: The DatasetSnapshot.
+        x: Column on the horizontal axis.
+        y: Column on the vertical axis.
+        title: The figure title.
+        labels: Dict mapping the column names to axis labels.
+        sample_per_genre: Number of sampled tracks per genre drawn on top of the heatmap (0 for none).
+        color_by_genre: Color the sampled tracks by genre.
+
+    Returns:
+        A Plotly figure.
+    """
+    grid = snapshot.density(x, y)
+    counts = grid['z'].astype('float64')
+    counts[counts == 0] = np.nan  # Empty cells stay transparent
+
+    fig = go.Figure(go.Heatmap(
+        x=grid['x'],
+        y=grid['y'],
+        z=counts,
+        colorscale='Blues',
+        showscale=not color_by_genre,
+        colorbar=dict(title='Pistes'),
+        name='Densité',
+        hovertemplate=f"{labels[x]}=%{{x:.3g}}<br>{labels[y]}=%{{y:.3g}}<br>Pistes=%{{z}}<extra></extra>"
+    ))
 
-    return df
+    if sample_per_genre:
+        sample = snapshot.sample(sample_per_genre)
+        if color_by_genre:
+            points = px.scatter(sample, x=x, y=y, color='track_genre', labels=labels, opacity=0.6)
+            fig.add_traces(points.data)
+        else:
+            fig.add_trace(go.Scatter(x=sample[x], y=sample[y], mode='markers', name='Échantillon',
+                                     marker=dict(size=3, color='#1f2d3d', opacity=0.5), showlegend=False))
+
+    fig.update_layout(title=title, meta={'density': {'x': x, 'y': y}})
+    return fig
 
 # Data Analysis Functions
-@cache.cached(timeout=3600, key_prefix='analyze_genre_popularity')
-def analyze_genre_popularity(df):
+@cached_chart(timeout=3600, version=genres_version)
+def analyze_genre_popularity(data, genres=None, top_n=None):
     """
     Analyzes the popularity of different music genres.
     Returns a Plotly figure (as JSON) and an interpretation string.
+
+    Args:
+        data: The DataFrame or DatasetSnapshot.
+        genres: Genres to include (all genres when None).
+        top_n: Only keep the ``top_n`` most popular genres.
     """
-    genre_popularity = df.groupby('track_genre')['popularity'].mean().sort_values(ascending=False)
+    stats = select_genres(as_snapshot(data).genre_stats, genres)
+    genre_popularity = stats[('popularity', 'mean')].sort_values(ascending=False).head(top_n)
 
     fig = px.bar(genre_popularity,
                  x=genre_popularity.index,
@@ -56,7 +197,7 @@ def analyze_genre_popularity(df):
         yaxis_tickfont=dict(size=10)
     )
 
-    graphJSON = fig.to_json()
+    graphJSON = figure_to_json(fig)
 
     interpretation = """
     Ce graphique montre le score de popularité moyen pour chaque genre. 
@@ -65,27 +206,29 @@ def analyze_genre_popularity(df):
     """
     return graphJSON, interpretation
 
-@cache.cached(timeout=3600, key_prefix='analyze_music_features_by_genre')
-def analyze_music_features_by_genre(df, feature='danceability'):
+@cached_chart(timeout=3600, version=genres_version)
+def analyze_music_features_by_genre(data, feature='danceability', genres=None, top_n=None):
     """
     Analyzes the distribution of a specific music feature across different genres.
 
     Args:
-        df: The DataFrame.
+        data: The DataFrame or DatasetSnapshot.
         feature: The music feature to analyze (e.g., 'danceability', 'energy', 'tempo').
+        genres: Genres to include (all genres when None).
+        top_n: Only keep the ``top_n`` genres with the highest mean.
 
     Returns:
         A Plotly figure (as JSON) and an interpretation string.
     """
-    feature_by_genre = df.groupby('track_genre')[feature].mean().sort_values(ascending=False)
-    
+    stats = select_genres(as_snapshot(data).genre_stats, genres)
+    feature_by_genre = stats[(feature, 'mean')].sort_values(ascending=False).head(top_n)
+
     fig = px.bar(
-        data_frame=df,
-        x='track_genre',
-        y=feature,
-        color='track_genre',
+        x=feature_by_genre.index,
+        y=feature_by_genre.values,
+        color=feature_by_genre.index,
         title=f"Moyenne de {feature.capitalize()} par genre",
-        category_orders={"track_genre": feature_by_genre.index.tolist()}
+        labels={'x': 'track_genre', 'y': feature}
     )
 
     fig.update_layout(
@@ -100,7 +243,7 @@ def analyze_music_features_by_genre(df, feature='danceability'):
         showlegend=False
     )
 
-    graphJSON = fig.to_json()
+    graphJSON = figure_to_json(fig)
 
     interpretation = f"""
     Ce graphique compare la moyenne de {feature} entre différents genres musicaux. 
@@ -110,16 +253,19 @@ def analyze_music_features_by_genre(df, feature='danceability'):
     """
     return graphJSON, interpretation
 
-@cache.cached(timeout=3600, key_prefix='analyze_sales_correlations')
-def analyze_sales_correlations(df):
+@cached_chart(timeout=3600)
+def analyze_sales_correlations(data, method='pearson'):
     """
     Analyzes correlations between music features and popularity.
 
+    Args:
+        data: The DataFrame or DatasetSnapshot.
+        method: ``'pearson'`` or ``'spearman'`` (rank) correlation.
+
     Returns:
         A Plotly figure (as JSON) and an interpretation string.
     """
-    numerical_df = df.select_dtypes(include=['number'])
-    correlation_matrix = numerical_df.corr()
+    correlation_matrix = as_snapshot(data).correlations(method)
     popularity_correlations = correlation_matrix['popularity'].sort_values(ascending=False)
 
     fig = px.bar(
@@ -143,7 +289,7 @@ def analyze_sales_correlations(df):
         showlegend=False
     )
 
-    graphJSON = fig.to_json()
+    graphJSON = figure_to_json(fig)
 
     interpretation = """
     Ce graphique affiche la corrélation entre diverses caractéristiques musicales et la popularité des pistes. 
@@ -153,19 +299,18 @@ def analyze_sales_correlations(df):
     """
     return graphJSON, interpretation
 
-@cache.cached(timeout=3600, key_prefix='analyze_explicit_content')
-def analyze_explicit_content(df):
+@cached_chart(timeout=3600, version=genres_version)
+def analyze_explicit_content(data, genres=None):
     """
     Analyzes the proportion of explicit tracks in each genre.
+    Only ``genres`` are shown when given.
     """
-    explicit_counts = df.groupby(['track_genre', 'explicit']).size().unstack(fill_value=0)
-    explicit_proportion = explicit_counts.div(explicit_counts.sum(axis=1), axis=0)
+    explicit_proportion = select_genres(as_snapshot(data).genre_stats, genres)[('explicit', 'share')]
 
-    fig = px.bar(explicit_proportion,
-                 x=explicit_proportion.index,
-                 y=True,
+    fig = px.bar(x=explicit_proportion.index,
+                 y=explicit_proportion.values,
                  title="Proportion de pistes explicites par genre",
-                 labels={'x': 'Genre', 'y': 'Proportion de pistes explicites', 'value': 'Proportion', 'variable': 'Explicite'},
+                 labels={'x': 'Genre', 'y': 'Proportion de pistes explicites'},
                  color_discrete_sequence=["#FF6347"])
 
     fig.update_layout(
@@ -180,7 +325,7 @@ def analyze_explicit_content(df):
         yaxis_tickformat=".2%"
     )
 
-    graphJSON = fig.to_json()
+    graphJSON = figure_to_json(fig)
 
     interpretation = """
     Ce graphique montre la proportion de pistes avec du contenu explicite dans chaque genre. 
@@ -190,18 +335,17 @@ def analyze_explicit_content(df):
     """
     return graphJSON, interpretation
 
-@cache.cached(timeout=3600, key_prefix='analyze_duration_by_genre')
-def analyze_duration_by_genre(df):
+@cached_chart(timeout=3600, version=genres_version)
+def analyze_duration_by_genre(data, genres=None):
     """
     Analyzes the distribution of track durations across different genres.
+    Only ``genres`` are shown when given.
     """
-    fig = px.box(df,
-                 x='track_genre',
-                 y='duration_ms',
-                 title="Distribution des durées de pistes par genre",
-                 labels={'track_genre': 'Genre', 'duration_ms': 'Durée (ms)'},
-                 color='track_genre',
-                 category_orders={"track_genre": df.groupby('track_genre')['duration_ms'].median().sort_values(ascending=False).index.tolist()})
+    snapshot = as_snapshot(data)
+    fig = precomputed_box_figure(snapshot.box_summary('duration_ms'),
+                                 title="Distribution des durées de pistes par genre",
+                                 labels={'x': 'Genre', 'y': 'Durée (ms)'},
+                                 order=genre_order(select_genres(snapshot.genre_stats, genres), 'duration_ms', 'median'))
 
     fig.update_layout(
         height=300,
@@ -215,7 +359,7 @@ def analyze_duration_by_genre(df):
         showlegend=False
     )
 
-    graphJSON = fig.to_json()
+    graphJSON = figure_to_json(fig)
 
     interpretation = """
     Ce diagramme en boîte montre la distribution des durées de pistes pour chaque genre. 
@@ -225,13 +369,16 @@ def analyze_duration_by_genre(df):
     """
     return graphJSON, interpretation
 
-@cache.cached(timeout=3600, key_prefix='analyze_feature_correlation_heatmap')
-def analyze_feature_correlation_heatmap(df):
+@cached_chart(timeout=3600)
+def analyze_feature_correlation_heatmap(data, method='pearson'):
     """
     Generates a heatmap to visualize the correlations between different musical features.
+
+    Args:
+        data: The DataFrame or DatasetSnapshot.
+        method: ``'pearson'`` or ``'spearman'`` (rank) correlation.
     """
-    numerical_features = df.select_dtypes(include=['number'])
-    corr_matrix = numerical_features.corr()
+    corr_matrix = as_snapshot(data).correlations(method)
 
     fig = go.Figure(data=go.Heatmap(
         z=corr_matrix.values,
@@ -255,7 +402,7 @@ def analyze_feature_correlation_heatmap(df):
         yaxis_autorange='reversed'
     )
 
-    graphJSON = fig.to_json()
+    graphJSON = figure_to_json(fig)
 
     interpretation = """
     Cette carte de chaleur visualise les corrélations entre différentes caractéristiques musicales. 
@@ -266,18 +413,17 @@ def analyze_feature_correlation_heatmap(df):
     """
     return graphJSON, interpretation
 
-@cache.cached(timeout=3600, key_prefix='analyze_tempo_by_genre')
-def analyze_tempo_by_genre(df):
+@cached_chart(timeout=3600, version=genres_version)
+def analyze_tempo_by_genre(data, genres=None):
     """
     Analyzes the distribution of tempo across different genres.
+    Only ``genres`` are shown when given.
     """
-    fig = px.box(df,
-                 x='track_genre',
-                 y='tempo',
-                 title="Distribution du Tempo par Genre",
-                 labels={'track_genre': 'Genre', 'tempo': 'Tempo (BPM)'},
-                 color='track_genre',
-                 category_orders={"track_genre": df.groupby('track_genre')['tempo'].median().sort_values(ascending=False).index.tolist()})
+    snapshot = as_snapshot(data)
+    fig = precomputed_box_figure(snapshot.box_summary('tempo'),
+                                 title="Distribution du Tempo par Genre",
+                                 labels={'x': 'Genre', 'y': 'Tempo (BPM)'},
+                                 order=genre_order(select_genres(snapshot.genre_stats, genres), 'tempo', 'median'))
 
     fig.update_layout(
         height=300,
@@ -291,7 +437,7 @@ def analyze_tempo_by_genre(df):
         showlegend=False
     )
 
-    graphJSON = fig.to_json()
+    graphJSON = figure_to_json(fig)
 
     interpretation = """
     Ce diagramme en boîte montre la distribution du tempo (BPM) pour chaque genre. 
@@ -300,18 +446,30 @@ def analyze_tempo_by_genre(df):
     """
     return graphJSON, interpretation
 
-@cache.cached(timeout=3600, key_prefix='analyze_energy_vs_danceability')
-def analyze_energy_vs_danceability(df):
+@cached_chart(timeout=3600)
+def analyze_energy_vs_danceability(data, mode='density', sample_per_genre=20):
     """
     Analyzes the relationship between energy and danceability across different genres.
-    """
-    fig = px.scatter(df,
-                     x='energy',
-                     y='danceability',
-                     color='track_genre',
-                     title="Relation entre l'Énergie et la Danseabilité par Genre",
-                     labels={'energy': 'Énergie', 'danceability': 'Danseabilité'},
-                     opacity=0.6)
+
+    Args:
+        data: The DataFrame or DatasetSnapshot.
+        mode: 'density' for a binned heatmap with a per-genre sample, 'points' to plot every track.
+        sample_per_genre: Number of tracks per genre drawn over the heatmap in density mode.
+    """
+    title = "Relation entre l'Énergie et la Danseabilité par Genre"
+    labels = {'energy': 'Énergie', 'danceability': 'Danseabilité', 'track_genre': 'Genre'}
+    snapshot = as_snapshot(data)
+    if mode == 'density':
+        fig = density_scatter_figure(snapshot, 'energy', 'danceability', title, labels,
+                                     sample_per_genre=sample_per_genre, color_by_genre=True)
+    else:
+        fig = px.scatter(snapshot.frame,
+                         x='energy',
+                         y='danceability',
+                         color='track_genre',
+                         title=title,
+                         labels=labels,
+                         opacity=0.6)
 
     fig.update_layout(
         height=400,
@@ -326,7 +484,7 @@ def analyze_energy_vs_danceability(df):
         legend_title_text='Genre'
     )
 
-    graphJSON = fig.to_json()
+    graphJSON = figure_to_json(fig)
 
     interpretation = """
     Ce graphique en nuage de points montre la relation entre l'énergie et la danseabilité des pistes, 
@@ -335,11 +493,12 @@ def analyze_energy_vs_danceability(df):
     """
     return graphJSON, interpretation
 
-@cache.cached(timeout=3600, key_prefix='analyze_popularity_over_time')
-def analyze_popularity_over_time(df):
+@cached_chart(timeout=3600)
+def analyze_popularity_over_time(data):
     """
     Analyzes the trend of track popularity over time.
     """
+    df = as_snapshot(data).frame
     if 'release_date' not in df.columns:
         interpretation = """
         La colonne 'release_date' n'est pas disponible dans le jeu de données. 
@@ -358,11 +517,12 @@ def analyze_popularity_over_time(df):
             xaxis_tickfont=dict(size=10),
             yaxis_tickfont=dict(size=10)
         )
-        graphJSON = fig.to_json()
+        graphJSON = figure_to_json(fig)
         return graphJSON, interpretation
 
-    df['release_year'] = pd.to_datetime(df['release_date']).dt.year
-    popularity_over_time = df.groupby('release_year')['popularity'].mean().reset_index()
+    # Derived locally: the frame is shared between requests and must not be mutated
+    release_year = pd.to_datetime(df['release_date']).dt.year.rename('release_year')
+    popularity_over_time = df.groupby(release_year)['popularity'].mean().reset_index()
 
     fig = px.line(popularity_over_time,
                   x='release_year',
@@ -382,7 +542,7 @@ def analyze_popularity_over_time(df):
         yaxis_tickfont=dict(size=10)
     )
 
-    graphJSON = fig.to_json()
+    graphJSON = figure_to_json(fig)
 
     interpretation = """
     Ce graphique en ligne montre l'évolution de la popularité moyenne des pistes au fil des années. 
@@ -391,19 +551,33 @@ def analyze_popularity_over_time(df):
     """
     return graphJSON, interpretation
 
-@cache.cached(timeout=3600, key_prefix='analyze_top_artists_by_popularity')
-def analyze_top_artists_by_popularity(df):
+@cached_chart(timeout=3600, version=genres_version)
+def analyze_top_artists_by_popularity(data, top_n=20, min_tracks=1, genres=None):
     """
-    Analyzes the top artists by average track popularity.
+    Analyzes the top ``top_n`` artists by average track popularity. Every artist of a
+    collaboration is credited with the track.
+
+    Args:
+        data: The DataFrame or DatasetSnapshot.
+        top_n: Number of artists shown.
+        min_tracks: Only artists with at least that many tracks are ranked.
+        genres: Only the tracks of these genres are counted (all genres when None).
     """
-    top_artists = df.groupby('artists')['popularity'].mean().sort_values(ascending=False).head(20)
+    top_artists = as_snapshot(data).top_artists(top_n, min_tracks=min_tracks, genres=genres)['mean']
 
-    fig = px.bar(top_artists,
-                 x=top_artists.values,
-                 y=top_artists.index,
-                 orientation='h',
-                 title="Top 20 des artistes par popularité moyenne",
-                 labels={'x': 'Popularité moyenne', 'y': 'Artistes'})
+    if top_artists.empty:
+        # No artist has min_tracks tracks: px.bar cannot draw an empty ranking
+        fig = go.Figure()
+        fig.update_layout(title=f"Top {top_n} des artistes par popularité moyenne",
+                          annotations=[dict(text=f"Aucun artiste ne compte au moins {min_tracks} pistes",
+                                            showarrow=False, xref='paper', yref='paper', x=0.5, y=0.5)])
+    else:
+        fig = px.bar(top_artists,
+                     x=top_artists.values,
+                     y=top_artists.index,
+                     orientation='h',
+                     title=f"Top {top_n} des artistes par popularité moyenne",
+                     labels={'x': 'Popularité moyenne', 'y': 'Artistes'})
 
     fig.update_layout(
         height=400,
@@ -417,25 +591,36 @@ def analyze_top_artists_by_popularity(df):
         yaxis_tickfont=dict(size=10)
     )
 
-    graphJSON = fig.to_json()
+    graphJSON = figure_to_json(fig)
 
-    interpretation = """
-    Ce graphique en barres horizontales montre les 20 artistes les plus populaires en fonction de la popularité 
+    if top_artists.empty:
+        interpretation = f"""
+    Aucun artiste ne compte au moins {min_tracks} pistes parmi les pistes retenues : le classement est vide.
+    Réduisez le nombre minimum de pistes ou élargissez la sélection de genres.
+    """
+        return graphJSON, interpretation
+
+    interpretation = f"""
+    Ce graphique en barres horizontales montre les {top_n} artistes les plus populaires en fonction de la popularité 
     moyenne de leurs pistes. Cela peut aider à identifier les artistes les plus influents ou les plus appréciés 
     par le public.
     """
     return graphJSON, interpretation
 
-@cache.cached(timeout=3600, key_prefix='analyze_valence_vs_popularity')
-def analyze_valence_vs_popularity(df):
+@cached_chart(timeout=3600)
+def analyze_valence_vs_popularity(data, mode='density', sample_per_genre=0):
     """
     Analyzes the relationship between valence and track popularity.
-    """
-    fig = px.scatter(df,
-                     x='valence',
-                     y='popularity',
-                     title="Relation entre la Valence et la Popularité",
-                     labels={'valence': 'Valence', 'popularity': 'Popularité'})
+    See ``analyze_energy_vs_danceability`` for ``mode`` and ``sample_per_genre``.
+    """
+    title = "Relation entre la Valence et la Popularité"
+    labels = {'valence': 'Valence', 'popularity': 'Popularité'}
+    snapshot = as_snapshot(data)
+    if mode == 'density':
+        fig = density_scatter_figure(snapshot, 'valence', 'popularity', title, labels,
+                                     sample_per_genre=sample_per_genre)
+    else:
+        fig = px.scatter(snapshot.frame, x='valence', y='popularity', title=title, labels=labels)
 
     fig.update_layout(
         height=400,
@@ -449,7 +634,7 @@ def analyze_valence_vs_popularity(df):
         yaxis_tickfont=dict(size=10)
     )
 
-    graphJSON = fig.to_json()
+    graphJSON = figure_to_json(fig)
 
     interpretation = """
     Ce graphique en nuage de points montre la relation entre la valence (positivité) des pistes et leur popularité. 
@@ -458,17 +643,17 @@ def analyze_valence_vs_popularity(df):
     """
     return graphJSON, interpretation
 
-@cache.cached(timeout=3600, key_prefix='analyze_top_popular_tracks')
-def analyze_top_popular_tracks(df):
+@cached_chart(timeout=3600)
+def analyze_top_popular_tracks(data, top_n=10):
     """
-    Analyzes the top 10 most popular tracks.
+    Analyzes the ``top_n`` most popular tracks.
     """
-    top_tracks = df.nlargest(10, 'popularity')
+    top_tracks = as_snapshot(data).top_tracks(top_n)
 
     fig = px.bar(top_tracks,
                  x='track_name',
                  y='popularity',
-                 title="Top 10 des pistes les plus populaires",
+                 title=f"Top {top_n} des pistes les plus populaires",
                  labels={'track_name': 'Nom de la piste', 'popularity': 'Popularité'})
 
     fig.update_layout(
@@ -483,24 +668,25 @@ def analyze_top_popular_tracks(df):
         showlegend=False
     )
 
-    graphJSON = fig.to_json()
+    graphJSON = figure_to_json(fig)
 
-    interpretation = """
-    Ce graphique montre les 10 pistes les plus populaires du jeu de données. 
+    interpretation = f"""
+    Ce graphique montre les {top_n} pistes les plus populaires du jeu de données. 
     Il aide à identifier les pistes qui ont le plus de succès auprès des auditeurs.
     """
     return graphJSON, interpretation
 
-@cache.cached(timeout=3600, key_prefix='analyze_energy_by_genre')
-def analyze_energy_by_genre(df):
+@cached_chart(timeout=3600, version=genres_version)
+def analyze_energy_by_genre(data, genres=None):
     """
     Analyzes the distribution of energy across genres.
+    Only ``genres`` are shown when given.
     """
-    fig = px.box(df,
-                 x='track_genre',
-                 y='energy',
-                 title="Distribution de l'énergie par genre",
-                 labels={'track_genre': 'Genre', 'energy': 'Énergie'})
+    summary = as_snapshot(data).box_summary('energy')
+    fig = precomputed_box_figure(select_genres(summary, genres),
+                                 title="Distribution de l'énergie par genre",
+                                 labels={'x': 'Genre', 'y': 'Énergie'},
+                                 color_by_genre=False)
 
     fig.update_layout(
         height=400,
@@ -514,7 +700,7 @@ def analyze_energy_by_genre(df):
         showlegend=False
     )
 
-    graphJSON = fig.to_json()
+    graphJSON = figure_to_json(fig)
 
     interpretation = """
     Ce diagramme en boîte montre la distribution de l'énergie des pistes par genre. 
@@ -522,16 +708,20 @@ def analyze_energy_by_genre(df):
     """
     return graphJSON, interpretation
 
-@cache.cached(timeout=3600, key_prefix='analyze_loudness_vs_energy')
-def analyze_loudness_vs_energy(df):
+@cached_chart(timeout=3600)
+def analyze_loudness_vs_energy(data, mode='density', sample_per_genre=0):
     """
     Analyzes the relationship between loudness and energy.
-    """
-    fig = px.scatter(df,
-                     x='loudness',
-                     y='energy',
-                     title="Relation entre la Loudness et l'Énergie",
-                     labels={'loudness': 'Loudness', 'energy': 'Énergie'})
+    See ``analyze_energy_vs_danceability`` for ``mode`` and ``sample_per_genre``.
+    """
+    title = "Relation entre la Loudness et l'Énergie"
+    labels = {'loudness': 'Loudness', 'energy': 'Énergie'}
+    snapshot = as_snapshot(data)
+    if mode == 'density':
+        fig = density_scatter_figure(snapshot, 'loudness', 'energy', title, labels,
+                                     sample_per_genre=sample_per_genre)
+    else:
+        fig = px.scatter(snapshot.frame, x='loudness', y='energy', title=title, labels=labels)
 
     fig.update_layout(
         height=400,
@@ -545,7 +735,7 @@ def analyze_loudness_vs_energy(df):
         yaxis_tickfont=dict(size=10)
     )
 
-    graphJSON = fig.to_json()
+    graphJSON = figure_to_json(fig)
 
     interpretation = """
     Ce graphique en nuage de points montre la relation entre la loudness et l'énergie des pistes. 
@@ -553,15 +743,18 @@ def analyze_loudness_vs_energy(df):
     """
     return graphJSON, interpretation
 
-@cache.cached(timeout=3600, key_prefix='analyze_acousticness_distribution')
-def analyze_acousticness_distribution(df):
+@cached_chart(timeout=3600)
+def analyze_acousticness_distribution(data):
     """
     Analyzes the distribution of acousticness.
+    The histogram is binned on the server, so the figure holds 50 counts rather than every value.
     """
-    fig = px.histogram(df,
-                       x='acousticness',
-                       title="Distribution de l'acousticness",
-                       labels={'acousticness': 'Acousticness'})
+    counts = as_snapshot(data).histogram('acousticness', bins=50)
+    edges = counts['edges']
+    fig = go.Figure(go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=counts['counts'], width=np.diff(edges),
+                           marker_line_width=0, name='acousticness',
+                           hovertemplate="Acousticness=%{x:.2f}<br>Pistes=%{y}<extra></extra>"))
+    fig.update_layout(title="Distribution de l'acousticness", bargap=0)
 
     fig.update_layout(
         height=400,
@@ -575,7 +768,7 @@ def analyze_acousticness_distribution(df):
         yaxis_tickfont=dict(size=10)
     )
 
-    graphJSON = fig.to_json()
+    graphJSON = figure_to_json(fig)
 
     interpretation = """
     Ce graphique montre la distribution de l'acousticness des pistes. 
@@ -0,0 +1,276 @@
+"""
+Popularity prediction: an ordinary least squares regression of popularity on the audio
+features, the explicit flag and the genre, fitted once per dataset version.
+
+The genre enters as a fixed effect. Rather than one dummy column per genre (a design
+matrix over a hundred columns wide), the features and the popularity are centred within
+each genre and the slopes are fitted on the centred values; the genre effects follow from
+the genre means. Both give the same coefficients (Frisch-Waugh-Lovell), but the matrix
+fitted has one column per feature only.
+
+Scoring is one matrix product: ``features @ coefficients + genre_effects[genre]``.
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from flask import current_app
+
+from .aggregates import GENRE_COLUMN
+
+PREDICTORS = ('danceability', 'energy', 'loudness', 'speechiness', 'acousticness', 'instrumentalness', 'liveness',
+              'valence', 'tempo', 'duration_ms', 'explicit')
+
+TARGET = 'popularity'
+
+# Bump whenever the fitted model or its file format changes
+MODEL_VERSION = 1
+
+# Seconds after a failed fit before a request starts another one
+REFIT_BACKOFF = 30
+
+
+class ModelUnavailable(RuntimeError):
+    """
+    Raised when no model has been fitted yet for the dataset (a fit is then running).
+    """
+
+
+class PopularityModel:
+    """
+    A fitted popularity regression.
+
+    Args:
+        features: Names of the predictors, in coefficient order.
+        coefficients: One slope per feature.
+        genres: The genres seen in training.
+        genre_effects: Intercept of each genre.
+        fingerprint: Version of the dataset it was fitted on.
+        stats: Fit statistics (``n``, ``r_squared``, ``rmse``, ``fitted_at``...).
+    """
+
+    def __init__(self, features, coefficients, genres, genre_effects, fingerprint, stats=None):
+        self.features = list(features)
+        self.coefficients = np.asarray(coefficients, dtype='float64')
+        self.genres = pd.Index(genres)
+        self.genre_effects = np.asarray(genre_effects, dtype='float64')
+        self.fingerprint = fingerprint
+        self.stats = dict(stats or {})
+        # Intercept of a track of unknown genre: the mean effect, weighted by tracks
+        self.mean_effect = float(self.stats.get('mean_effect', self.genre_effects.mean() if len(genres) else 0.0))
+
+    def design_matrix(self, df):
+        """
+        Returns the (n, features) float64 matrix of ``df``; raises ValueError when a feature
+        is missing, not numeric or infinite (missing values are NaN).
+        """
+        missing = [feature for feature in self.features if feature not in df.columns]
+        if missing:
+            raise ValueError(f"missing features: {', '.join(missing)}")
+        try:
+            matrix = df[self.features].to_numpy(dtype='float64', na_value=np.nan)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"features must be numbers: {e}") from e
+        infinite = np.isinf(matrix).any(axis=0)
+        if infinite.any():
+            names = ', '.join(feature for feature, bad in zip(self.features, infinite) if bad)
+            raise ValueError(f"features must be finite numbers: {names}")
+        return matrix
+
+    def predict(self, df):
+        """
+        Predicts the popularity of every row of ``df``.
+
+        ``df`` needs the model features; its ``track_genre`` column is optional, and rows
+        without a genre, or with one unseen in training, get the mean genre effect.
+        Rows with a missing feature are predicted as NaN.
+
+        Returns:
+            A float64 array, clipped to the 0-100 popularity scale.
+        """
+        matrix = self.design_matrix(df)
+        intercepts = np.full(len(df), self.mean_effect)
+        if GENRE_COLUMN in df.columns:
+            codes = self.genres.get_indexer(df[GENRE_COLUMN].astype(object))
+            known = codes >= 0
+            intercepts[known] = self.genre_effects[codes[known]]
+        return np.clip(matrix @ self.coefficients + intercepts, 0, 100)
+
+    def describe(self):
+        return {
+            'fingerprint': self.fingerprint,
+            'coefficients': dict(zip(self.features, self.coefficients.tolist())),
+            'genre_effects': dict(zip(self.genres.astype(str), self.genre_effects.tolist())),
+            **self.stats,
+        }
+
+    def save(self, path):
+        """
+        Writes the model to a JSON file, atomically.
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'model_version': MODEL_VERSION, **self.describe()}, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads a model written by ``save``; returns None when the file is missing, unreadable
+        or from another MODEL_VERSION.
+        """
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.pop('model_version', None) != MODEL_VERSION:
+            return None
+        coefficients, effects = data.pop('coefficients'), data.pop('genre_effects')
+        return cls(list(coefficients), list(coefficients.values()), list(effects), list(effects.values()),
+                   data.pop('fingerprint'), data)
+
+
+def fit_popularity_model(df, fingerprint=None):
+    """
+    Fits the popularity regression on a tracks DataFrame with statsmodels OLS.
+
+    Rows with a missing predictor or popularity are left out.
+
+    Returns:
+        A PopularityModel.
+    """
+    # Imported here: statsmodels is slow to import and only needed to fit
+    import statsmodels.api as sm
+
+    features = [feature for feature in PREDICTORS if feature in df.columns]
+    matrix = df[features].to_numpy(dtype='float64', na_value=np.nan)
+    target = df[TARGET].to_numpy(dtype='float64', na_value=np.nan)
+    codes, genres = pd.factorize(df[GENRE_COLUMN].astype(str), sort=True)
+    valid = ~np.isnan(matrix).any(axis=1) & ~np.isnan(target) & (codes >= 0)
+    matrix, target, codes = matrix[valid], target[valid], codes[valid]
+
+    # Genre means of every column, then the values centred within their genre
+    counts = np.bincount(codes, minlength=len(genres)).astype('float64')
+    present = counts > 0
+    counts[~present] = 1.0
+    target_means = np.bincount(codes, weights=target, minlength=len(genres)) / counts
+    feature_means = np.column_stack([np.bincount(codes, weights=matrix[:, j], minlength=len(genres))
+                                     for j in range(matrix.shape[1])]) / counts[:, None]
+    result = sm.OLS(target - target_means[codes], matrix - feature_means[codes]).fit()
+    coefficients = np.asarray(result.params)
+    effects = target_means - feature_means @ coefficients
+
+    residuals = target - (matrix @ coefficients + effects[codes])
+    total = ((target - target.mean()) ** 2).sum()
+    stats = {
+        'n': int(len(target)),
+        'r_squared': float(1 - (residuals ** 2).sum() / total) if total > 0 else 0.0,
+        'rmse': float(np.sqrt((residuals ** 2).mean())) if len(target) else 0.0,
+        'mean_effect': float(np.average(effects[present], weights=counts[present])) if present.any() else 0.0,
+        'fitted_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+    }
+    return PopularityModel(features, coefficients, genres[present], effects[present], fingerprint, stats)
+
+
+class PredictionService:
+    """
+    Holds the popularity model of one application and refits it when the dataset changes.
+
+    Fitting runs in a background thread; meanwhile requests keep the previous model (or get
+    ModelUnavailable when there is none yet). A failed fit is retried by a request coming
+    REFIT_BACKOFF seconds later. A fitted model is saved to ``path``, from
+    which the other workers, and restarts, load it instead of fitting again.
+
+    Args:
+        path: JSON file of the model, or None to keep it in memory only.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._model = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._fitting = None  # Fingerprint being fitted
+        self._checked = None  # Fingerprint last looked up in the saved model
+        self._error = None
+        self._retry_at = 0.0  # Monotonic time before which a failed fit is not retried
+
+    def init_app(self, app):
+        app.extensions['prediction_service'] = self
+
+    def model(self, snapshot):
+        """
+        Returns the model of ``snapshot``'s dataset version, or the previous one while the
+        new one is being fitted.
+
+        Raises:
+            ModelUnavailable: When there is no model at all yet.
+        """
+        model = self._model
+        if ((model is None or model.fingerprint != snapshot.fingerprint) and self._checked != snapshot.fingerprint
+                and time.monotonic() >= self._retry_at):
+            # Once per dataset version: another worker (or a previous run) may have saved it
+            self._checked = snapshot.fingerprint
+            stored = PopularityModel.load(self.path) if self.path else None
+            if stored is not None and (model is None or stored.fingerprint == snapshot.fingerprint):
+                self._model = model = stored
+            if model is None or model.fingerprint != snapshot.fingerprint:
+                self.refit(snapshot)
+        if model is None:
+            message = "The popularity model is being fitted, retry shortly."
+            if self._error is not None:
+                message = f"The popularity model could not be fitted: {self._error}"
+            raise ModelUnavailable(message)
+        return model
+
+    def refit(self, snapshot):
+        """
+        Starts fitting a model on ``snapshot`` in a daemon thread, unless that version is
+        already being fitted, and returns the thread.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                if self._fitting == snapshot.fingerprint:
+                    return self._thread
+            self._fitting = snapshot.fingerprint
+            self._thread = threading.Thread(target=self._fit, args=(snapshot,), name='model-fit', daemon=True)
+            self._thread.start()
+            return self._thread
+
+    def _fit(self, snapshot):
+        start = time.perf_counter()
+        try:
+            model = fit_popularity_model(snapshot.frame, snapshot.fingerprint)
+        except Exception as e:
+            # The error may be transient (e.g. MemoryError): a request after REFIT_BACKOFF
+            # seconds looks the version up and fits it again
+            with self._lock:
+                self._error, self._checked = e, None
+                self._retry_at = time.monotonic() + REFIT_BACKOFF
+            print(f"Popularity model fit failed: {e}")
+            return
+        with self._lock:
+            # A fit of an older version finishing late must not replace a newer model
+            if self._fitting != snapshot.fingerprint and self._model is not None:
+                return
+            self._model, self._error = model, None
+        if self.path:
+            try:
+                model.save(self.path)
+            except OSError as e:
+                print(f"Could not save the popularity model: {e}")
+        print(f"Popularity model fitted on {model.stats['n']} tracks in {time.perf_counter() - start:.2f}s "
+              f"(R² {model.stats['r_squared']:.3f})")
+
+
+def get_prediction_service():
+    """
+    Returns the prediction service of the current application.
+    """
+    return current_app.extensions['prediction_service']
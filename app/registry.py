@@ -0,0 +1,191 @@
+import os
+import threading
+import time
+
+from flask import current_app
+
+from . import storage
+from .snapshot import as_snapshot
+
+
+class DatasetUnavailable(RuntimeError):
+    """
+    Raised when the dataset could not be loaded.
+    """
+
+
+class DatasetRegistry:
+    """
+    Owns the dataset of one Flask application.
+
+    The data is loaded on first use, or ahead of time by ``warm_up`` in a background
+    thread, so creating the application never blocks on disk or network I/O.
+    ``reload`` builds a new snapshot and swaps it in atomically: requests already
+    running keep the snapshot they started with.
+
+    Batches of new tracks are stored as delta files in ``delta_dir`` (see ``append`` and
+    the ``ingest`` command). Every process checks the directory at most every
+    ``poll_interval`` seconds and appends the batches it has not seen yet to its snapshot
+    incrementally, so no restart or full reload is needed.
+
+    Args:
+        loader: Callable returning a DataFrame or a DatasetSnapshot (or None when the data is unavailable).
+        delta_dir: Directory of the ingested batches, or None to disable ingestion.
+        poll_interval: Seconds between two checks of ``delta_dir``.
+    """
+
+    def __init__(self, loader, delta_dir=None, poll_interval=30):
+        self._loader = loader
+        self.delta_dir = delta_dir
+        self.poll_interval = poll_interval
+        self._snapshot = None
+        self._applied = ()
+        self._checked_at = 0.0
+        self._error = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._warm_up_thread = None
+
+    def init_app(self, app):
+        app.extensions['dataset_registry'] = self
+
+    @property
+    def ready(self):
+        return self._snapshot is not None
+
+    def _load(self):
+        start = time.perf_counter()
+        data = self._loader()
+        if data is None:
+            raise DatasetUnavailable("The dataset could not be loaded.")
+        snapshot, applied = self._apply_deltas(as_snapshot(data).prepare(), ())
+        print(f"Dataset {snapshot.fingerprint} loaded in {time.perf_counter() - start:.2f}s")
+        return snapshot, applied
+
+    def _apply_deltas(self, snapshot, applied):
+        # Appends the delta files not in ``applied``, in ingestion order
+        applied = list(applied)
+        for path in storage.list_deltas(self.delta_dir):
+            name = os.path.basename(path)
+            if name not in applied:
+                snapshot = snapshot.append(storage.read_delta(path)).prepare()
+                applied.append(name)
+        self._checked_at = time.monotonic()
+        return snapshot, tuple(applied)
+
+    def get(self):
+        """
+        Returns the current snapshot, loading the dataset if needed.
+        Concurrent callers wait for a single load.
+        """
+        snapshot = self._snapshot
+        if snapshot is not None:
+            if self.delta_dir and time.monotonic() - self._checked_at > self.poll_interval:
+                return self.refresh()
+            return snapshot
+        with self._lock:
+            if self._snapshot is None:
+                try:
+                    self._snapshot, self._applied = self._load()
+                    self._error = None
+                except Exception as e:
+                    self._error = e
+                    raise
+            return self._snapshot
+
+    def warm_up(self):
+        """
+        Starts loading the dataset in a daemon thread and returns the thread.
+        """
+        def run():
+            try:
+                self.get()
+            except Exception as e:
+                print(f"Dataset warm-up failed: {e}")
+
+        if self._warm_up_thread is None or not self._warm_up_thread.is_alive():
+            self._warm_up_thread = threading.Thread(target=run, name='dataset-warm-up', daemon=True)
+            self._warm_up_thread.start()
+        return self._warm_up_thread
+
+    def reload(self):
+        """
+        Loads the dataset again and atomically replaces the current snapshot.
+        The previous snapshot keeps serving requests until the new one is ready.
+        """
+        snapshot, applied = self._load()
+        with self._lock:
+            self._snapshot, self._applied = snapshot, applied
+            self._error = None
+        return snapshot
+
+    def refresh(self):
+        """
+        Appends the delta files ingested since the last check and returns the current snapshot.
+        Only one thread refreshes at a time; the others keep using the current snapshot.
+        """
+        if self._snapshot is None or not self._refresh_lock.acquire(blocking=False):
+            return self.get() if self._snapshot is None else self._snapshot
+        try:
+            snapshot, applied = self._apply_deltas(self._snapshot, self._applied)
+            if applied != self._applied:
+                with self._lock:
+                    self._snapshot, self._applied = snapshot, applied
+                print(f"Dataset {snapshot.fingerprint}: appended {len(applied)} batches in total")
+            return self._snapshot
+        finally:
+            self._refresh_lock.release()
+
+    def append(self, batch):
+        """
+        Ingests a batch of new tracks: validates it, stores it as a delta file (when the
+        registry has a ``delta_dir``) so that other processes pick it up, and swaps in a
+        snapshot including it.
+
+        Returns:
+            The new snapshot.
+        """
+        batch = storage.validate_batch(batch)
+        path = storage.write_delta(batch, self.delta_dir) if self.delta_dir else None
+        with self._refresh_lock:
+            if path is not None:
+                self.get()
+                snapshot, applied = self._apply_deltas(self._snapshot, self._applied)
+            else:
+                snapshot, applied = self.get().append(batch).prepare(), self._applied
+            with self._lock:
+                self._snapshot, self._applied = snapshot, applied
+        return snapshot
+
+    def status(self):
+        """
+        Describes the registry state for the readiness endpoint.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            return {
+                'ready': False,
+                'loading': self._warm_up_thread is not None and self._warm_up_thread.is_alive(),
+                'error': str(self._error) if self._error else None,
+            }
+        return {
+            'ready': True,
+            'version': snapshot.fingerprint,
+            'rows': len(snapshot),
+            'loaded_at': snapshot.loaded_at,
+            'batches': len(self._applied),
+        }
+
+
+def get_registry():
+    """
+    Returns the dataset registry of the current application.
+    """
+    return current_app.extensions['dataset_registry']
+
+
+def get_dataset():
+    """
+    Returns the current dataset snapshot of the current application.
+    """
+    return get_registry().get()
@@ -0,0 +1,104 @@
+import gzip
+import hashlib
+
+from flask import current_app, request
+
+from . import cache
+from .artifacts import get_artifact_cache
+from .metrics import metrics
+
+try:
+    import brotli  # Optional: smaller than gzip, preferred by browsers that accept it
+except ImportError:
+    brotli = None
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+
+
+def available_encodings():
+    """
+    Content encodings the server can produce, in order of preference.
+    """
+    return (['br'] if brotli is not None else []) + ['gzip', 'identity']
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)  # mtime=0: identical bytes each time
+    return body
+
+
+def variant_etag(tag, encoding):
+    # Strong ETags must differ between the encodings of a resource
+    return tag if encoding == 'identity' else f"{tag}.{encoding}"
+
+
+def _stored_body(key, encoding, build):
+    # Looks up one encoding of a body in both cache tiers, building and compressing it on a miss
+    variant_key = f"response:{key}:{encoding}"
+    body = cache.get(variant_key)
+    metrics.cache_lookup('response', 'memory', body is not None)
+    if body is not None:
+        return body
+    artifacts = get_artifact_cache()
+    if artifacts is not None:
+        body = artifacts.get(variant_key)
+        metrics.cache_lookup('response', 'shared', body is not None)
+    if body is None:
+        body = build()
+        with metrics.stage('compress'):
+            body = compress(body, encoding)
+        if artifacts is not None:
+            artifacts.set(variant_key, body)
+    cache.set(variant_key, body)
+    return body
+
+
+def precompressed_response(key, tag, build, mimetype):
+    """
+    Returns a response whose gzip/brotli variants are compressed once and then cached.
+
+    The response carries a strong ETag derived from ``tag``. When the client already has
+    the current version (``If-None-Match``), a bodiless ``304 Not Modified`` is returned
+    without calling ``build``.
+
+    Args:
+        key: Cache key of the content (e.g. a chart cache key); each encoding is stored under
+            ``response:<key>:<encoding>`` in the Flask cache and the artifact cache.
+        tag: ETag of the content, which must change whenever the content does.
+        build: Callable returning the uncompressed body as bytes, called on a cache miss only.
+        mimetype: Content type of the body.
+    """
+    encoding = request.accept_encodings.best_match(available_encodings()) or 'identity'
+    response = current_app.response_class(mimetype=mimetype)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'no-cache'  # Cache, but revalidate: a 304 costs almost nothing
+
+    # A client holding any encoding of the current version may keep it
+    if any(request.if_none_match.contains_weak(variant_etag(tag, variant)) for variant in available_encodings()):
+        response.status_code = 304
+        response.set_etag(variant_etag(tag, encoding))
+        return response
+
+    if encoding == 'identity':
+        body = _stored_body(key, encoding, build)
+    else:
+        body = _stored_body(key, encoding, lambda: _stored_body(key, 'identity', build))
+        response.headers['Content-Encoding'] = encoding
+    response.set_data(body)
+    response.set_etag(variant_etag(tag, encoding))
+    return response
+
+
+def content_tag(*parts):
+    """
+    Builds an ETag from strings (or bytes) identifying a content, e.g. its cache key.
+    """
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part.encode() if isinstance(part, str) else part)
+        digest.update(b'\0')
+    return digest.hexdigest()[:20]
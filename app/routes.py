@@ -1,69 +1,292 @@
-from flask import Blueprint, render_template, request, redirect, url_for
-from .models import (load_data, analyze_genre_popularity, 
-                     analyze_music_features_by_genre, analyze_sales_correlations, 
-                     analyze_explicit_content, analyze_duration_by_genre, 
-                     analyze_feature_correlation_heatmap, analyze_tempo_by_genre,
-                     analyze_energy_vs_danceability, analyze_popularity_over_time,
-                     analyze_top_artists_by_popularity, analyze_valence_vs_popularity,
-                     analyze_top_popular_tracks, analyze_energy_by_genre,
-                     analyze_loudness_vs_energy, analyze_acousticness_distribution)
+import json
+import math
 
-main = Blueprint('main', __name__)
+import pandas as pd
+from flask import Blueprint, current_app, render_template, request, redirect, url_for, jsonify
+from .aggregates import DISTRIBUTION_GROUPS, DISTRIBUTION_MODES, density_grid
+from .charts import CHARTS, chart_document, choice_param, genres_param, parse_chart_params, parse_filter, render_chart
+from .metrics import metrics
+from .prediction import ModelUnavailable, get_prediction_service
+from .registry import DatasetUnavailable, get_dataset, get_registry
+from .responses import content_tag, precompressed_response
 
-# Load the dataset once when the application starts
-df = load_data()
+main = Blueprint('main', __name__)
 
 @main.route('/')
 def index():
     return render_template('index.html')
 
+@main.route('/ready')
+def ready():
+    # Readiness probe: 200 once the dataset is loaded, 503 while it is still loading
+    status = get_registry().status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+@main.route('/api/charts')
+def chart_index():
+    # Available charts and the query parameters each one accepts
+    return jsonify({name: sorted(chart.params) for name, chart in CHARTS.items()})
+
+@main.route('/api/charts/<name>')
+def chart(name):
+    """
+    Returns one chart as JSON: its figure, interpretation, normalised parameters and the
+    version of the data it was computed from. Parameters are validated per chart (see
+    ``charts.CHARTS``), e.g. ``/api/charts/music_features_by_genre?feature=energy&top_n=10``.
+    Every chart also accepts row filters (see ``charts.parse_filter``) and is then computed
+    over the matching tracks only, e.g. ``/api/charts/tempo_by_genre?explicit=true&popularity_min=71``.
+    """
+    if name not in CHARTS:
+        return jsonify(error=f"unknown chart '{name}'"), 404
+    snapshot = get_dataset()
+    try:
+        params = parse_chart_params(name, request.args, snapshot)
+        row_filter = parse_filter(request.args, snapshot)
+        if row_filter is not None:
+            snapshot = snapshot.filtered(row_filter)
+    except ValueError as e:  # ChartParameterError, or filters the snapshot cannot apply
+        return jsonify(error=str(e)), 400
+    filters = row_filter.as_params() if row_filter is not None else {}
+    if not len(snapshot):
+        return jsonify(error="no tracks match the filters", filter=filters), 404
+
+    # Version of the data the chart reads: the dataset fingerprint, or the version of the
+    # requested genres for charts restricted to a genre subset
+    function = CHARTS[name].function
+    version = function.data_version(snapshot, **params)
+
+    def build():
+        graph_json, interpretation = render_chart(name, snapshot, params)
+        return chart_document(name, version, params, filters, len(snapshot), graph_json, interpretation)
+
+    # The cache key identifies the data version, parameters and encoding, so a client
+    # revalidating an unchanged chart gets a 304 without the chart being computed
+    key = function.cache_key(snapshot, **params)
+    tag = f"{version}-{content_tag(key)}"
+    return precompressed_response(key, tag, build, 'application/json')
+
+# Bin counts accepted by /api/distribution; each one is a table kept with the dataset
+DISTRIBUTION_BINS = ('10', '20', '50', '100')
+
+@main.route('/api/distribution/<feature>')
+def distribution(feature):
+    """
+    Returns the distribution of a numeric feature as bar data: the bin edges and the count
+    of tracks in each bin, read from the tables precomputed with the dataset, so the
+    response size depends on the bins, not on the number of tracks.
+
+    Query parameters: ``bins`` (10, 20, 50 or 100, default 50), ``mode`` (``fixed``
+    equal-width bins or ``adaptive`` bins holding about as many tracks each), ``by``
+    (``genre`` or ``explicit``, one series per group) and ``genre`` (comma-separated genres
+    to count), e.g. ``/api/distribution/energy?by=explicit&genre=pop,rock``.
+    """
+    snapshot = get_dataset()
+    if feature not in snapshot.features:
+        return jsonify(error=f"unknown feature '{feature}'"), 404
+    params = {'bins': 50, 'mode': 'fixed', 'by': None, 'genres': None}
+    parsers = {'bins': choice_param(*DISTRIBUTION_BINS), 'mode': choice_param(*DISTRIBUTION_MODES),
+               'by': choice_param(*DISTRIBUTION_GROUPS), 'genre': genres_param}
+    for param, parse in parsers.items():
+        if request.args.get(param):
+            try:
+                params['genres' if param == 'genre' else param] = parse(request.args[param], snapshot)
+            except ValueError as e:
+                return jsonify(error=f"{param}: {e}"), 400
+    params['bins'] = int(params['bins'])
+    try:
+        table = snapshot.distribution(feature, **params)
+    except ValueError as e:  # Distributions a streamed dataset does not keep
+        return jsonify(error=str(e)), 400
+
+    def build():
+        body = {
+            'feature': feature, 'version': snapshot.fingerprint, **params,
+            'edges': [round(edge, 6) for edge in table['edges'].tolist()],
+            'groups': [{'name': name, 'counts': counts}
+                       for name, counts in zip(table['names'], table['counts'].tolist())],
+        }
+        return json.dumps(body, separators=(',', ':')).encode()
+
+    key = f"distribution:{snapshot.fingerprint}:{feature}:{content_tag(json.dumps(params, sort_keys=True))}"
+    return precompressed_response(key, f"{snapshot.fingerprint}-{content_tag(key)}", build, 'application/json')
+
+# Similar tracks per query, and query tracks per request, accepted by /api/similar
+MAX_SIMILAR = 100
+MAX_SIMILAR_QUERIES = 100
+
+@main.route('/api/similar/<track_id>')
+def similar_track(track_id):
+    """
+    Returns the tracks whose audio features are closest to those of ``track_id``.
+
+    Query parameters: ``k`` (number of tracks, 1-100, default 10) and the row filters of
+    the charts (see ``charts.parse_filter``), which the similar tracks must match, e.g.
+    ``/api/similar/5SuOikwiRyPMVoIQDJUgSV?k=20&genre=pop&explicit=false``.
+    """
+    response = _similar([track_id])
+    if isinstance(response, dict):
+        result = response['results'][0]
+        if result['similar'] is None:
+            return jsonify(error=f"unknown track '{track_id}'"), 404
+        return jsonify({**result, 'k': response['k'], 'filter': response['filter']})
+    return response
+
+@main.route('/api/similar')
+def similar_tracks():
+    """
+    Batch version of ``/api/similar/<track_id>``: ``track_ids`` is a comma-separated list
+    of up to 100 ids, answered with one search. Unknown ids get ``"similar": null``.
+    """
+    track_ids = [track_id.strip() for track_id in request.args.get('track_ids', '').split(',') if track_id.strip()]
+    if not track_ids or len(track_ids) > MAX_SIMILAR_QUERIES:
+        return jsonify(error=f"track_ids must list 1 to {MAX_SIMILAR_QUERIES} track ids"), 400
+    response = _similar(track_ids)
+    return jsonify(response) if isinstance(response, dict) else response
+
+def _similar(track_ids):
+    snapshot = get_dataset()
+    try:
+        k = int(request.args.get('k', 10))
+        if not 1 <= k <= MAX_SIMILAR:
+            raise ValueError(f"k must be between 1 and {MAX_SIMILAR}")
+        row_filter = parse_filter(request.args, snapshot)
+        results = snapshot.similar_tracks(track_ids, k, row_filter)
+    except ValueError as e:  # Also raised by a streamed dataset
+        return jsonify(error=str(e)), 400
+    return {
+        'k': k,
+        'filter': row_filter.as_params() if row_filter is not None else {},
+        'results': [{'track_id': track_id, 'similar': None if similar is None else similar.to_dict('records')}
+                    for track_id, similar in zip(track_ids, results)],
+    }
+
+# Query parameters of /api/density; the other ones are row filters
+DENSITY_PARAMS = ('x', 'y', 'bins', 'x_min', 'x_max', 'y_min', 'y_max')
+
+@main.route('/api/density')
+def density():
+    """
+    Returns a 2D histogram of two features, restricted to an optional x/y viewport.
+
+    Query parameters: ``x`` and ``y`` (feature names), ``bins`` (per axis, 10-400) and
+    ``x_min``/``x_max``/``y_min``/``y_max``. The dashboard calls it when a density chart
+    is zoomed so the visible area is re-binned at full resolution. Row filters (see
+    ``charts.parse_filter``) restrict the tracks counted.
+    """
+    snapshot = get_dataset()
+    try:
+        row_filter = parse_filter({param: value for param, value in request.args.items()
+                                   if param not in DENSITY_PARAMS}, snapshot)
+        if row_filter is not None:
+            snapshot = snapshot.filtered(row_filter)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    x, y = request.args.get('x'), request.args.get('y')
+    if x not in snapshot.features or y not in snapshot.features:
+        return jsonify(error=f"x and y must be among: {', '.join(snapshot.features)}"), 400
+    try:
+        bins = _bins_arg()
+        x_range = _range_arg('x')
+        y_range = _range_arg('y')
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    with metrics.stage('aggregate'):
+        grid = density_grid(snapshot.frame, x, y, bins=bins, x_range=x_range, y_range=y_range)
+    return jsonify(
+        x=grid['x'].tolist(),
+        y=grid['y'].tolist(),
+        z=[[count or None for count in row] for row in grid['z'].tolist()],
+        x_range=grid['x_range'],
+        y_range=grid['y_range'],
+    )
+
+def _bins_arg():
+    try:
+        bins = int(request.args.get('bins', 100))
+    except ValueError:
+        raise ValueError("bins must be an integer") from None
+    return min(max(bins, 10), 400)
+
+def _range_arg(axis):
+    low, high = request.args.get(f'{axis}_min'), request.args.get(f'{axis}_max')
+    if low is None and high is None:
+        return None
+    if low is None or high is None:
+        raise ValueError(f"{axis}_min and {axis}_max must be given together")
+    try:
+        low, high = float(low), float(high)
+    except ValueError:
+        raise ValueError(f"{axis}_min and {axis}_max must be numbers") from None
+    if not (math.isfinite(low) and math.isfinite(high) and low < high):
+        raise ValueError(f"{axis}_min and {axis}_max must be finite with {axis}_min < {axis}_max")
+    return low, high
+
+# Tracks scored per /api/predict request
+MAX_PREDICTIONS = 10000
+
+@main.route('/api/predict', methods=['GET', 'POST'])
+def predict():
+    """
+    Predicts the popularity of tracks from their audio features (see ``prediction``).
+
+    POST a JSON object ``{"tracks": [{"danceability": 0.7, "energy": 0.8, ..., "explicit": false,
+    "track_genre": "pop"}, ...]}`` with every feature of the model (listed by GET, which
+    describes the model) and up to 10,000 tracks; ``track_genre`` is optional. All the tracks
+    are scored with one matrix product.
+    """
+    model = get_prediction_service().model(get_dataset())
+    if request.method == 'GET':
+        return jsonify(model.describe())
+    payload = request.get_json(silent=True)
+    tracks = payload.get('tracks') if isinstance(payload, dict) else None
+    if not isinstance(tracks, list) or not tracks or len(tracks) > MAX_PREDICTIONS:
+        return jsonify(error=f"expected a JSON object with a 'tracks' list of 1 to {MAX_PREDICTIONS} tracks"), 400
+    try:
+        predictions = model.predict(pd.DataFrame.from_records(tracks))
+    except (TypeError, ValueError) as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(fingerprint=model.fingerprint,
+                   predictions=[None if math.isnan(value) else round(value, 3) for value in predictions.tolist()])
+
+@main.errorhandler(ModelUnavailable)
+def model_unavailable(error):
+    response = jsonify(error=str(error))
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+@main.errorhandler(DatasetUnavailable)
+def dataset_unavailable(error):
+    return str(error), 503
+
 @main.route('/dashboard')
 def dashboard():
-    # Data analysis functions (using precomputed data where possible)
-    genre_pop_json, genre_pop_interpretation = analyze_genre_popularity(df)
-    danceability_json, danceability_interpretation = analyze_music_features_by_genre(df, 'danceability')
-    correlation_json, correlation_interpretation = analyze_sales_correlations(df)
-    explicit_json, explicit_interpretation = analyze_explicit_content(df)
-    duration_json, duration_interpretation = analyze_duration_by_genre(df)
-    heatmap_json, heatmap_interpretation = analyze_feature_correlation_heatmap(df)
-    tempo_json, tempo_interpretation = analyze_tempo_by_genre(df)
-    energy_danceability_json, energy_danceability_interpretation = analyze_energy_vs_danceability(df)
-    popularity_time_json, popularity_time_interpretation = analyze_popularity_over_time(df)
-    top_artists_json, top_artists_interpretation = analyze_top_artists_by_popularity(df)
-    valence_popularity_json, valence_popularity_interpretation = analyze_valence_vs_popularity(df)
-    top_popular_tracks_json, top_popular_tracks_interpretation = analyze_top_popular_tracks(df)
-    energy_by_genre_json, energy_by_genre_interpretation = analyze_energy_by_genre(df)
-    loudness_vs_energy_json, loudness_vs_energy_interpretation = analyze_loudness_vs_energy(df)
-    acousticness_distribution_json, acousticness_distribution_interpretation = analyze_acousticness_distribution(df)
-
-    return render_template('dashboard.html',
-                           genre_popularity=genre_pop_json,
-                           genre_pop_interpretation=genre_pop_interpretation,
-                           danceability=danceability_json,
-                           danceability_interpretation=danceability_interpretation,
-                           sales_correlations=correlation_json,
-                           sales_correlations_interpretation=correlation_interpretation,
-                           explicit=explicit_json,
-                           explicit_interpretation=explicit_interpretation,
-                           duration=duration_json,
-                           duration_interpretation=duration_interpretation,
-                           heatmap=heatmap_json,
-                           heatmap_interpretation=heatmap_interpretation,
-                           tempo=tempo_json,
-                           tempo_interpretation=tempo_interpretation,
-                           energy_danceability=energy_danceability_json,
-                           energy_danceability_interpretation=energy_danceability_interpretation,
-                           popularity_time=popularity_time_json,
-                           popularity_time_interpretation=popularity_time_interpretation,
-                           top_artists=top_artists_json,
-                           top_artists_interpretation=top_artists_interpretation,
-                           valence_popularity=valence_popularity_json,
-                           valence_popularity_interpretation=valence_popularity_interpretation,
-                           top_popular_tracks=top_popular_tracks_json,
-                           top_popular_tracks_interpretation=top_popular_tracks_interpretation,
-                           energy_by_genre=energy_by_genre_json,
-                           energy_by_genre_interpretation=energy_by_genre_interpretation,
-                           loudness_vs_energy=loudness_vs_energy_json,
-                           loudness_vs_energy_interpretation=loudness_vs_energy_interpretation,
-                           acousticness_distribution=acousticness_distribution_json,
-                           acousticness_distribution_interpretation=acousticness_distribution_interpretation)
\ No newline at end of file
+    # Light shell only: each chart is fetched from /api/charts/<name> when its section is
+    # shown (see loadChartsLazily in scripts.js), so the page never waits for the dataset
+    page = render_template('dashboard.html', chart_url=api_chart_url).encode()
+    tag = content_tag(page)
+    return precompressed_response(f"page:dashboard:{tag}", tag, lambda: page, 'text/html')
+
+def api_chart_url(name, **params):
+    # URL a dashboard chart is fetched from; the static export links its files instead
+    return url_for('main.chart', name=name, **params)
+
+@main.route('/metrics')
+def metrics_endpoint():
+    # Prometheus scrape target; only served when METRICS_ENABLED is set
+    if not metrics.enabled:
+        return "metrics are disabled (METRICS_ENABLED)", 404
+    return current_app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@main.route('/metrics/profile')
+def profile():
+    """
+    Returns the stacks sampled by the profiler (PROFILER_ENABLED) in the collapsed format
+    of flamegraph.pl and speedscope. ``?reset=1`` starts a new profile.
+    """
+    profiler = current_app.extensions.get('profiler')
+    if profiler is None:
+        return "the profiler is disabled (PROFILER_ENABLED)", 404
+    reset = request.args.get('reset', '') in ('1', 'true')
+    return current_app.response_class(profiler.collapsed(reset=reset), mimetype='text/plain')
@@ -0,0 +1,162 @@
+import base64
+import math
+
+import numpy as np
+import plotly.io as pio
+
+from .metrics import metrics
+
+try:
+    import orjson  # noqa: F401  Optional: much faster JSON encoding
+    JSON_ENGINE = 'orjson'
+except ImportError:
+    JSON_ENGINE = 'json'
+
+FLOAT_DTYPES = ('float32', 'float64')
+
+# numpy dtype -> plotly.js typed array type (plotly.js >= 2.28 decodes {"dtype", "bdata"} objects)
+TYPED_ARRAY_DTYPES = {
+    'int8': 'i1', 'uint8': 'u1', 'int16': 'i2', 'uint16': 'u2',
+    'int32': 'i4', 'uint32': 'u4', 'float32': 'f4', 'float64': 'f8',
+}
+
+
+class FigureEncoder:
+    """
+    Serialises Plotly figures to JSON for the dashboard.
+
+    Numeric arrays of at least ``min_binary_size`` values are sent as base64-encoded typed
+    arrays, which plotly.js decodes without parsing decimal text, unless their JSON text would
+    be shorter (short decimals, mostly missing values), as estimated from the values' range
+    and decimals rather than by encoding them twice. Everything else is written as plain
+    JSON, with orjson when it is installed.
+    Configured from the application like ``cache``: see ``init_app``.
+
+    Args:
+        float_dtype: ``'float32'`` (about 7 significant digits, half the size) or ``'float64'``.
+        binary: Send large numeric arrays as typed arrays; plain JSON lists when False.
+        min_binary_size: Smallest array sent as a typed array.
+    """
+
+    def __init__(self, float_dtype='float32', binary=True, min_binary_size=16):
+        self.configure(float_dtype, binary, min_binary_size)
+
+    def configure(self, float_dtype='float32', binary=True, min_binary_size=16):
+        if float_dtype not in FLOAT_DTYPES:
+            raise ValueError(f"float_dtype must be one of {', '.join(FLOAT_DTYPES)}")
+        self.float_dtype = float_dtype
+        self.binary = binary
+        self.min_binary_size = min_binary_size
+
+    def init_app(self, app):
+        self.configure(app.config['FIGURE_FLOAT_DTYPE'], app.config['FIGURE_BINARY_ARRAYS'],
+                       app.config['FIGURE_BINARY_MIN_SIZE'])
+
+    @property
+    def format(self):
+        """
+        Identifies the output format, so charts encoded differently never share a cache entry.
+        """
+        return f"{'b64' if self.binary else 'text'}{self.min_binary_size}-{self.float_dtype}"
+
+    def encode(self, fig):
+        """
+        Returns the JSON of a figure, as ``fig.to_json()`` does.
+        """
+        data, layout, frames = _figure_properties(fig)
+        figure = {'data': [self._encode_value(trace) for trace in data], 'layout': layout}
+        if frames:
+            figure['frames'] = frames
+        return pio.to_json(figure, validate=False, engine=JSON_ENGINE)
+
+    def _encode_value(self, value):
+        if isinstance(value, dict):
+            return {key: self._encode_value(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)) and len(value) >= self.min_binary_size and _is_numeric_list(value):
+            value = np.asarray(value)
+        if isinstance(value, np.ndarray) and value.dtype.kind in 'iuf':
+            return self._encode_array(value)
+        return value
+
+    def _encode_array(self, array):
+        if array.dtype.kind == 'f':
+            # float_dtype bounds the precision; float32 data is never widened
+            itemsize = min(max(array.dtype.itemsize, 4), np.dtype(self.float_dtype).itemsize)
+            array = array.astype(f'float{itemsize * 8}', copy=False)
+        elif array.dtype.itemsize == 8:
+            # plotly.js has no 64-bit integer arrays
+            info = np.iinfo('int32')
+            in_range = array.size == 0 or (array.min() >= info.min and array.max() <= info.max)
+            array = array.astype('int32' if in_range else 'float64')
+
+        if not self.binary or array.size < self.min_binary_size:
+            return array
+        little_endian = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<'))  # As read by plotly.js
+        spec = {'dtype': TYPED_ARRAY_DTYPES[array.dtype.name], 'bdata': base64.b64encode(little_endian).decode('ascii')}
+        if array.ndim > 1:
+            spec['shape'] = list(array.shape)
+        # Short decimals (e.g. 0.25) or mostly-missing values (null) can be smaller as text
+        if _text_size(array) < len(spec['bdata']):
+            return array
+        return spec
+
+
+def _figure_properties(fig):
+    # The traces, layout and frames of a figure. plotly 5 keeps them as plain dicts, read
+    # here without the deep copy of ``fig.to_plotly_json()`` (half of the encoding time):
+    # traces are rebuilt by _encode_value and nothing is modified. These attributes are
+    # private, so a plotly without them takes the public path.
+    frames = getattr(fig, '_frame_objs', None)
+    if (hasattr(fig, '_data') and hasattr(fig, '_layout') and frames is not None
+            and all(hasattr(frame, '_props') for frame in frames)):
+        return fig._data, fig._layout, [frame._props for frame in frames]
+    figure = fig.to_plotly_json()
+    return figure['data'], figure['layout'], figure.get('frames', [])
+
+
+def _text_size(array):
+    # Upper estimate of the length of an array as JSON text, from its largest magnitude and
+    # the decimals its values need (at most 2; longer decimals always make text larger)
+    values = array.ravel()
+    size = 0
+    if values.dtype.kind == 'f':
+        missing = np.isnan(values)
+        size += 5 * int(missing.sum())  # 'null,'
+        values = values[~missing]
+        if not np.isfinite(values).all():
+            return math.inf
+    if not values.size:
+        return size
+    magnitude = float(np.abs(values).max())
+    digits = len(str(int(magnitude))) + (values.min() < 0) + 1  # Integer part, sign and comma
+    if values.dtype.kind != 'f':
+        return size + values.size * digits
+    scale = max(magnitude, 1.0) * np.finfo(values.dtype).eps * 4
+    for decimals in range(3):
+        scaled = values * 10 ** decimals
+        if (np.abs(scaled - np.rint(scaled)) <= scale * 10 ** decimals).all():
+            # Integral floats are written with '.0'
+            return size + values.size * (digits + max(decimals, 1) + 1)
+    return math.inf
+
+
+def _is_numeric_list(values):
+    return all(isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool)
+               for value in values)
+
+
+def decode_typed_array(spec):
+    """
+    Reverses the typed array encoding, e.g. to inspect a figure in tests.
+    """
+    array = np.frombuffer(base64.b64decode(spec['bdata']), dtype=np.dtype(spec['dtype']).newbyteorder('<'))
+    return array.reshape(spec['shape']) if 'shape' in spec else array
+
+
+# Encoder shared by the analysis functions, configured by create_app
+encoder = FigureEncoder()
+
+
+def figure_to_json(fig):
+    with metrics.stage('serialize'):
+        return encoder.encode(fig)
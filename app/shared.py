@@ -0,0 +1,224 @@
+"""
+Dataset shared by the worker processes of a host through a memory-mapped Arrow IPC file.
+
+The first worker to start (or ``flask publish-dataset``) loads the dataset, computes the
+aggregates of the dashboard charts and writes both to one uncompressed Arrow IPC file: the
+columns as Arrow buffers, the aggregates pickled in the schema metadata. Every worker then
+maps that file read-only. The numeric columns, most of the table, become numpy arrays over
+the mapped pages, which the operating system shares between processes: an extra worker
+only pays for the categorical codes, the boolean column and the aggregates. The arrays of
+the similar-track index (standardized feature matrix, rows sorted by track id) are stored
+as extra columns and mapped the same way. Starting a worker parses nothing.
+
+The mapped arrays are read-only, so an in-place write raises instead of corrupting the
+data other workers see; with pandas copy-on-write (``PANDAS_COPY_ON_WRITE``), writes
+through ``DatasetSnapshot.frame`` copy the column first.
+"""
+import json
+import os
+import pickle
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+import pyarrow as pa
+
+from . import storage
+from .aggregates import ready_for_threads
+from .locks import acquire_lock_file, release_lock_file
+from .similarity import INDEX_ARRAYS, SimilarityIndex
+from .snapshot import DatasetSnapshot, as_snapshot
+
+# Bump whenever the layout of the shared file or of its state changes
+SHARED_VERSION = 2
+
+STATE_KEY = b'music_insights.snapshot'
+
+# Columns holding the arrays of the similarity index, next to those of the frame
+SIMILARITY_COLUMNS = {name: f"__similarity_{name}__" for name in INDEX_ARRAYS}
+
+# Attributes of a prepared snapshot stored with the columns, besides its derived structures
+SHARED_ATTRIBUTES = ('fingerprint', 'genre_versions', 'genre_stats', 'features', 'correlation_stats')
+
+# Seconds after which the publish lock of a worker that died is taken over
+PUBLISH_LOCK_TIMEOUT = 900
+
+# Seconds between two checks of a worker waiting for another one to publish the file
+PUBLISH_POLL_INTERVAL = 0.2
+
+
+def precompute(snapshot):
+    """
+    Computes the structures the dashboard charts read (genre statistics, box summaries,
+    correlations, density grids...), so that they are written once for every worker.
+    """
+    from .charts import CHARTS, DASHBOARD_CHARTS  # Imported here: charts depend on the models
+
+    snapshot.prepare()
+    snapshot.correlation_stats
+    snapshot.similarity_index
+    for name, params in DASHBOARD_CHARTS:
+        CHARTS[name].function.uncached(snapshot, **params)
+    return snapshot
+
+
+def write_shared(snapshot, path, source=None):
+    """
+    Writes a snapshot (its frame, SHARED_ATTRIBUTES and derived structures) to an Arrow IPC
+    file, atomically.
+
+    Args:
+        snapshot: A DatasetSnapshot, ideally ``precompute``-d.
+        path: The shared file.
+        source: Description of the data source (see ``storage.source_fingerprint``), checked
+            by ``is_shared_fresh``.
+    """
+    state = {name: getattr(snapshot, name) for name in SHARED_ATTRIBUTES}
+    state['derived'] = dict(snapshot._derived)
+    table = pa.Table.from_pandas(snapshot._frame, preserve_index=False)
+    if 'similarity_index' in snapshot.__dict__:
+        for name, values in snapshot.similarity_index.arrays.items():
+            column = pa.array(values.reshape(-1))
+            if values.ndim == 2:  # One fixed-size list per row: the matrix stays row-major
+                column = pa.FixedSizeListArray.from_arrays(column, values.shape[1])
+            table = table.append_column(SIMILARITY_COLUMNS[name], column)
+    metadata = dict(table.schema.metadata or {})
+    metadata[STATE_KEY] = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+    metadata[storage.METADATA_KEY] = json.dumps({
+        'shared_version': SHARED_VERSION, 'schema_version': storage.SCHEMA_VERSION, 'fingerprint': source})
+    table = table.replace_schema_metadata(metadata)
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp_path, path)  # Workers still mapping the previous file keep reading it
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _read_metadata(path):
+    try:
+        with pa.memory_map(path, 'r') as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+    except (OSError, pa.ArrowException):
+        return None
+    if storage.METADATA_KEY not in metadata:
+        return None
+    return json.loads(metadata[storage.METADATA_KEY])
+
+
+def is_shared_fresh(path, source=None):
+    """
+    Checks that the shared file exists, has the current layout and schema, and was
+    written from ``source``.
+    """
+    metadata = _read_metadata(path) if os.path.exists(path) else None
+    if metadata is None:
+        return False
+    return (metadata.get('shared_version') == SHARED_VERSION and
+            metadata.get('schema_version') == storage.SCHEMA_VERSION and metadata.get('fingerprint') == source)
+
+
+def map_shared(path):
+    """
+    Maps a shared file read-only and returns its DatasetSnapshot, aggregates included.
+    """
+    with pa.memory_map(path, 'r') as source:
+        table = pa.ipc.open_file(source).read_all()  # Zero-copy: the buffers point into the mapping
+    state = pickle.loads(table.schema.metadata[STATE_KEY])
+    arrays = {name: _mapped_array(table.column(column)) for name, column in SIMILARITY_COLUMNS.items()
+              if column in table.column_names}
+    table = table.drop_columns([SIMILARITY_COLUMNS[name] for name in arrays])
+    # split_blocks keeps each numeric column a view of its Arrow buffer instead of copying
+    # them into 2D blocks
+    frame = table.to_pandas(split_blocks=True, types_mapper=storage.arrow_types)
+    for column in frame.columns:
+        if isinstance(frame[column].dtype, pd.CategoricalDtype):
+            frame[column] = storage.dictionary_encode(frame[column])
+
+    snapshot = DatasetSnapshot(frame, fingerprint=state.pop('fingerprint'))
+    snapshot._derived.update(state.pop('derived'))
+    state['genre_stats'] = ready_for_threads(state['genre_stats'])
+    snapshot.__dict__.update(state)
+    if arrays:
+        snapshot.similarity_index = SimilarityIndex(frame, arrays=arrays)
+    return snapshot
+
+
+def _mapped_array(column):
+    # Zero-copy numpy view of a column written as one chunk; fixed-size lists become 2D
+    chunk = column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+    if pa.types.is_fixed_size_list(chunk.type):
+        return chunk.flatten().to_numpy().reshape(-1, chunk.type.list_size)
+    return chunk.to_numpy()
+
+
+class SharedDataset:
+    """
+    Dataset loader of the registry when ``DATASET_SHARED_PATH`` is set: maps the shared
+    file, writing it first when it is missing or stale. Workers starting together write
+    it once: the one holding the ``<path>.lock`` file publishes, the others wait for it.
+
+    Args:
+        path: The shared file.
+        loader: Callable returning the dataset (DataFrame or snapshot), called when the file
+            has to be (re)written.
+        source_path: The file the dataset is loaded from: the shared file is rewritten when
+            it changes. When None (or missing), the shared file is only written once.
+    """
+
+    def __init__(self, path, loader, source_path=None):
+        self.path = path
+        self.loader = loader
+        self.source_path = source_path
+
+    def source(self):
+        if self.source_path and os.path.exists(self.source_path):
+            return storage.source_fingerprint(self.source_path)
+        return None
+
+    def __call__(self):
+        source = self.source()
+        if not is_shared_fresh(self.path, source):
+            with self.publish_lock():
+                # Published by another worker while this one waited for the lock?
+                if not is_shared_fresh(self.path, source) and self.publish() is None:
+                    return None
+        return map_shared(self.path)
+
+    @contextmanager
+    def publish_lock(self):
+        """
+        Holds the ``<path>.lock`` file, waiting while another process publishes.
+
+        Yields:
+            True when another process held the lock first.
+        """
+        lock = f"{self.path}.lock"
+        token = acquire_lock_file(lock, PUBLISH_LOCK_TIMEOUT)
+        waited = token is None
+        while token is None:
+            time.sleep(PUBLISH_POLL_INTERVAL)
+            token = acquire_lock_file(lock, PUBLISH_LOCK_TIMEOUT)
+        try:
+            yield waited
+        finally:
+            release_lock_file(lock, token)
+
+    def publish(self):
+        """
+        Loads the dataset, precomputes its aggregates and (re)writes the shared file; callers
+        hold ``publish_lock``.
+
+        Returns:
+            The written snapshot, or None when the dataset could not be loaded.
+        """
+        data = self.loader()
+        if data is None:
+            return None
+        snapshot = precompute(as_snapshot(data))
+        write_shared(snapshot, self.path, self.source())
+        return snapshot
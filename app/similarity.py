@@ -0,0 +1,277 @@
+"""
+Nearest-neighbour search of similar tracks over their audio features.
+
+Tracks are points of a standardized feature space (each feature centred and divided by its
+standard deviation, so tempo does not outweigh valence); two tracks are similar when their
+Euclidean distance in that space is small. ``SimilarityIndex`` answers exact k-nearest
+neighbour queries with a KD-tree (scipy) and falls back to a blocked brute-force scan
+without scipy, for small datasets and for filters keeping few tracks.
+"""
+import bisect
+from functools import cached_property
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+try:
+    from scipy.spatial import cKDTree  # Optional: logarithmic queries instead of a full scan
+except ImportError:
+    cKDTree = None
+
+SIMILARITY_FEATURES = ('danceability', 'energy', 'loudness', 'speechiness', 'acousticness', 'instrumentalness',
+                       'liveness', 'valence', 'tempo')
+
+ID_COLUMN = 'track_id'
+
+# Below this many tracks, a brute-force scan is as fast as the tree
+TREE_MIN_ROWS = 4096
+
+# Rows per block of the brute-force scan, bounding its temporary distance matrix
+BLOCK_ROWS = 65536
+
+# Arrays of a SimilarityIndex, enough to rebuild it over the same frame (see ``shared``)
+INDEX_ARRAYS = ('matrix', 'order', 'codes')
+
+# Filtered queries walk the tree, skipping the tracks the filter rejects, while the filter
+# keeps at least this share of the tracks; more selective filters scan the matching tracks
+TREE_MIN_SELECTIVITY = 0.2
+
+
+def standardize(values):
+    """
+    Centres and scales each column of a 2D array to unit variance.
+
+    Constant columns are only centred and missing values are set to the mean (0).
+
+    Returns:
+        The standardized float32 matrix, the column means and the column scales.
+    """
+    values = np.asarray(values, dtype='float64')
+    mean = np.nanmean(values, axis=0) if len(values) else np.zeros(values.shape[1])
+    scale = np.nanstd(values, axis=0) if len(values) else np.ones(values.shape[1])
+    mean = np.nan_to_num(mean)
+    scale[~(scale > 0)] = 1.0
+    matrix = (values - mean) / scale
+    matrix[np.isnan(matrix)] = 0.0
+    return np.ascontiguousarray(matrix, dtype='float32'), mean, scale
+
+
+def brute_force_neighbours(matrix, queries, k, rows=None, block_rows=BLOCK_ROWS):
+    """
+    Exact k-nearest neighbours by scanning ``matrix`` block by block.
+
+    Args:
+        matrix: The (n, d) points.
+        queries: The (q, d) query points.
+        k: Neighbours per query.
+        rows: Ids of the candidate points, all when None.
+        block_rows: Candidates compared at once.
+
+    Returns:
+        ``(distances, rows)``, two (q, k) arrays sorted by increasing distance. When there
+        are fewer than k candidates, the missing entries have an infinite distance and row -1.
+    """
+    queries = np.asarray(queries, dtype='float32')
+    n_queries = len(queries)
+    best_distances = np.full((n_queries, k), np.inf, dtype='float64')
+    best_rows = np.full((n_queries, k), -1, dtype='int64')
+    query_norms = np.einsum('ij,ij->i', queries, queries)
+    total = len(matrix) if rows is None else len(rows)
+    for start in range(0, total, block_rows):
+        block_ids = np.arange(start, min(start + block_rows, total)) if rows is None else rows[start:start + block_rows]
+        block = matrix[block_ids]
+        # |q - x|² = |q|² - 2 q.x + |x|², the product done as one matrix multiplication
+        squared = query_norms[:, None] - 2 * (queries @ block.T) + np.einsum('ij,ij->i', block, block)[None, :]
+        np.maximum(squared, 0, out=squared)
+        keep = min(k, len(block_ids))
+        nearest = np.argpartition(squared, keep - 1, axis=1)[:, :keep] if keep < len(block_ids) else \
+            np.broadcast_to(np.arange(len(block_ids)), squared.shape)
+        candidates = np.concatenate([best_distances, np.take_along_axis(squared, nearest, axis=1)], axis=1)
+        candidate_rows = np.concatenate([best_rows, block_ids[nearest]], axis=1)
+        order = np.argsort(candidates, axis=1, kind='stable')[:, :k]
+        best_distances = np.take_along_axis(candidates, order, axis=1)
+        best_rows = np.take_along_axis(candidate_rows, order, axis=1)
+    return np.sqrt(best_distances), best_rows
+
+
+def sort_ids(ids):
+    """
+    Sorts rows by track id with Arrow kernels, without building a Python string per row.
+
+    Args:
+        ids: Arrow array of the track ids.
+
+    Returns:
+        ``(order, codes)``: the rows by increasing id (the rows of one track in increasing
+        order), and for each row a code shared by the rows of the same track.
+    """
+    order = pc.sort_indices(ids).to_numpy()
+    dtype = 'int32' if len(order) < 2**31 else 'int64'
+    sorted_ids = ids.take(order)
+    changed = pc.not_equal(sorted_ids[1:], sorted_ids[:-1]).to_numpy(zero_copy_only=False)
+    codes = np.empty(len(order), dtype=dtype)
+    codes[order] = np.concatenate([[0], np.cumsum(changed)])[:len(order)]
+    return order.astype(dtype), codes
+
+
+class SimilarityIndex:
+    """
+    Exact nearest-neighbour search over the standardized audio features of the tracks.
+
+    The feature matrix is built once, in float32 (36 bytes per track). Track ids stay in
+    the frame's Arrow column: the index only adds the rows sorted by id, searched by
+    bisection, and an integer code per track (8 bytes per track in all). The KD-tree, used
+    when scipy is installed and the dataset has at least TREE_MIN_ROWS tracks, is built on
+    the first query: it keeps its own float64 copy of the matrix. Queries are batched: many
+    tracks are looked up with one call.
+
+    Args:
+        df: The tracks DataFrame, with a ``track_id`` column and the SIMILARITY_FEATURES
+            it has.
+        use_tree: Build the KD-tree (when possible); False forces the brute-force path.
+        arrays: The ``arrays`` of an index of the same frame (e.g. mapped from the shared
+            dataset file), used instead of computing them again.
+    """
+
+    def __init__(self, df, use_tree=True, arrays=None):
+        self.features = [feature for feature in SIMILARITY_FEATURES if feature in df.columns]
+        self.size = len(df)
+        self.use_tree = use_tree
+        self.ids = pa.array(df[ID_COLUMN] if ID_COLUMN in df.columns else np.arange(self.size).astype(str))
+        if arrays is None:
+            matrix, _, _ = standardize(df[self.features].to_numpy(dtype='float64', na_value=np.nan))
+            order, codes = sort_ids(self.ids)
+            arrays = {'matrix': matrix, 'order': order, 'codes': codes}
+        self.matrix, self.order, self.codes = (arrays[name] for name in INDEX_ARRAYS)
+
+    @property
+    def arrays(self):
+        return {name: getattr(self, name) for name in INDEX_ARRAYS}
+
+    @cached_property
+    def tree(self):
+        if not self.use_tree or cKDTree is None or self.size < TREE_MIN_ROWS:
+            return None
+        return cKDTree(self.matrix, leafsize=32, balanced_tree=False)
+
+    def rows_of(self, track_ids):
+        """
+        Returns the first row of each track id, -1 for unknown ids.
+        """
+        rows = np.full(len(track_ids), -1, dtype='int64')
+        for position, track_id in enumerate(track_ids):
+            # First of the rows sorted by id whose id is not below track_id
+            found = bisect.bisect_left(self.order, track_id, key=self._id_at)
+            if found < self.size and self._id_at(self.order[found]) == track_id:
+                rows[position] = self.order[found]
+        return rows
+
+    def _id_at(self, row):
+        return self.ids[int(row)].as_py()
+
+    def neighbours(self, queries, k, rows=None):
+        """
+        Returns the k nearest tracks of each query point.
+
+        Args:
+            queries: (q, d) standardized query points, e.g. ``index.matrix[rows]``.
+            k: Neighbours per query.
+            rows: Sorted ids of the candidate tracks (e.g. from ``FilterIndex.rows``), all
+                when None.
+
+        Returns:
+            ``(distances, rows)`` as ``brute_force_neighbours``.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype='float32'))
+        candidates = self.size if rows is None else len(rows)
+        if k <= 0 or not candidates:
+            return np.empty((len(queries), 0)), np.empty((len(queries), 0), dtype='int64')
+        if self.tree is None or candidates < TREE_MIN_SELECTIVITY * self.size:
+            return brute_force_neighbours(self.matrix, queries, k, rows)
+        if rows is None:
+            distances, found = self.tree.query(queries, k=min(k, self.size))
+            return _padded(distances, found, k, self.size)
+        return self._filtered_tree_query(queries, k, rows)
+
+    def _filtered_tree_query(self, queries, k, rows):
+        # Asks the tree for more neighbours (x4 each round) until k of them pass the filter
+        allowed = np.zeros(self.size + 1, dtype=bool)  # The tree reports missing neighbours as size
+        allowed[rows] = True
+        distances = np.full((len(queries), k), np.inf)
+        found = np.full((len(queries), k), -1, dtype='int64')
+        pending = np.arange(len(queries))
+        wanted = max(4 * k, int(k * self.size / len(rows)))
+        while len(pending):
+            wanted = min(wanted, self.size)
+            tree_distances, tree_rows = self.tree.query(queries[pending], k=wanted)
+            tree_distances, tree_rows = _padded(tree_distances, tree_rows, wanted, self.size)
+            keep = allowed[np.where(tree_rows >= 0, tree_rows, self.size)]
+            done = (keep.sum(axis=1) >= k) | (wanted == self.size)
+            for position in np.flatnonzero(done):
+                selected = np.flatnonzero(keep[position])[:k]
+                distances[pending[position], :len(selected)] = tree_distances[position, selected]
+                found[pending[position], :len(selected)] = tree_rows[position, selected]
+            pending = pending[~done]
+            wanted *= 4
+        return distances, found
+
+    def similar(self, track_ids, k=10, rows=None):
+        """
+        Returns the k tracks most similar to each of ``track_ids``.
+
+        The track itself, and its other rows (the same track listed under another genre),
+        are left out, as are repeated rows of a neighbour.
+
+        Args:
+            track_ids: Ids of the query tracks.
+            k: Similar tracks per query.
+            rows: Sorted ids of the candidate tracks, all when None.
+
+        Returns:
+            For each query, None when the id is unknown, otherwise ``(rows, distances)``: the
+            rows of the similar tracks, nearest first, and their distances.
+        """
+        query_rows = self.rows_of(track_ids)
+        known = np.flatnonzero(query_rows >= 0)
+        results = [None] * len(query_rows)
+        # Extra neighbours absorb the duplicates; queries still short of k ask again
+        pending, wanted = known, k + 4
+        while len(pending):
+            distances, found = self.neighbours(self.matrix[query_rows[pending]], wanted, rows)
+            short = []
+            for position, query in enumerate(pending):
+                selected = self._distinct(found[position], self.codes[query_rows[query]], k)
+                exhausted = not found.shape[1] or found[position, -1] < 0 or wanted >= (self.size if rows is None else len(rows))
+                if len(selected) < k and not exhausted:
+                    short.append(query)
+                else:
+                    results[query] = (found[position, selected], distances[position, selected])
+            pending, wanted = np.array(short, dtype='int64'), wanted * 4
+        return results
+
+    def _distinct(self, found, query_code, k):
+        # Positions of the first k neighbours of distinct tracks, other than the query's
+        seen = {int(query_code)}
+        selected = []
+        for position, row in enumerate(found):
+            if row < 0:
+                break
+            code = int(self.codes[row])
+            if code not in seen:
+                seen.add(code)
+                selected.append(position)
+                if len(selected) == k:
+                    break
+        return selected
+
+
+def _padded(distances, rows, k, size):
+    # cKDTree returns 1D arrays for k=1 and marks missing neighbours with row == size
+    distances = np.asarray(distances, dtype='float64').reshape(len(distances), -1)
+    rows = np.asarray(rows, dtype='int64').reshape(len(rows), -1)
+    rows = np.where(rows >= size, -1, rows)
+    if rows.shape[1] < k:
+        distances = np.pad(distances, ((0, 0), (0, k - rows.shape[1])), constant_values=np.inf)
+        rows = np.pad(rows, ((0, 0), (0, k - rows.shape[1])), constant_values=-1)
+    return distances, rows
@@ -0,0 +1,125 @@
+"""
+Coalescing of concurrent computations of the same cache entry ("single flight").
+
+When a chart is missing from the caches (a new dataset version, a cold start, an entry
+evicted), every request asking for it at that moment would compute it. Instead one caller
+per key computes and the others wait for its result: threads of a process wait on an
+event (``SingleFlight``), workers of other processes poll the artifact cache while a lock
+held there shows the computation is running (``shared_flight``).
+"""
+import threading
+import time
+
+from .metrics import metrics
+
+# Seconds between two looks at the artifact cache while another worker computes an entry
+POLL_INTERVAL = 0.05
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs at most one computation per key at a time in this process.
+
+    Args:
+        name: Label of the waits in the metrics (e.g. ``'chart'``).
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def run(self, key, compute):
+        """
+        Returns ``compute()``, or, when a call for ``key`` is already running, waits for it
+        and returns its result (raising its exception if it failed).
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            metrics.increment('cache_coalesced_total', cache=self.name, tier='memory')
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = compute()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+    def running(self, key):
+        return key in self._flights
+
+    def refresh(self, key, compute):
+        """
+        Runs ``compute`` for ``key`` in a daemon thread, unless it is already running.
+        Errors are printed: the caller has moved on with the value it had.
+        """
+        if self.running(key):
+            return None
+
+        def target():
+            try:
+                self.run(key, compute)
+            except Exception as e:
+                print(f"Background refresh of {key} failed: {e}")
+
+        thread = threading.Thread(target=target, name=f"{self.name}-refresh", daemon=True)
+        thread.start()
+        return thread
+
+
+def shared_flight(artifacts, key, lookup, compute, lock_timeout, name='chart'):
+    """
+    Computes an artifact cache entry in one worker at a time.
+
+    The worker taking the lock of ``key`` in the artifact cache computes; the others poll
+    ``lookup`` until the result is stored. A worker waiting longer than ``lock_timeout``
+    seconds (the holder is stuck or died) computes the entry itself, as does every worker
+    when the artifact cache does not support locks.
+
+    Args:
+        artifacts: The ``artifacts.ArtifactCache``, or None.
+        key: Cache key of the entry.
+        lookup: Callable returning the stored entry, or None.
+        compute: Callable computing and storing the entry, returning it.
+        lock_timeout: Seconds the lock is held at most.
+        name: Label of the waits in the metrics.
+    """
+    if artifacts is None:
+        return compute()
+    lock = f"lock:{key}"
+    deadline = time.monotonic() + lock_timeout
+    token = artifacts.acquire(lock, lock_timeout)
+    if token is None:
+        metrics.increment('cache_coalesced_total', cache=name, tier='shared')
+    while token is None:
+        time.sleep(POLL_INTERVAL)
+        result = lookup()
+        if result is not None:
+            return result
+        if time.monotonic() > deadline:
+            return compute()
+        token = artifacts.acquire(lock, lock_timeout)
+    try:
+        # The previous holder may have stored it between the caller's lookup and the lock
+        result = lookup()
+        return result if result is not None else compute()
+    finally:
+        artifacts.release(lock, token)
@@ -0,0 +1,406 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+from .aggregates import (GENRE_COLUMN, build_box_summary, build_distributions, build_genre_stats, density_grid,
+                         distribution_counts, histogram, merge_distributions, numeric_features, ready_for_threads,
+                         stratified_sample, top_tracks)
+from .correlations import METHODS, CorrelationStats, spearman
+from .indexes import ArtistIndex, FilterIndex
+from .metrics import metrics
+from .similarity import SimilarityIndex
+from .storage import concat_frames
+
+
+def frame_fingerprint(df, row_hashes=None):
+    """
+    Returns a short content hash of a DataFrame.
+
+    Two frames with the same rows and columns get the same fingerprint, which makes it
+    usable as a dataset version in cache keys.
+    """
+    if row_hashes is None:
+        row_hashes = pd.util.hash_pandas_object(df, index=False).values
+    digest = hashlib.sha1(row_hashes.tobytes())
+    digest.update(','.join(map(str, df.columns)).encode())
+    return digest.hexdigest()[:16]
+
+
+def chain_version(*parts):
+    """
+    Derives a version from a previous version and the content added to it.
+    """
+    return hashlib.sha1('\0'.join(parts).encode()).hexdigest()[:16]
+
+
+def genre_digests(df, row_hashes=None):
+    """
+    Returns a short content hash of the rows of each genre (independent of row order).
+    """
+    if row_hashes is None:
+        row_hashes = pd.util.hash_pandas_object(df, index=False).values
+    sums = pd.Series(row_hashes).groupby(df[GENRE_COLUMN].astype(str).to_numpy()).agg(['sum', 'size'])
+    return digests_from_sums(df.columns, sums)
+
+
+def digests_from_sums(columns, sums):
+    """
+    Returns the ``genre_digests`` of the per-genre ``sum`` of the row hashes and ``size``.
+    """
+    columns = ','.join(map(str, columns))
+    return {genre: chain_version(columns, str(row['sum']), str(row['size'])) for genre, row in sums.iterrows()}
+
+
+# Filtered snapshots kept per snapshot (see DatasetSnapshot.filtered)
+FILTERED_SNAPSHOTS = 32
+
+# Columns describing each track returned by similar_tracks
+SIMILAR_COLUMNS = ('track_id', 'track_name', 'artists', 'track_genre', 'popularity')
+
+
+class DatasetSnapshot:
+    """
+    A loaded version of the dataset shared by every request.
+
+    The underlying frame is never handed out directly: ``frame`` returns a shallow copy,
+    so adding columns in an analysis cannot leak into other requests.
+    Derived structures (such as ``genre_stats``) are computed once per snapshot.
+    """
+
+    def __init__(self, frame, fingerprint=None, loaded_at=None):
+        self._frame = frame
+        if fingerprint is not None:
+            self.fingerprint = fingerprint
+        self.loaded_at = loaded_at if loaded_at is not None else time.time()
+        self._derived = {}
+        self._filtered = OrderedDict()
+        self._filtered_lock = threading.Lock()
+
+    @property
+    def frame(self):
+        return self._frame.copy(deep=False)
+
+    @cached_property
+    def _row_hashes(self):
+        return pd.util.hash_pandas_object(self._frame, index=False).values
+
+    @cached_property
+    def fingerprint(self):
+        return frame_fingerprint(self._frame, self._row_hashes)
+
+    @cached_property
+    def genre_versions(self):
+        """
+        Version of the rows of each genre: it only changes when rows of that genre are added.
+        """
+        return genre_digests(self._frame, self._row_hashes)
+
+    def genres_version(self, genres=None):
+        """
+        Version of the rows of some genres, or of the whole dataset when ``genres`` is None.
+        Charts restricted to a few genres use it in their cache key, so they stay cached
+        when rows of other genres are appended.
+        """
+        if genres is None:
+            return self.fingerprint
+        versions = self.genre_versions
+        return chain_version(*(f"{genre}={versions.get(genre, '')}" for genre in sorted(genres)))
+
+    @cached_property
+    def genre_stats(self):
+        """
+        Per-genre statistics table, see ``aggregates.build_genre_stats``.
+        """
+        with metrics.stage('aggregate'):
+            return build_genre_stats(self._frame)
+
+    @cached_property
+    def features(self):
+        """
+        Names of the numeric columns, the only ones accepted by feature parameters.
+        """
+        return numeric_features(self._frame)
+
+    @cached_property
+    def correlation_stats(self):
+        """
+        Running sufficient statistics of the correlations of the numeric columns,
+        see ``correlations.CorrelationStats``.
+        """
+        with metrics.stage('aggregate'):
+            return CorrelationStats.from_frame(self._frame, self.features)
+
+    def correlations(self, method='pearson'):
+        """
+        Correlation matrix of the numeric columns, shared by every correlation chart.
+
+        Args:
+            method: ``'pearson'`` (from ``correlation_stats``) or ``'spearman'``.
+        """
+        if method not in METHODS:
+            raise ValueError(f"method must be one of {', '.join(METHODS)}")
+        if method == 'spearman':
+            return self._memoize(('correlations', method), lambda: spearman(self._frame, self.features))
+        return self._memoize(('correlations', method), self.correlation_stats.pearson)
+
+    def _memoize(self, key, build):
+        # Derived structures are pure functions of the frame: computing one twice
+        # under concurrency is harmless, so no lock is needed.
+        value = self._derived.get(key)
+        if value is None:
+            with metrics.stage('aggregate'):
+                value = self._derived[key] = build()
+        return value
+
+    def box_summary(self, feature):
+        """
+        Per-genre box plot summary of ``feature``, see ``aggregates.build_box_summary``.
+        """
+        return self._memoize(('box', feature),
+                             lambda: build_box_summary(self._frame, feature, self.genre_stats))
+
+    def density(self, x, y, bins=100):
+        """
+        Full-range 2D histogram of two features, see ``aggregates.density_grid``.
+        """
+        return self._memoize(('density', x, y, bins), lambda: density_grid(self._frame, x, y, bins=bins))
+
+    def sample(self, per_group, seed=0):
+        """
+        Stratified per-genre sample of the tracks, see ``aggregates.stratified_sample``.
+        """
+        return self._memoize(('sample', per_group, seed),
+                             lambda: stratified_sample(self._frame, self.features, per_group, seed=seed))
+
+    def append(self, batch):
+        """
+        Returns a new snapshot with the rows of ``batch`` added; this one is left unchanged.
+
+        Derived structures already computed are updated from the batch rather than rebuilt:
+        correlation statistics in O(new rows); genre statistics and box summaries only for
+        the genres present in the batch; density grids and fixed-bin distributions by adding
+        the batch counts when it falls within their range; the artist index by adding the
+        batch totals. Anything else is rebuilt on first use.
+
+        The new fingerprint chains this one with the batch content, so every worker applying
+        the same batches to the same data agrees on the version.
+        """
+        frame = concat_frames(self._frame, batch)
+        batch = frame.iloc[len(self._frame):]
+        # The slice keeps every category of the frame: the batch only needs its own ones
+        batch = batch.assign(**{column: batch[column].cat.remove_unused_categories() for column in batch
+                                if isinstance(batch[column].dtype, pd.CategoricalDtype)})
+        batch_hashes = pd.util.hash_pandas_object(batch, index=False).values
+        snapshot = DatasetSnapshot(frame, fingerprint=chain_version(self.fingerprint,
+                                                                    frame_fingerprint(batch, batch_hashes)))
+
+        versions = dict(self.genre_versions)
+        for genre, digest in genre_digests(batch, batch_hashes).items():
+            versions[genre] = chain_version(versions.get(genre, ''), digest)
+        snapshot.genre_versions = versions
+
+        if 'correlation_stats' in self.__dict__:
+            snapshot.correlation_stats = self.correlation_stats.updated(batch)
+
+        if 'genre_stats' in self.__dict__:
+            affected = sorted(batch[GENRE_COLUMN].astype(str).unique())
+            genres = frame[GENRE_COLUMN]
+            # Compared on the category codes: no string is built for the existing rows
+            wanted = np.zeros(len(genres.cat.categories) + 1, dtype=bool)
+            wanted[genres.cat.categories.get_indexer(affected)] = True
+            wanted[-1] = False
+            in_affected = wanted[genres.cat.codes.to_numpy()]
+            affected_rows = frame[in_affected]
+            affected_stats = build_genre_stats(affected_rows)
+            stats = pd.concat([self.genre_stats.drop(affected, errors='ignore'), affected_stats]).sort_index()
+            snapshot.genre_stats = ready_for_threads(stats)
+
+            for key, value in self._derived.items():
+                if key[0] == 'box':
+                    feature = key[1]
+                    summary = pd.concat([value.drop(affected, errors='ignore'),
+                                         build_box_summary(affected_rows, feature, affected_stats)])
+                    snapshot._derived[key] = summary.reindex(stats.index)
+
+        if 'artist_index' in self.__dict__:
+            snapshot.artist_index = self.artist_index.appended(batch, len(self._frame))
+
+        for key, value in self._derived.items():
+            if key[0] == 'density':
+                _, x, y, bins = key
+                added = density_grid(batch, x, y, bins=bins, x_range=value['x_range'], y_range=value['y_range'])
+                within = (batch[x].between(*value['x_range']) & batch[y].between(*value['y_range'])
+                          | batch[x].isna() | batch[y].isna()).all()
+                if within:
+                    snapshot._derived[key] = {**value, 'z': value['z'] + added['z']}
+            elif key[0] == 'distributions' and key[2] == 'fixed':
+                # Fixed bins only: the quantiles of adaptive bins move with every batch
+                within = all((batch[feature].between(edges[0], edges[-1]) | batch[feature].isna()).all()
+                             for feature, edges in zip(value['features'], value['edges']))
+                if within:
+                    added = build_distributions(batch, value['features'], key[1], 'fixed', value['edges'])
+                    snapshot._derived[key] = merge_distributions(value, added)
+        return snapshot
+
+    def distributions(self, bins=50, mode='fixed'):
+        """
+        Bin counts of every numeric feature per genre and explicit flag, see
+        ``aggregates.build_distributions``.
+        """
+        return self._memoize(('distributions', bins, mode),
+                             lambda: build_distributions(self._frame, self.features, bins, mode))
+
+    def distribution(self, feature, bins=50, mode='fixed', by=None, genres=None):
+        """
+        Distribution of one feature, see ``aggregates.distribution_counts``.
+        """
+        return distribution_counts(self.distributions(bins, mode), feature, by, genres)
+
+    def histogram(self, feature, bins=50):
+        """
+        Counts of a feature on equal-width bins, as ``aggregates.histogram``.
+        """
+        if feature not in self.features:
+            return self._memoize(('histogram', feature, bins), lambda: histogram(self._frame, feature, bins=bins))
+        counts = self.distribution(feature, bins)
+        return {'edges': counts['edges'], 'counts': counts['counts'][0]}
+
+    @cached_property
+    def artist_index(self):
+        """
+        Popularity statistics per artist, collaborations split, see ``indexes.ArtistIndex``.
+        """
+        with metrics.stage('aggregate'):
+            return ArtistIndex(self._frame)
+
+    def top_artists(self, top_n=20, min_tracks=1, genres=None):
+        """
+        The ``top_n`` artists with the best mean popularity, see ``indexes.ArtistIndex.top``.
+        """
+        genres = tuple(genres) if genres is not None else None
+        return self._memoize(('top_artists', top_n, min_tracks, genres),
+                             lambda: self.artist_index.top(top_n, min_tracks=min_tracks, genres=genres))
+
+    def top_tracks(self, top_n=10):
+        """
+        The ``top_n`` most popular tracks.
+        """
+        return self._memoize(('top_tracks', top_n), lambda: top_tracks(self._frame, top_n))
+
+    @cached_property
+    def similarity_index(self):
+        """
+        Nearest-neighbour index of the tracks' audio features, see ``similarity.SimilarityIndex``;
+        built on the first similar-track query.
+        """
+        with metrics.stage('aggregate'):
+            return SimilarityIndex(self._frame)
+
+    def similar_tracks(self, track_ids, k=10, row_filter=None):
+        """
+        Finds the k tracks most similar to each of ``track_ids``.
+
+        Args:
+            track_ids: Ids of the query tracks.
+            k: Similar tracks per query.
+            row_filter: Optional ``indexes.RowFilter`` the similar tracks must match.
+
+        Returns:
+            For each id, None when the track is unknown, otherwise a DataFrame of the
+            similar tracks (SIMILAR_COLUMNS and ``distance``), nearest first.
+        """
+        rows = None
+        if row_filter is not None:
+            with metrics.stage('filter'):
+                rows = self.filter_index.rows(row_filter)
+        results = self.similarity_index.similar(track_ids, k, rows)
+        columns = [column for column in SIMILAR_COLUMNS if column in self._frame.columns]
+        tracks = []
+        for result in results:
+            if result is None:
+                tracks.append(None)
+                continue
+            found, distances = result
+            similar = self._frame[columns].take(found).reset_index(drop=True)
+            similar['distance'] = distances
+            tracks.append(similar)
+        return tracks
+
+    @cached_property
+    def filter_index(self):
+        """
+        Indexes answering row filters without a full scan, see ``indexes.FilterIndex``.
+        """
+        with metrics.stage('filter'):
+            return FilterIndex(self._frame)
+
+    def filtered(self, row_filter):
+        """
+        Returns the snapshot of the tracks matching ``row_filter`` (an ``indexes.RowFilter``).
+
+        Every chart can be computed from it unchanged. Its versions are derived from this
+        snapshot's and the filter, so its charts are cached separately, and a genre's version
+        only changes when rows of that genre are added here. The FILTERED_SNAPSHOTS most
+        recently used filtered snapshots are kept.
+        """
+        key = row_filter.key
+        with self._filtered_lock:
+            snapshot = self._filtered.get(key)
+            if snapshot is not None:
+                self._filtered.move_to_end(key)
+                return snapshot
+
+        with metrics.stage('filter'):
+            rows = self.filter_index.rows(row_filter)
+        snapshot = DatasetSnapshot(self._frame.take(rows).reset_index(drop=True),
+                                   fingerprint=chain_version(self.fingerprint, key), loaded_at=self.loaded_at)
+        snapshot.genre_versions = {genre: chain_version(version, key)
+                                   for genre, version in self.genre_versions.items()
+                                   if row_filter.genres is None or genre in row_filter.genres}
+        with self._filtered_lock:
+            self._filtered[key] = snapshot
+            while len(self._filtered) > FILTERED_SNAPSHOTS:
+                self._filtered.popitem(last=False)
+        return snapshot
+
+    def prepare(self):
+        """
+        Computes the fingerprint and every derived structure up front.
+        """
+        self.fingerprint
+        self.genre_stats
+        self.distributions()
+        return self
+
+    def __getstate__(self):
+        # Sent to process pool workers: locks cannot be pickled and indexes are rebuilt there
+        state = dict(self.__dict__)
+        del state['_filtered_lock']
+        state['_filtered'] = OrderedDict()
+        state.pop('filter_index', None)
+        state.pop('similarity_index', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._filtered_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._frame)
+
+    def __repr__(self):
+        return f"<DatasetSnapshot {self.fingerprint} rows={len(self)}>"
+
+
+def as_snapshot(data):
+    """
+    Wraps a DataFrame into a DatasetSnapshot; snapshots are returned unchanged.
+    """
+    if isinstance(data, DatasetSnapshot):
+        return data
+    return DatasetSnapshot(data)
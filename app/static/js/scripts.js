@@ -0,0 +1,91 @@
+// Copies the row filters of the page's query string (genre, explicit, <feature>_min/_max) onto a URL.
+function withPageFilters(url) {
+    const target = new URL(url, window.location.href);
+    new URLSearchParams(window.location.search).forEach((value, name) => {
+        const isFilter = name === 'genre' || name === 'explicit' || /_(min|max)$/.test(name);
+        if (isFilter && value !== '') {
+            target.searchParams.set(name, value);
+        }
+    });
+    return target.pathname + target.search;
+}
+
+// Re-bins a density chart (see density_scatter_figure) for the visible area when the user zooms.
+function enableDensityZoom(chartId) {
+    const chart = document.getElementById(chartId);
+    const density = chart.layout && chart.layout.meta && chart.layout.meta.density;
+    if (!density) {
+        return;
+    }
+
+    chart.on('plotly_relayout', function(event) {
+        const params = new URLSearchParams({x: density.x, y: density.y});
+        const xRange = event['xaxis.range'] || [event['xaxis.range[0]'], event['xaxis.range[1]']];
+        const yRange = event['yaxis.range'] || [event['yaxis.range[0]'], event['yaxis.range[1]']];
+        const zoomed = xRange[0] !== undefined || yRange[0] !== undefined;
+        if (!zoomed && !event['xaxis.autorange'] && !event['yaxis.autorange']) {
+            return;  // Not a zoom (e.g. legend click or resize)
+        }
+        if (xRange[0] !== undefined) {
+            params.set('x_min', xRange[0]);
+            params.set('x_max', xRange[1]);
+        }
+        if (yRange[0] !== undefined) {
+            params.set('y_min', yRange[0]);
+            params.set('y_max', yRange[1]);
+        }
+
+        fetch(withPageFilters('/api/density?' + params.toString()))
+            .then(response => response.json())
+            .then(grid => {
+                if (grid.error === undefined) {
+                    Plotly.restyle(chart, {x: [grid.x], y: [grid.y], z: [grid.z]}, [0]);
+                }
+            });
+    });
+}
+
+// Fetches a chart from its endpoint (the data-src attribute, see /api/charts/<name>) and draws it.
+function loadChart(container) {
+    container.classList.add('chart-loading');
+    return fetch(withPageFilters(container.dataset.src))
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(response.status + ' ' + response.statusText);
+            }
+            return response.json();
+        })
+        .then(chart => {
+            container.classList.remove('chart-loading');
+            return Plotly.newPlot(container, chart.figure.data, chart.figure.layout).then(() => {
+                const interpretation = document.getElementById(container.dataset.interpretation);
+                if (interpretation) {
+                    interpretation.textContent = chart.interpretation;
+                }
+                enableDensityZoom(container.id);
+            });
+        })
+        .catch(error => {
+            container.classList.remove('chart-loading');
+            container.classList.add('chart-error');
+            container.textContent = "Ce graphique n'a pas pu être chargé (" + error.message + ").";
+        });
+}
+
+// Loads each .lazy-chart the first time it becomes visible (sections are hidden until selected).
+function loadChartsLazily() {
+    const containers = document.querySelectorAll('.lazy-chart[data-src]');
+    if (!('IntersectionObserver' in window)) {
+        containers.forEach(loadChart);
+        return;
+    }
+    const observer = new IntersectionObserver(entries => {
+        entries.forEach(entry => {
+            if (entry.isIntersecting) {
+                observer.unobserve(entry.target);
+                loadChart(entry.target);
+            }
+        });
+    }, {rootMargin: '200px'});
+    containers.forEach(container => observer.observe(container));
+}
@@ -0,0 +1,327 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Bump whenever SCHEMA changes so that existing caches get rebuilt.
+SCHEMA_VERSION = 2
+
+# Explicit on-disk/in-memory types for the Spotify Tracks dataset. 'category' columns are
+# dictionary-encoded with their dictionary in Arrow memory (see dictionary_encode).
+SCHEMA = {
+    'track_id': 'string[pyarrow]',
+    'artists': 'category',
+    'album_name': 'category',
+    'track_name': 'string[pyarrow]',
+    'popularity': 'int16',
+    'duration_ms': 'int32',
+    'explicit': 'bool',
+    'danceability': 'float32',
+    'energy': 'float32',
+    'key': 'int8',
+    'loudness': 'float32',
+    'mode': 'int8',
+    'speechiness': 'float32',
+    'acousticness': 'float32',
+    'instrumentalness': 'float32',
+    'liveness': 'float32',
+    'valence': 'float32',
+    'tempo': 'float32',
+    'time_signature': 'int8',
+    'track_genre': 'category',
+}
+
+# Columns of the CSV export dropped on load: 'Unnamed: 0' is the row number written by
+# pandas, not a feature
+DROPPED_COLUMNS = ('Unnamed: 0',)
+
+# Columns no analysis reads. They stay in the Parquet cache, from which they can be read on
+# demand (read_cache(path, columns=...)), but are left out of the frame the app serves.
+# track_id is served: it identifies the tracks of similarity queries (see app.similarity).
+LAZY_COLUMNS = ('album_name',)
+ANALYSIS_COLUMNS = tuple(column for column in SCHEMA if column not in LAZY_COLUMNS)
+
+ARROW_STRING = pd.StringDtype('pyarrow')
+
+METADATA_KEY = b'music_insights'
+
+# Reads Arrow strings as pandas strings backed by Arrow memory instead of Python objects
+arrow_types = {pa.string(): ARROW_STRING, pa.large_string(): ARROW_STRING}.get
+
+
+def cache_path_for(local_path):
+    """
+    Returns the path of the columnar cache that belongs to a CSV source.
+    """
+    return os.path.splitext(local_path)[0] + '.parquet'
+
+
+def source_fingerprint(path):
+    """
+    Describes a source file by size and modification time.
+
+    The fingerprint is stored in the cache metadata and compared on every load,
+    so a replaced or edited CSV invalidates the cache.
+    """
+    stat = os.stat(path)
+    return {'source': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def dictionary_encode(values):
+    """
+    Returns a categorical Series whose categories (the dictionary) are Arrow strings.
+
+    Python string objects cost about 50 bytes of overhead each; held in one Arrow buffer the
+    dictionary of a column such as ``artists`` takes half the memory. The codes are unchanged.
+    """
+    values = values.astype('category')
+    categories = values.cat.categories
+    if categories.dtype == ARROW_STRING:
+        return values
+    dtype = pd.CategoricalDtype(pd.Index(categories.astype(str), dtype=ARROW_STRING))
+    return pd.Series(pd.Categorical.from_codes(values.cat.codes, dtype=dtype), index=values.index, name=values.name)
+
+
+def apply_schema(df):
+    """
+    Casts the columns of a DataFrame to the types declared in SCHEMA and drops
+    DROPPED_COLUMNS. Columns missing from SCHEMA are left untouched.
+    """
+    df = df.drop(columns=[column for column in DROPPED_COLUMNS if column in df.columns])
+    dtypes = {column: dtype for column, dtype in SCHEMA.items() if column in df.columns}
+    df = df.astype(dtypes)
+    for column, dtype in dtypes.items():
+        if dtype == 'category':
+            df[column] = dictionary_encode(df[column])
+    return df
+
+
+def csv_read_options(path, columns=None):
+    """
+    Returns the ``usecols`` and ``dtype`` arguments of ``pd.read_csv`` reading a CSV export
+    with the explicit schema: ``columns`` (all when None) minus DROPPED_COLUMNS.
+    """
+    header = pd.read_csv(path, nrows=0).columns
+    usecols = [column for column in header
+               if column not in DROPPED_COLUMNS and (columns is None or column in columns)]
+    dtypes = {column: dtype for column, dtype in SCHEMA.items() if column in usecols}
+    return {'usecols': usecols, 'dtype': dtypes}
+
+
+def read_csv_typed(path, columns=None):
+    """
+    Reads a legacy CSV export of the dataset with the explicit schema.
+
+    Args:
+        path: The CSV file.
+        columns: Columns to read (all when None).
+    """
+    return apply_schema(pd.read_csv(path, **csv_read_options(path, columns)))
+
+
+def read_cache_metadata(cache_path):
+    """
+    Returns the metadata stored alongside a cache file, or None if the file
+    is missing or was not written by write_cache.
+    """
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        metadata = pq.read_schema(cache_path).metadata or {}
+    except (OSError, pa.ArrowException):
+        return None
+    if METADATA_KEY not in metadata:
+        return None
+    return json.loads(metadata[METADATA_KEY])
+
+
+def is_cache_fresh(cache_path, fingerprint):
+    """
+    Checks whether the cache exists, matches the current schema version and was
+    built from the source described by ``fingerprint``.
+    """
+    metadata = read_cache_metadata(cache_path)
+    if metadata is None or metadata.get('schema_version') != SCHEMA_VERSION:
+        return False
+    return metadata.get('fingerprint') == fingerprint
+
+
+def parquet_columns(path, columns=None):
+    """
+    Returns the columns of a Parquet file to read: ``columns`` (all when None), in file order.
+    """
+    names = pq.read_schema(path).names
+    return [name for name in names if columns is None or name in columns]
+
+
+def read_cache(cache_path, columns=None):
+    """
+    Reads the columnar cache (or the given ``columns`` only) back into a DataFrame with
+    categorical columns restored.
+    """
+    table = pq.read_table(cache_path, columns=parquet_columns(cache_path, columns))
+    return apply_schema(table.to_pandas(types_mapper=arrow_types))
+
+
+def memory_report(before, after):
+    """
+    Compares the memory used by each column of two representations of the tracks, e.g. the
+    legacy ``pd.read_csv`` frame and the one served by the app.
+
+    Returns:
+        A DataFrame indexed by column (plus a ``total`` row) with the bytes used ``before``
+        and ``after`` (strings included, 0 for a missing column) and their ratio.
+    """
+    columns = list(dict.fromkeys([*before.columns, *after.columns]))
+    report = pd.DataFrame({'before': before.memory_usage(deep=True, index=False),
+                           'after': after.memory_usage(deep=True, index=False)}).reindex(columns)
+    report = report.fillna(0).astype('int64')
+    report.loc['total'] = report.sum()
+    report['ratio'] = (report['before'] / report['after'].replace(0, np.nan)).round(1)
+    return report
+
+
+def write_cache(df, cache_path, fingerprint):
+    """
+    Writes ``df`` to a Parquet cache tagged with the source fingerprint.
+
+    The file is written to a temporary path first and then renamed, so
+    concurrent workers never observe a partially written cache.
+    """
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    table = pa.Table.from_pandas(apply_schema(df), preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[METADATA_KEY] = json.dumps({'schema_version': SCHEMA_VERSION, 'fingerprint': fingerprint})
+    table = table.replace_schema_metadata(metadata)
+
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, cache_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class SchemaError(ValueError):
+    """
+    Raised when a batch of tracks does not match SCHEMA.
+    """
+
+
+# Columns that must be present on every row of a batch
+REQUIRED_VALUES = ['track_id', 'track_genre', 'popularity', 'duration_ms', 'explicit']
+
+
+def read_batch(path):
+    """
+    Reads a batch of new tracks from a CSV or Parquet file and validates it.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        df = pd.read_csv(path)
+    elif extension in ('.parquet', '.pq'):
+        df = pd.read_parquet(path)
+    else:
+        raise SchemaError(f"{path}: unsupported file type '{extension}' (expected .csv or .parquet)")
+    return validate_batch(df)
+
+
+def validate_batch(df):
+    """
+    Checks that a batch of new tracks has exactly the SCHEMA columns (DROPPED_COLUMNS are
+    accepted and dropped), with values of the declared types, and returns it cast to SCHEMA.
+
+    Raises:
+        SchemaError: Listing every problem found.
+    """
+    df = df.drop(columns=[column for column in DROPPED_COLUMNS if column in df.columns])
+    problems = []
+    missing = [column for column in SCHEMA if column not in df.columns]
+    unexpected = [column for column in df.columns if column not in SCHEMA]
+    if missing:
+        problems.append(f"missing columns: {', '.join(missing)}")
+    if unexpected:
+        problems.append(f"unexpected columns: {', '.join(map(str, unexpected))}")
+    for column in REQUIRED_VALUES:
+        if column in df.columns and df[column].isna().any():
+            problems.append(f"{column}: {int(df[column].isna().sum())} missing values")
+    if problems:
+        raise SchemaError('; '.join(problems))
+
+    for column in df.columns:
+        try:
+            df[column].astype(SCHEMA[column])
+        except (ValueError, TypeError) as e:
+            problems.append(f"{column}: cannot be read as {SCHEMA[column]} ({e})")
+    if problems:
+        raise SchemaError('; '.join(problems))
+    return apply_schema(df)
+
+
+def concat_frames(first, second):
+    """
+    Appends the rows of ``second`` to ``first``, keeping the SCHEMA types.
+
+    Categorical columns get the union of both category sets, the new categories of
+    ``second`` going at the end so the codes of ``first`` are kept unchanged. Columns of ``second`` that
+    ``first`` does not have (e.g. LAZY_COLUMNS) are left out.
+    """
+    columns = {}
+    for column in first.columns:
+        values = first[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # Concatenates the codes, so the first frame is not recoded whatever its size
+            categories, dtype = values.cat.categories, values.dtype
+            added = pd.Index(second[column].astype(str))
+            codes = categories.get_indexer(added)
+            unseen = codes < 0
+            if unseen.any():
+                # New categories go at the end so the existing codes stay valid
+                new = added[unseen].unique().sort_values()
+                codes[unseen] = len(categories) + new.get_indexer(added[unseen])
+                dtype = pd.CategoricalDtype(categories.append(new))
+            columns[column] = pd.Categorical.from_codes(
+                np.concatenate([values.cat.codes.to_numpy(), codes]), dtype=dtype)
+        else:
+            columns[column] = pd.concat([values, second[column].astype(values.dtype)], ignore_index=True)
+    return pd.DataFrame(columns, copy=False)
+
+
+def write_delta(df, directory):
+    """
+    Stores a validated batch as a new delta file of ``directory`` and returns its path.
+
+    Delta files are named after their creation time and content, so they sort in the
+    order they were ingested, and are renamed into place once complete.
+    """
+    os.makedirs(directory, exist_ok=True)
+    row_hashes = pd.util.hash_pandas_object(df, index=False).values
+    name = f"{time.time_ns():020d}-{hashlib.sha1(row_hashes.tobytes()).hexdigest()[:12]}.parquet"
+    path = os.path.join(directory, name)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        pq.write_table(pa.Table.from_pandas(apply_schema(df), preserve_index=False), tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+def list_deltas(directory):
+    """
+    Returns the paths of the delta files of ``directory`` in ingestion order.
+    """
+    if not directory or not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith('.parquet')]
+
+
+def read_delta(path, columns=None):
+    return read_cache(path, columns)
@@ -0,0 +1,482 @@
+import copy
+import hashlib
+import os
+import time
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from . import storage
+from .aggregates import (FEATURE_RANGES, FEATURE_STATS, GENRE_COLUMN, density_grid, numeric_features,
+                         ready_for_threads)
+from .correlations import CorrelationStats
+from .indexes import ArtistIndex
+from .snapshot import DatasetSnapshot, chain_version, digests_from_sums, frame_fingerprint, genre_digests
+
+# Feature pairs whose 2D histograms are accumulated while streaming (the dashboard density charts)
+DENSITY_PAIRS = [('energy', 'danceability'), ('valence', 'popularity'), ('loudness', 'energy')]
+DENSITY_BINS = 100
+
+# Bins per feature of the quantile grids: quantiles are exact to 1/QUANTILE_BINS of the feature range
+QUANTILE_BINS = 2000
+
+# Number of most popular tracks kept
+TOP_TRACKS = 500
+
+
+def iter_chunks(path, chunksize=500_000, columns=None):
+    """
+    Reads a CSV file in chunks, or a Parquet file in record batches, with the dataset schema.
+    Only ``columns`` are read (all when None).
+    """
+    if os.path.splitext(path)[1].lower() in ('.parquet', '.pq'):
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize,
+                                                       columns=storage.parquet_columns(path, columns)):
+            yield storage.apply_schema(batch.to_pandas(types_mapper=storage.arrow_types))
+    else:
+        for chunk in pd.read_csv(path, chunksize=chunksize, **storage.csv_read_options(path, columns)):
+            yield storage.apply_schema(chunk)
+
+
+class StreamingAggregate:
+    """
+    Mergeable aggregate state of the tracks, built one chunk at a time in bounded memory.
+
+    Each chunk is folded into:
+
+    * exact per-genre counts, sums, minima and maxima of every numeric feature, the explicit
+      share and the correlation statistics (see ``correlations.CorrelationStats``);
+    * per-genre counts on a fixed grid of QUANTILE_BINS bins per feature (FEATURE_RANGES),
+      from which quartiles, histograms and box plot whiskers are read;
+    * a reservoir of at most ``sample_size`` random tracks per genre (the tracks with the
+      smallest keys, a hash of their content: two reservoirs are merged by keeping the
+      smallest keys again);
+    * the TOP_TRACKS most popular tracks, the track count, popularity sum and maximum per
+      genre and artist (see ``indexes.ArtistIndex.genre_totals``) and the 2D histograms of
+      DENSITY_PAIRS.
+
+    Memory does not depend on the number of tracks, except for the per-artist totals.
+
+    Args:
+        columns: Numeric columns to aggregate (defaults to those of the first chunk).
+        sample_size: Size of the per-genre reservoirs.
+        seed: Seed of the reservoir keys.
+    """
+
+    def __init__(self, columns=None, sample_size=1000, seed=0):
+        self.columns = columns
+        self.sample_size = sample_size
+        self.seed = seed
+        self.rows = 0
+        self.chunks = 0
+        self.genres = []
+        self._codes = {}
+        self.all_columns = None
+        self.hash = hashlib.sha1()
+        self.genre_hashes = np.zeros(0, dtype='uint64')
+        self.sizes = np.zeros(0, dtype='int64')
+        self.moments = None          # (genre, feature, [count, sum, min, max])
+        self.explicit = np.zeros(0)
+        self.grids = None            # (genre, feature, bin) counts
+        self.correlation_stats = None
+        self.sample = None
+        self.top = None
+        self.artists = None
+        self.densities = {}
+
+    # -- folding ---------------------------------------------------------------------
+
+    def _genre_codes(self, genres):
+        # Codes of the genres of a chunk, registering new genres and growing the arrays
+        for genre in pd.unique(genres):
+            if genre not in self._codes:
+                self._codes[genre] = len(self.genres)
+                self.genres.append(genre)
+        grow = len(self.genres) - len(self.genre_hashes)
+        if grow:
+            k = len(self.columns)
+            self.genre_hashes = np.concatenate([self.genre_hashes, np.zeros(grow, dtype='uint64')])
+            self.sizes = np.concatenate([self.sizes, np.zeros(grow, dtype='int64')])
+            self.explicit = np.concatenate([self.explicit, np.zeros(grow)])
+            empty = np.zeros((grow, k, 4))
+            empty[:, :, 2], empty[:, :, 3] = np.inf, -np.inf
+            self.moments = np.concatenate([self.moments, empty]) if self.moments is not None else empty
+            grids = np.zeros((grow, k, QUANTILE_BINS), dtype='int64')
+            self.grids = np.concatenate([self.grids, grids]) if self.grids is not None else grids
+        return pd.Series(genres).map(self._codes).to_numpy()
+
+    def update(self, chunk):
+        """
+        Folds a chunk of tracks into the state. Returns self.
+        """
+        if self.columns is None:
+            self.columns = numeric_features(chunk)
+        if self.all_columns is None:
+            self.all_columns = list(chunk.columns)
+        chunk = chunk.set_axis(pd.RangeIndex(self.rows, self.rows + len(chunk)))  # Row numbers in the whole source
+        genres = chunk[GENRE_COLUMN].astype(str).to_numpy()
+        codes = self._genre_codes(genres)
+        n_genres = len(self.genres)
+
+        # Content hashes: the same values as DatasetSnapshot.fingerprint/genre_versions of the whole frame
+        row_hashes = pd.util.hash_pandas_object(chunk, index=False).values
+        self.hash.update(row_hashes.tobytes())
+        np.add.at(self.genre_hashes, codes, row_hashes)  # Wraps around like the pandas sum
+        self.sizes += np.bincount(codes, minlength=n_genres)
+
+        values = chunk[self.columns].to_numpy(dtype='float64', na_value=np.nan)
+        for i, column in enumerate(self.columns):
+            column_values = values[:, i]
+            present = ~np.isnan(column_values)
+            grouped = pd.Series(column_values[present]).groupby(codes[present]).agg(['count', 'sum', 'min', 'max'])
+            index = grouped.index.to_numpy()
+            self.moments[index, i, 0] += grouped['count'].to_numpy()
+            self.moments[index, i, 1] += grouped['sum'].to_numpy()
+            self.moments[index, i, 2] = np.minimum(self.moments[index, i, 2], grouped['min'].to_numpy())
+            self.moments[index, i, 3] = np.maximum(self.moments[index, i, 3], grouped['max'].to_numpy())
+
+            if column in FEATURE_RANGES:
+                bins = _bin_index(column_values[present], column)
+                flat = codes[present] * QUANTILE_BINS + bins
+                self.grids[:, i, :] += np.bincount(flat, minlength=n_genres * QUANTILE_BINS).reshape(
+                    n_genres, QUANTILE_BINS)
+
+        if 'explicit' in chunk.columns:
+            self.explicit += np.bincount(codes, weights=chunk['explicit'].to_numpy(dtype='float64'),
+                                         minlength=n_genres)
+
+        numeric = chunk[self.columns]
+        if self.correlation_stats is None:
+            self.correlation_stats = CorrelationStats.from_frame(numeric, self.columns)
+        else:
+            self.correlation_stats.update(numeric)
+
+        self._update_sample(chunk, row_hashes)
+        self._update_top(chunk)
+        self._add_artists(ArtistIndex(chunk).genre_totals())
+        for x, y in DENSITY_PAIRS:
+            if x in chunk.columns and y in chunk.columns:
+                grid = density_grid(chunk, x, y, bins=DENSITY_BINS, x_range=FEATURE_RANGES[x],
+                                    y_range=FEATURE_RANGES[y])
+                if (x, y) in self.densities:
+                    self.densities[(x, y)]['z'] += grid['z']
+                else:
+                    self.densities[(x, y)] = grid
+
+        self.rows += len(chunk)
+        self.chunks += 1
+        return self
+
+    def _update_sample(self, chunk, row_hashes):
+        # Bottom-k sampling: keep the sample_size rows with the smallest random keys per genre.
+        # Keys are derived from the row contents, so the sample does not depend on the chunking.
+        keys = pd.util.hash_array(row_hashes ^ np.uint64(self.seed))
+        candidates = chunk.assign(_key=keys)
+        if self.sample is not None:
+            candidates = pd.concat([self.sample, candidates], ignore_index=True)
+        self.sample = _bottom_k(candidates, self.sample_size)
+
+    def _add_artists(self, totals):
+        if self.artists is not None:
+            totals = pd.concat([self.artists, totals]).groupby(level=[0, 1], sort=False).agg(
+                {'count': 'sum', 'sum': 'sum', 'max': 'max'})
+        self.artists = totals
+
+    def _update_top(self, chunk):
+        top = chunk if self.top is None else pd.concat([self.top, chunk])
+        self.top = top.nlargest(TOP_TRACKS, 'popularity')
+
+    def merge(self, other):
+        """
+        Folds another state, built from other chunks, into this one. Returns self.
+        """
+        if other.rows == 0:
+            return self
+        if self.rows == 0:
+            self.__dict__.update(copy.deepcopy(other).__dict__)
+            return self
+        if other.columns != self.columns:
+            raise ValueError("Cannot merge aggregates of different columns")
+        codes = self._genre_codes(np.array(other.genres, dtype=object))
+        self.hash = hashlib.sha1(self.hash.digest() + other.hash.digest())  # Order-dependent, like the rows
+        self.genre_hashes[codes] += other.genre_hashes
+        self.sizes[codes] += other.sizes
+        self.explicit[codes] += other.explicit
+        self.moments[codes, :, 0:2] += other.moments[:, :, 0:2]
+        self.moments[codes, :, 2] = np.minimum(self.moments[codes, :, 2], other.moments[:, :, 2])
+        self.moments[codes, :, 3] = np.maximum(self.moments[codes, :, 3], other.moments[:, :, 3])
+        self.grids[codes] += other.grids
+        self.correlation_stats = self.correlation_stats.merge(other.correlation_stats)
+        self.sample = _bottom_k(pd.concat([self.sample, other.sample], ignore_index=True), self.sample_size)
+        self.top = pd.concat([self.top, other.top.set_axis(other.top.index + self.rows)]).nlargest(
+            TOP_TRACKS, 'popularity')
+        self._add_artists(other.artists)
+        for pair, grid in other.densities.items():
+            if pair in self.densities:
+                self.densities[pair]['z'] += grid['z']
+            else:
+                self.densities[pair] = grid
+        self.rows += other.rows
+        self.chunks += other.chunks
+        return self
+
+    def __getstate__(self):
+        # Hash objects cannot be pickled (process workers) or copied (``StreamingSnapshot.append``):
+        # the running hash is replaced by its current value, which later chunks are chained to
+        state = dict(self.__dict__)
+        state['hash'] = self.fingerprint() if self.all_columns is not None else ''
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.hash = hashlib.sha1(state['hash'].encode())
+
+    # -- reading -----------------------------------------------------------------------
+
+    def quantiles(self, feature, qs):
+        """
+        Per-genre quantiles of a feature read from its grid (linear within a bin),
+        as an array of shape (genres, len(qs)).
+        """
+        i = self.columns.index(feature)
+        counts = self.grids[:, i, :]
+        low, high = FEATURE_RANGES[feature]
+        width = (high - low) / QUANTILE_BINS
+        cumulative = np.cumsum(counts, axis=1)
+        result = np.full((len(self.genres), len(qs)), np.nan)
+        for g in np.flatnonzero(cumulative[:, -1]):
+            def value_at(ranks):
+                # Value of the (0-based) ranks, spread evenly within their bin
+                b = np.searchsorted(cumulative[g], ranks, side='right')
+                before = np.where(b > 0, cumulative[g, b - 1], 0)
+                return low + (b + (ranks - before + 0.5) / counts[g, b]) * width
+
+            # Linear interpolation between the two closest ranks, as pandas does
+            position = np.asarray(qs) * (cumulative[g, -1] - 1)
+            below = np.floor(position)
+            above = np.minimum(below + 1, cumulative[g, -1] - 1)
+            result[g] = value_at(below) + (position - below) * (value_at(above) - value_at(below))
+        # Quantiles never fall outside the exact extremes
+        minimum, maximum = self.moments[:, i, 2:3], self.moments[:, i, 3:4]
+        return np.clip(result, minimum, maximum)
+
+    def genre_stats(self):
+        """
+        The per-genre statistics table, as ``aggregates.build_genre_stats`` returns it.
+        """
+        data = {}
+        for i, feature in enumerate(self.columns):
+            count, total, minimum, maximum = (self.moments[:, i, j] for j in range(4))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = total / count
+            if feature in FEATURE_RANGES:
+                q1, median, q3 = self.quantiles(feature, [0.25, 0.5, 0.75]).T
+            else:
+                q1 = median = q3 = np.full(len(self.genres), np.nan)
+            present = count > 0
+            stats = {'count': count, 'mean': mean, 'median': median, 'q1': q1, 'q3': q3,
+                     'min': np.where(present, minimum, np.nan), 'max': np.where(present, maximum, np.nan)}
+            for stat in FEATURE_STATS:
+                data[(feature, stat)] = stats[stat]
+        stats = pd.DataFrame(data, index=pd.Index(self.genres, name=GENRE_COLUMN))
+        stats[('tracks', 'count')] = self.sizes
+        if 'explicit' in self.all_columns:
+            stats[('explicit', 'share')] = self.explicit / np.maximum(self.sizes, 1)
+        return ready_for_threads(stats.sort_index())
+
+    def box_summary(self, feature, stats, max_outliers=50):
+        """
+        Per-genre box plot summary, as ``aggregates.build_box_summary`` returns it.
+
+        Whiskers are read from the quantile grid (to one bin); outliers are the reservoir
+        tracks beyond them, plus the exact extremes.
+        """
+        i = self.columns.index(feature)
+        low, high = FEATURE_RANGES[feature]
+        width = (high - low) / QUANTILE_BINS
+        centers = low + (np.arange(QUANTILE_BINS) + 0.5) * width
+        q1 = stats[(feature, 'q1')].to_numpy()
+        q3 = stats[(feature, 'q3')].to_numpy()
+        iqr = q3 - q1
+        lower, upper = q1 - 1.5 * iqr, q3 + 1.5 * iqr
+
+        sample = self.sample.groupby(self.sample[GENRE_COLUMN].astype(str), observed=True)[feature]
+        lowerfence, upperfence, outliers = [], [], []
+        for row, genre in enumerate(stats.index):
+            g = self._codes[genre]
+            counts = self.grids[g, i]
+            inside = (counts > 0) & (centers >= lower[row]) & (centers <= upper[row])
+            minimum, maximum = self.moments[g, i, 2], self.moments[g, i, 3]
+            lowerfence.append(max(centers[inside].min(), minimum) if inside.any() else q1[row])
+            upperfence.append(min(centers[inside].max(), maximum) if inside.any() else q3[row])
+
+            values = sample.get_group(genre).to_numpy(dtype='float64') if genre in sample.groups else np.array([])
+            values = np.concatenate([values, [minimum, maximum]])
+            group = np.unique(values[(values < lower[row]) | (values > upper[row])])
+            if len(group) > max_outliers:
+                group = group[np.linspace(0, len(group) - 1, max_outliers).round().astype(int)]
+            outliers.append(group)
+
+        return pd.DataFrame({
+            'q1': q1,
+            'median': stats[(feature, 'median')].to_numpy(),
+            'q3': q3,
+            'mean': stats[(feature, 'mean')].to_numpy(),
+            'lowerfence': lowerfence,
+            'upperfence': upperfence,
+            'outliers': outliers,
+        }, index=stats.index)
+
+    def histogram(self, feature, bins=50):
+        """
+        Counts of a feature over all genres on ``bins`` bins of its FEATURE_RANGES.
+        """
+        table = self.distribution(feature, bins)
+        return {'edges': table['edges'], 'counts': table['counts'][0]}
+
+    def distribution(self, feature, bins=50, by=None, genres=None):
+        """
+        Counts of a feature on ``bins`` bins of its FEATURE_RANGES, as
+        ``aggregates.distribution_counts`` (``by`` is None or ``'genre'``).
+        """
+        low, high = FEATURE_RANGES[feature]
+        grids, names = self.grids[:, self.columns.index(feature), :], pd.Index(self.genres)
+        if genres is not None:
+            keep = names.get_indexer(list(genres))
+            keep = keep[keep >= 0]
+            grids, names = grids[keep], names[keep]
+        if by != 'genre':
+            grids, names = grids.sum(axis=0, keepdims=True), pd.Index(['all'])
+        # Each grid bin goes to the output bin holding its center
+        centers = low + (np.arange(QUANTILE_BINS) + 0.5) * (high - low) / QUANTILE_BINS
+        target = np.minimum(((centers - low) / (high - low) * bins).astype(int), bins - 1)
+        counts = np.zeros((len(grids), bins), dtype='int64')
+        np.add.at(counts, (slice(None), target), grids.astype('int64'))
+        return {'edges': np.linspace(low, high, bins + 1), 'names': list(names), 'counts': counts}
+
+    def fingerprint(self):
+        digest = self.hash.copy()
+        digest.update(','.join(map(str, self.all_columns)).encode())
+        return digest.hexdigest()[:16]
+
+    def genre_versions(self):
+        sums = pd.DataFrame({'sum': self.genre_hashes, 'size': self.sizes}, index=self.genres)
+        return digests_from_sums(self.all_columns, sums)
+
+
+def _bin_index(values, feature):
+    low, high = FEATURE_RANGES[feature]
+    bins = ((values - low) / (high - low) * QUANTILE_BINS).astype('int64')
+    return np.clip(bins, 0, QUANTILE_BINS - 1)
+
+
+def _bottom_k(candidates, k):
+    candidates = candidates.sort_values('_key', kind='stable')
+    rank = candidates.groupby(candidates[GENRE_COLUMN].astype(str), observed=True).cumcount()
+    return candidates[rank.to_numpy() < k].reset_index(drop=True)
+
+
+class StreamingSnapshot(DatasetSnapshot):
+    """
+    A dataset version served from a ``StreamingAggregate`` instead of the full frame.
+
+    It offers the same accessors as DatasetSnapshot, so every chart renders from it.
+    Counts, means, extremes, correlations, top tracks and artists are exact; quantiles,
+    whiskers and histograms are exact to one grid bin; density grids use FEATURE_RANGES.
+    ``frame`` is the reservoir sample: anything computed from it (``points`` scatter mode,
+    ``/api/density`` zooms, Spearman correlations) is an estimate.
+    """
+
+    def __init__(self, aggregate, loaded_at=None):
+        sample = aggregate.sample.drop(columns='_key')
+        super().__init__(sample, fingerprint=aggregate.fingerprint(), loaded_at=loaded_at)
+        self.aggregate = aggregate
+        self.genre_versions = aggregate.genre_versions()
+        self.correlation_stats = aggregate.correlation_stats
+        self.features = list(aggregate.columns)
+
+    @property
+    def genre_stats(self):
+        return self._memoize(('genre_stats',), self.aggregate.genre_stats)
+
+    def box_summary(self, feature):
+        return self._memoize(('box', feature), lambda: self.aggregate.box_summary(feature, self.genre_stats))
+
+    def density(self, x, y, bins=100):
+        grid = self.aggregate.densities.get((x, y))
+        if grid is not None and bins == DENSITY_BINS:
+            return grid
+        return self._memoize(('density', x, y, bins), lambda: density_grid(self._frame, x, y, bins=bins))
+
+    def sample(self, per_group, seed=0):
+        # The reservoir is already a random sample: its first rows per genre are one too
+        def build():
+            rank = self._frame.groupby(self._frame[GENRE_COLUMN].astype(str), observed=True).cumcount()
+            sample = self._frame[rank.to_numpy() < per_group]
+            return sample[list(dict.fromkeys(self.features + [GENRE_COLUMN]))]
+        return self._memoize(('sample', per_group, seed), build)
+
+    def histogram(self, feature, bins=50):
+        if feature not in FEATURE_RANGES:
+            return super().histogram(feature, bins)
+        return self._memoize(('histogram', feature, bins), lambda: self.aggregate.histogram(feature, bins))
+
+    def distribution(self, feature, bins=50, mode='fixed', by=None, genres=None):
+        # Only the per-genre grids of FEATURE_RANGES features are kept while streaming
+        if mode != 'fixed' or by == 'explicit' or feature not in FEATURE_RANGES:
+            raise ValueError("adaptive bins, explicit groups and features without a known range need the whole "
+                             "dataset in memory (DATASET_STREAMING is on)")
+        return self.aggregate.distribution(feature, bins, by, genres)
+
+    def prepare(self):
+        # No distribution tables: ``distribution`` reads the aggregate's grids, and tables
+        # built from the sample would never be read
+        self.fingerprint
+        self.genre_stats
+        return self
+
+    @cached_property
+    def artist_index(self):
+        return ArtistIndex.from_genre_totals(self.aggregate.artists)
+
+    def top_tracks(self, top_n=10):
+        return self.aggregate.top.head(top_n)
+
+    def filtered(self, row_filter):
+        raise ValueError("filters need the whole dataset in memory (DATASET_STREAMING is on)")
+
+    def similar_tracks(self, track_ids, k=10, row_filter=None):
+        # The reservoir sample would only find the tracks it happens to hold
+        raise ValueError("similar tracks need the whole dataset in memory (DATASET_STREAMING is on)")
+
+    def append(self, batch):
+        # Versions are chained exactly as DatasetSnapshot.append does, so that streaming and
+        # in-memory workers agree on them
+        batch = storage.concat_frames(self._frame.head(0), batch)
+        batch_hashes = pd.util.hash_pandas_object(batch, index=False).values
+
+        aggregate = copy.deepcopy(self.aggregate).update(batch)
+        snapshot = StreamingSnapshot(aggregate)
+        snapshot.fingerprint = chain_version(self.fingerprint, frame_fingerprint(batch, batch_hashes))
+        versions = dict(self.genre_versions)
+        for genre, digest in genre_digests(batch, batch_hashes).items():
+            versions[genre] = chain_version(versions.get(genre, ''), digest)
+        snapshot.genre_versions = versions
+        return snapshot
+
+    def __len__(self):
+        return self.aggregate.rows
+
+
+def aggregate_file(path, chunksize=500_000, sample_size=1000, seed=0, columns=storage.ANALYSIS_COLUMNS):
+    """
+    Streams the ``columns`` of a CSV or Parquet file (all when None) into a StreamingSnapshot.
+    """
+    start = time.perf_counter()
+    aggregate = StreamingAggregate(sample_size=sample_size, seed=seed)
+    for chunk in iter_chunks(path, chunksize, columns):
+        aggregate.update(chunk)
+    print(f"Streamed {aggregate.rows} tracks in {aggregate.chunks} chunks in {time.perf_counter() - start:.2f}s")
+    return StreamingSnapshot(aggregate)
@@ -0,0 +1,63 @@
+"""
+Compares top-K artist queries answered by the artist index with an explode + groupby over
+the collaborations, and reports the index build time.
+
+Usage:
+    python -m benchmarks.bench_artists [--rows 114000 1140000]
+"""
+import argparse
+import time
+
+import pandas as pd
+
+from app import storage
+from app.indexes import ArtistIndex
+from benchmarks.synthetic import make_tracks
+
+QUERIES = {
+    'top 20': {},
+    'top 20, >= 5 tracks': {'min_tracks': 5},
+    'top 20 in pop': {'genres': ['pop']},
+    'top 20 in 3 genres, >= 3 tracks': {'genres': ['pop', 'rock', 'jazz'], 'min_tracks': 3},
+}
+
+
+def _best(func, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def groupby_top(df, k, min_tracks=1, genres=None):
+    if genres is not None:
+        df = df[df['track_genre'].astype(str).isin(genres)]
+    pairs = df[['artists', 'popularity']].assign(artists=df['artists'].astype(str).str.split(';')).explode('artists')
+    stats = pairs.groupby('artists')['popularity'].agg(['count', 'mean', 'max'])
+    return stats[stats['count'] >= min_tracks].nlargest(k, 'mean')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[114000, 1140000])
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        df = storage.apply_schema(make_tracks(rows))
+        start = time.perf_counter()
+        index = ArtistIndex(df)
+        print(f"\n{rows} rows, {len(index.names)} artists, index built in {time.perf_counter() - start:.2f}s")
+        print(f"{'query':36}{'groupby (ms)':>14}{'index (ms)':>12}")
+        for name, query in QUERIES.items():
+            expected = groupby_top(df, 20, **query)
+            pd.testing.assert_series_equal(index.top(20, **query)['mean'].sort_values(), expected['mean'].sort_values(),
+                                           check_names=False, check_index=False)
+            scan = _best(lambda: groupby_top(df, 20, **query), repeat=2)
+            indexed = _best(lambda: index.top(20, **query))
+            print(f"{name:36}{scan * 1e3:>14.1f}{indexed * 1e3:>12.3f}")
+
+
+if __name__ == '__main__':
+    main()
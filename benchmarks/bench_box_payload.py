@@ -0,0 +1,52 @@
+"""
+Compares the figure JSON of the raw ``px.box`` charts with the server-side summaries.
+
+Usage:
+    python -m benchmarks.bench_box_payload [--rows 10000 50000 114000]
+"""
+import argparse
+import time
+
+import plotly.express as px
+
+from app import storage
+from app.models import precomputed_box_figure
+from app.snapshot import DatasetSnapshot
+from benchmarks.synthetic import make_tracks
+
+FEATURES = ['duration_ms', 'tempo', 'energy']
+
+
+def _raw_box_json(df, feature):
+    return px.box(df, x='track_genre', y=feature, color='track_genre').to_json()
+
+
+def _summary_box_json(snapshot, feature):
+    summary = snapshot.box_summary(feature)
+    return precomputed_box_figure(summary, title=feature, labels={'x': 'Genre', 'y': feature}).to_json()
+
+
+def _measure(func, *args):
+    start = time.perf_counter()
+    payload = func(*args)
+    return time.perf_counter() - start, len(payload.encode())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 50000, 114000])
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'feature':<12}{'raw (s)':>9}{'raw (kB)':>10}{'summary (s)':>13}{'summary (kB)':>14}")
+    for rows in args.rows:
+        df = storage.apply_schema(make_tracks(rows))
+        snapshot = DatasetSnapshot(df)
+        for feature in FEATURES:
+            raw_time, raw_bytes = _measure(_raw_box_json, df, feature)
+            summary_time, summary_bytes = _measure(_summary_box_json, snapshot, feature)
+            print(f"{rows:>8} {feature:<12}{raw_time:>9.3f}{raw_bytes / 1e3:>10.0f}"
+                  f"{summary_time:>13.3f}{summary_bytes / 1e3:>14.0f}")
+
+
+if __name__ == '__main__':
+    main()
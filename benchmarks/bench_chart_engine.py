@@ -0,0 +1,48 @@
+"""
+Measures cold rendering of the dashboard charts, serially and with the chart engine.
+
+Usage:
+    python -m benchmarks.bench_chart_engine [--rows 114000] [--workers 1 2 4]
+"""
+import argparse
+import time
+
+from app import cache, create_app, storage
+from app.charts import DASHBOARD_CHARTS, render_chart
+from app.engine import ChartEngine
+from benchmarks.synthetic import make_tracks
+
+
+def _cold(app, func):
+    with app.app_context():
+        cache.clear()
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=114000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+
+    df = storage.apply_schema(make_tracks(args.rows))
+    app = create_app({'ARTIFACT_CACHE_TYPE': None, 'DATASET_LOADER': lambda: df})
+    snapshot = app.extensions['dataset_registry'].get()
+
+    def serial():
+        for name, params in DASHBOARD_CHARTS:
+            render_chart(name, snapshot, params)
+
+    print(f"{'mode':<10}{'workers':>8}{'seconds':>10}")
+    print(f"{'serial':<10}{1:>8}{_cold(app, serial):>10.2f}")
+    for executor in ('thread', 'process'):
+        for workers in args.workers:
+            engine = ChartEngine(workers, executor)
+            seconds = _cold(app, lambda: engine.render(snapshot, DASHBOARD_CHARTS))
+            print(f"{executor:<10}{workers:>8}{seconds:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Compares ``fig.to_json()`` with the dashboard's figure encoder, per dashboard chart.
+
+Usage:
+    python -m benchmarks.bench_figure_encoding [--rows 114000]
+"""
+import argparse
+import time
+from unittest import mock
+
+from app import create_app, models, storage
+from app.charts import CHARTS, DASHBOARD_CHARTS
+from app.serialization import FigureEncoder
+from benchmarks.synthetic import make_tracks
+
+ENCODERS = {
+    'to_json': lambda fig: fig.to_json(),
+    'text-f64': FigureEncoder('float64', binary=False).encode,
+    'b64-f64': FigureEncoder('float64').encode,
+    'b64-f32': FigureEncoder('float32').encode,
+}
+
+
+def _figures(snapshot):
+    # Run every dashboard chart, keeping the figure instead of its JSON
+    figures = {}
+    for name, params in DASHBOARD_CHARTS:
+        with mock.patch.object(models, 'figure_to_json', lambda fig: figures.setdefault(name, fig) and ''):
+            CHARTS[name].function.uncached(snapshot, **params)
+    return figures
+
+
+def _measure(encode, fig, repeat=10):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        payload = encode(fig)
+    return (time.perf_counter() - start) / repeat, len(payload.encode())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=114000)
+    args = parser.parse_args()
+
+    df = storage.apply_schema(make_tracks(args.rows))
+    app = create_app({'ARTIFACT_CACHE_TYPE': None, 'DATASET_LOADER': lambda: df})
+    figures = _figures(app.extensions['dataset_registry'].get())
+
+    print(f"{'chart':<30}" + ''.join(f"{name + ' (ms)':>16}{name + ' (kB)':>16}" for name in ENCODERS))
+    totals = {name: [0.0, 0] for name in ENCODERS}
+    for chart, fig in figures.items():
+        row = f"{chart:<30}"
+        for name, encode in ENCODERS.items():
+            seconds, size = _measure(encode, fig)
+            totals[name][0] += seconds
+            totals[name][1] += size
+            row += f"{seconds * 1e3:>16.1f}{size / 1e3:>16.0f}"
+        print(row)
+    print(f"{'total':<30}" + ''.join(f"{seconds * 1e3:>16.1f}{size / 1e3:>16.0f}"
+                                     for seconds, size in totals.values()))
+
+
+if __name__ == '__main__':
+    main()
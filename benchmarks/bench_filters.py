@@ -0,0 +1,65 @@
+"""
+Compares row filters answered by the precomputed indexes with full boolean-mask scans,
+and times a filtered chart end to end.
+
+Usage:
+    python -m benchmarks.bench_filters [--rows 114000 1140000]
+"""
+import argparse
+import math
+import time
+
+import numpy as np
+
+from app import storage
+from app.charts import CHARTS
+from app.indexes import RowFilter
+from app.snapshot import DatasetSnapshot
+from benchmarks.synthetic import make_tracks
+
+FILTERS = {
+    'explicit pop, popularity > 70': RowFilter(['pop'], True, [('popularity', 71, math.inf)]),
+    '3 genres': RowFilter(['pop', 'rock', 'jazz']),
+    'energy 0.4-0.5, tempo 120-130': RowFilter(ranges=[('energy', 0.4, 0.5), ('tempo', 120, 130)]),
+    'non-explicit': RowFilter(explicit=False),
+}
+
+
+def _best(func, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[114000, 1140000])
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        df = storage.apply_schema(make_tracks(rows))
+        snapshot = DatasetSnapshot(df)
+        start = time.perf_counter()
+        index = snapshot.filter_index
+        for row_filter in FILTERS.values():
+            index.rows(row_filter)  # Builds the sorted arrays of the filtered features
+        print(f"\n{rows} rows, indexes built in {time.perf_counter() - start:.2f}s")
+        CHARTS['genre_popularity'].function.uncached(snapshot.filtered(RowFilter(['pop'])))  # Warms plotly up
+        print(f"{'filter':32}{'tracks':>9}{'scan (ms)':>11}{'index (ms)':>12}{'chart (ms)':>12}")
+        for name, row_filter in FILTERS.items():
+            assert np.array_equal(index.rows(row_filter), np.flatnonzero(row_filter.mask(df)))
+            scan = _best(lambda: np.flatnonzero(row_filter.mask(df)))
+            indexed = _best(lambda: index.rows(row_filter))
+            # First (uncached) chart over the filtered tracks, filter resolution included
+            start = time.perf_counter()
+            filtered = snapshot.filtered(row_filter)
+            CHARTS['genre_popularity'].function.uncached(filtered)
+            chart = time.perf_counter() - start
+            print(f"{name:32}{len(filtered):>9}{scan * 1e3:>11.2f}{indexed * 1e3:>12.2f}{chart * 1e3:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Compares the legacy CSV round-trip of ``load_data`` with the typed Parquet cache.
+
+Usage:
+    python -m benchmarks.bench_load_data [--rows 114000] [--csv path/to/export.csv]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from app import storage
+from app.models import load_data
+from benchmarks.synthetic import make_tracks
+
+
+def _timed(func, repeat=3):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def _megabytes(df):
+    return df.memory_usage(deep=True).sum() / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=114000, help="Rows of synthetic data when --csv is not given")
+    parser.add_argument('--csv', help="Existing CSV export of the dataset")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = args.csv
+        if csv_path is None:
+            csv_path = os.path.join(tmp, 'tracks.csv')
+            make_tracks(args.rows).to_csv(csv_path, index=False)
+        cache_path = os.path.join(tmp, 'tracks.parquet')
+
+        legacy_time, legacy_df = _timed(lambda: pd.read_csv(csv_path))
+        start = time.perf_counter()
+        load_data(csv_path, cache_path=cache_path)
+        rebuild_time = time.perf_counter() - start
+        cached_time, cached_df = _timed(lambda: load_data(csv_path, cache_path=cache_path))
+
+        print(f"rows: {len(legacy_df)}")
+        print(f"{'':24}{'time (s)':>10}{'memory (MB)':>14}")
+        print(f"{'legacy pd.read_csv':24}{legacy_time:>10.3f}{_megabytes(legacy_df):>14.1f}")
+        print(f"{'typed CSV + cache build':24}{rebuild_time:>10.3f}{'':>14}")
+        print(f"{'parquet cache':24}{cached_time:>10.3f}{_megabytes(cached_df):>14.1f}")
+        print(f"speed-up: {legacy_time / cached_time:.1f}x, "
+              f"memory reduction: {_megabytes(legacy_df) / _megabytes(cached_df):.1f}x, "
+              f"cache file: {os.path.getsize(cache_path) / 1e6:.1f} MB "
+              f"(schema v{storage.SCHEMA_VERSION})")
+        print()
+        print(storage.memory_report(legacy_df, cached_df).to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Compares the memory of N worker processes loading the dataset from the Parquet cache with
+N workers mapping the shared Arrow file (see ``app.shared``).
+
+Each worker loads the dataset, renders the dashboard charts, waits for the others, then
+reads its memory from /proc/self/smaps_rollup (Linux): ``private`` is what the worker
+alone pays for, ``pss`` its proportional share of the pages it shares with others.
+
+Usage:
+    python -m benchmarks.bench_shared [--rows 1140000] [--workers 4]
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from benchmarks.bench_streaming import write_file
+
+
+def _memory():
+    values = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            name, _, rest = line.partition(':')
+            if name in ('Pss', 'Private_Clean', 'Private_Dirty'):
+                values[name] = int(rest.split()[0]) / 1024
+    return values.get('Private_Clean', 0) + values.get('Private_Dirty', 0), values.get('Pss', 0)
+
+
+def _worker(mode, csv_path, cache_path, shared_path, barrier, results):
+    from app.charts import CHARTS, DASHBOARD_CHARTS
+    from app.models import load_data
+    from app.shared import map_shared
+    from app.snapshot import DatasetSnapshot
+
+    baseline = _memory()[0]
+    start = time.perf_counter()
+    if mode == 'shared':
+        snapshot = map_shared(shared_path)
+    else:
+        snapshot = DatasetSnapshot(load_data(csv_path, cache_path=cache_path)).prepare()
+    started = time.perf_counter() - start
+    for name, params in DASHBOARD_CHARTS:
+        CHARTS[name].function.uncached(snapshot, **params)
+    barrier.wait()  # Every worker holds its dataset
+    private, pss = _memory()
+    results.put((started, private - baseline, pss))
+    barrier.wait()
+
+
+def _run(mode, workers, *paths):
+    context = multiprocessing.get_context('spawn')  # No pages inherited from this process
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [context.Process(target=_worker, args=(mode, *paths, barrier, results)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    measured = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return measured
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_140_000)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    from app.models import load_data
+    from app.shared import SharedDataset
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, 'tracks.csv')
+        cache_path = os.path.join(tmp, 'tracks.parquet')
+        shared_path = os.path.join(tmp, 'dataset.arrow')
+        write_file(csv_path, args.rows, min(args.rows, 500_000))
+        SharedDataset(shared_path, lambda: load_data(csv_path, cache_path=cache_path), csv_path).publish()
+        print(f"{args.rows} tracks, {args.workers} workers, shared file {os.path.getsize(shared_path) / 1e6:.1f} MB")
+
+        print(f"{'mode':10}{'start (s)':>12}{'private (MB)':>15}{'pss (MB)':>12}{'total pss (MB)':>17}")
+        for mode in ('parquet', 'shared'):
+            measured = _run(mode, args.workers, csv_path, cache_path, shared_path)
+            started = max(result[0] for result in measured)
+            private = sum(result[1] for result in measured) / len(measured)
+            pss = [result[2] for result in measured]
+            print(f"{mode:10}{started:>12.3f}{private:>15.1f}{sum(pss) / len(pss):>12.1f}{sum(pss):>17.1f}")
+
+
+if __name__ == '__main__':
+    main()
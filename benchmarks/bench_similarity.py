@@ -0,0 +1,66 @@
+"""
+Compares similar-track queries answered by the KD-tree of the similarity index with the
+brute-force scan, and reports the index build time.
+
+Usage:
+    python -m benchmarks.bench_similarity [--rows 114000 1140000] [--k 10]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app import storage
+from app.indexes import FilterIndex, RowFilter
+from app.similarity import SimilarityIndex
+from benchmarks.synthetic import make_tracks
+
+FILTERS = {
+    'no filter': None,
+    'not explicit': RowFilter(explicit=False),
+    'explicit (8%)': RowFilter(explicit=True),
+    'pop': RowFilter(genres=['pop']),
+}
+
+
+def _best(func, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[114000, 1140000])
+    parser.add_argument('--k', type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    for rows in args.rows:
+        df = storage.apply_schema(make_tracks(rows))
+        start = time.perf_counter()
+        index = SimilarityIndex(df)
+        index.tree  # Built on the first query
+        built = time.perf_counter() - start
+        brute = SimilarityIndex(df, use_tree=False)
+        filters = FilterIndex(df)
+        single = [df['track_id'].iloc[int(rng.integers(rows))]]
+        batch = df['track_id'].iloc[rng.integers(rows, size=100)].tolist()
+        print(f"\n{rows} rows, index built in {built:.2f}s")
+        print(f"{'query':30}{'brute force (ms)':>18}{'tree (ms)':>11}")
+        for name, row_filter in FILTERS.items():
+            allowed = None if row_filter is None else filters.rows(row_filter)
+            for label, track_ids in ((f"1 track, {name}", single), (f"100 tracks, {name}", batch)):
+                expected = [result[1] for result in brute.similar(track_ids, args.k, allowed)]
+                found = [result[1] for result in index.similar(track_ids, args.k, allowed)]
+                np.testing.assert_allclose(np.concatenate(found), np.concatenate(expected), atol=2e-3)
+                scan = _best(lambda: brute.similar(track_ids, args.k, allowed), repeat=2)
+                tree = _best(lambda: index.similar(track_ids, args.k, allowed))
+                print(f"{label:30}{scan * 1e3:>18.1f}{tree * 1e3:>11.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Aggregates a large synthetic file in streaming mode and compares it with loading it whole.
+
+The file is generated chunk by chunk, so it can be much larger than memory. Peak memory is
+measured with tracemalloc (numpy and pandas allocations included) in a second, untimed run.
+
+Usage:
+    python -m benchmarks.bench_streaming [--rows 2000000] [--chunksize 200000] [--format parquet]
+        [--skip-in-memory]
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from app import storage
+from app.charts import CHARTS, DASHBOARD_CHARTS
+from app.snapshot import DatasetSnapshot
+from app.streaming import aggregate_file
+from benchmarks.synthetic import make_tracks
+
+
+def write_file(path, rows, chunksize):
+    writer = None
+    for start in range(0, rows, chunksize):
+        chunk = make_tracks(min(chunksize, rows - start), seed=start)
+        chunk['Unnamed: 0'] = range(start, start + len(chunk))
+        if path.endswith('.csv'):
+            chunk.to_csv(path, index=False, mode='a', header=start == 0)
+            continue
+        table = pa.Table.from_pandas(storage.apply_schema(chunk), preserve_index=False)
+        table = table.cast(pa.schema([field.with_type(pa.string()) if pa.types.is_dictionary(field.type) else field
+                                      for field in table.schema]))
+        writer = writer or pq.ParquetWriter(path, table.schema)
+        writer.write_table(table)
+    if writer is not None:
+        writer.close()
+
+
+def _measured(func):
+    # Timed and traced separately: tracemalloc slows pandas down a lot
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak / 1e6
+
+
+def _render_dashboard(snapshot):
+    start = time.perf_counter()
+    for name, params in DASHBOARD_CHARTS:
+        CHARTS[name].function.uncached(snapshot, **params)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--chunksize', type=int, default=200_000)
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='parquet')
+    parser.add_argument('--skip-in-memory', action='store_true', help="Do not load the whole file for comparison")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"tracks.{args.format}")
+        start = time.perf_counter()
+        write_file(path, args.rows, args.chunksize)
+        print(f"{args.rows} rows written to a {os.path.getsize(path) / 1e6:.0f} MB {args.format} file "
+              f"in {time.perf_counter() - start:.1f}s")
+
+        print(f"{'':12}{'load (s)':>10}{'peak (MB)':>12}{'dashboard (s)':>15}")
+        streamed, seconds, peak = _measured(lambda: aggregate_file(path, args.chunksize))
+        print(f"{'streaming':12}{seconds:>10.2f}{peak:>12.0f}{_render_dashboard(streamed):>15.2f}")
+
+        if not args.skip_in_memory:
+            read = storage.read_csv_typed if args.format == 'csv' else storage.read_cache
+            loaded, seconds, peak = _measured(lambda: DatasetSnapshot(read(path)).prepare())
+            print(f"{'in memory':12}{seconds:>10.2f}{peak:>12.0f}{_render_dashboard(loaded):>15.2f}")
+            print(f"same fingerprint: {streamed.fingerprint == loaded.fingerprint}")
+
+
+if __name__ == '__main__':
+    main()
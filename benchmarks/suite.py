@@ -0,0 +1,277 @@
+"""
+Offline benchmark suite: times the whole pipeline on synthetic data at several scales and
+compares the results with a JSON baseline.
+
+For each scale (a multiple of the 114,000 tracks of the Spotify dataset) it measures:
+
+* ``load_data:csv`` (typed CSV read and Parquet cache build) and ``load_data:cache``;
+* every ``analyze_*`` function, cold, on a fresh snapshot (``chart:<name>``), and the part
+  of that time spent serializing the figure (``serialize:<name>``);
+* the dashboard end to end (``dashboard:cold`` and ``dashboard:warm``): ``/dashboard`` and
+  every ``/api/charts/<name>`` request it makes, through the Flask test client.
+
+Each entry records the wall time (best of ``--repeat`` runs), the peak memory (traced with
+tracemalloc in a separate run, as it slows pandas down) and the payload size in bytes.
+An entry regresses when it is slower, uses more memory or sends more bytes than the
+baseline beyond the tolerances; the command then exits with status 1.
+
+Usage:
+    python -m benchmarks.suite [--scales 1 10 100] [--baseline benchmarks/baseline.json]
+        [--save] [--repeat 3] [--no-memory]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from app import cache, create_app
+from app.charts import CHARTS, DASHBOARD_CHARTS
+from app.models import load_data
+from app.serialization import encoder
+from app.snapshot import DatasetSnapshot
+from benchmarks.bench_streaming import write_file
+
+SPOTIFY_ROWS = 114000
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# Relative increase tolerated before an entry is reported as a regression, and the absolute
+# change ignored for very small measurements (timer and allocator noise)
+TOLERANCES = {'seconds': 0.25, 'peak_mb': 0.10, 'bytes': 0.01}
+MIN_CHANGES = {'seconds': 0.005, 'peak_mb': 1.0, 'bytes': 64}
+
+
+def _peak(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+
+@contextmanager
+def _serialization_timer():
+    # Accumulates the time spent in figure_to_json while the charts render
+    timings = []
+    encode = encoder.encode
+
+    def timed(fig):
+        start = time.perf_counter()
+        result = encode(fig)
+        timings.append(time.perf_counter() - start)
+        return result
+
+    encoder.encode = timed
+    try:
+        yield timings
+    finally:
+        del encoder.encode
+
+
+class Recorder:
+    """
+    Collects the measurements of one scale.
+    """
+
+    def __init__(self, repeat=3, memory=True):
+        self.repeat = repeat
+        self.memory = memory
+        self.results = {}
+
+    def measure(self, name, func, setup=None, payload=None):
+        """
+        Times ``func()`` (after ``setup()`` before each run, untimed) and records its result.
+
+        Args:
+            name: Entry name.
+            func: The measured call; receives the result of ``setup`` when given.
+            setup: Builds fresh inputs for each run, e.g. an empty cache.
+            payload: Returns the payload size in bytes from the result of ``func``.
+        """
+        def run():
+            return func(setup()) if setup else func()
+
+        def timed():
+            # setup() runs outside the timed section
+            inputs = setup() if setup else None
+            start = time.perf_counter()
+            result = func(inputs) if setup else func()
+            return time.perf_counter() - start, result
+
+        runs = [timed() for _ in range(self.repeat)]
+        seconds, result = min(runs, key=lambda run: run[0])
+        entry = {'seconds': round(seconds, 6)}
+        if self.memory:
+            entry['peak_mb'] = round(_peak(run), 3)
+        if payload is not None:
+            entry['bytes'] = int(payload(result))
+        self.results[name] = entry
+        return result
+
+
+def _measure_load(recorder, tmp, rows):
+    csv_path = os.path.join(tmp, 'tracks.csv')
+    write_file(csv_path, rows, min(rows, 500_000))
+
+    def fresh_cache():
+        path = os.path.join(tmp, 'tracks.parquet')
+        if os.path.exists(path):
+            os.remove(path)
+        return path
+
+    recorder.measure('load_data:csv', lambda path: load_data(csv_path, cache_path=path), setup=fresh_cache,
+                     payload=lambda df: os.path.getsize(csv_path))
+    cache_path = os.path.join(tmp, 'tracks.parquet')
+    return recorder.measure('load_data:cache', lambda: load_data(csv_path, cache_path=cache_path),
+                            payload=lambda df: os.path.getsize(cache_path))
+
+
+def _measure_charts(recorder, df):
+    for name, params in DASHBOARD_CHARTS:
+        function = CHARTS[name].function.uncached
+        with _serialization_timer() as timings:
+            def render(snapshot):
+                timings.clear()
+                result = function(snapshot, **params)
+                return result, sum(timings)
+
+            _, serialization = recorder.measure(f"chart:{name}", render, setup=lambda: DatasetSnapshot(df),
+                                                payload=lambda result: len(result[0][0]))
+        # Serialization time within the fastest run
+        recorder.results[f"serialize:{name}"] = {'seconds': round(serialization, 6)}
+
+
+def _measure_dashboard(recorder, df):
+    app = create_app({'ARTIFACT_CACHE_TYPE': None, 'DATASET_LOADER': lambda: df, 'DATASET_DELTA_DIR': None})
+    client = app.test_client()
+    urls = ['/dashboard'] + [f"/api/charts/{name}" for name, _ in DASHBOARD_CHARTS]
+    params = [{}] + [params for _, params in DASHBOARD_CHARTS]
+
+    def load_page(_=None):
+        size = 0
+        for url, query in zip(urls, params):
+            response = client.get(url, query_string=query, headers={'Accept-Encoding': 'gzip'})
+            assert response.status_code == 200, (url, response.status_code)
+            size += len(response.data)
+        return size
+
+    def cold():
+        with app.app_context():
+            cache.clear()
+        # A new snapshot, as after a restart: derived structures are rebuilt too
+        app.extensions['dataset_registry'].reload()
+
+    recorder.measure('dashboard:cold', load_page, setup=cold, payload=lambda size: size)
+    recorder.measure('dashboard:warm', load_page, payload=lambda size: size)
+
+
+def run_scale(rows, repeat=3, memory=True):
+    """
+    Runs every benchmark on ``rows`` synthetic tracks.
+
+    Returns:
+        A dict of entries, each with ``seconds`` and optionally ``peak_mb`` and ``bytes``.
+    """
+    recorder = Recorder(repeat, memory)
+    with tempfile.TemporaryDirectory() as tmp:
+        df = _measure_load(recorder, tmp, rows)
+    _warm_up(df)
+    _measure_charts(recorder, df)
+    _measure_dashboard(recorder, df)
+    return recorder.results
+
+
+def _warm_up(df):
+    # Imports and first-call setup of plotly are not part of any measurement
+    snapshot = DatasetSnapshot(df.head(2000))
+    for name, params in DASHBOARD_CHARTS:
+        CHARTS[name].function.uncached(snapshot, **params)
+
+
+def compare(results, baseline, tolerances=None):
+    """
+    Lists the entries of ``results`` that regressed against ``baseline`` (same layout).
+
+    Returns:
+        A list of ``(scale, entry, metric, baseline value, new value)``.
+    """
+    tolerances = {**TOLERANCES, **(tolerances or {})}
+    regressions = []
+    for scale, entries in results.items():
+        for name, entry in entries.items():
+            reference = baseline.get(scale, {}).get(name, {})
+            for metric, value in entry.items():
+                old = reference.get(metric)
+                if old is None:
+                    continue
+                if value > old * (1 + tolerances[metric]) and value - old > MIN_CHANGES[metric]:
+                    regressions.append((scale, name, metric, old, value))
+    return regressions
+
+
+def environment():
+    return {
+        'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+    }
+
+
+def _print_results(scale, entries, baseline):
+    print(f"\n{scale}")
+    print(f"{'entry':44}{'seconds':>10}{'peak (MB)':>11}{'bytes':>12}{'vs baseline':>13}")
+    for name, entry in entries.items():
+        old = baseline.get(scale, {}).get(name, {}).get('seconds')
+        change = f"{entry['seconds'] / old - 1:+.0%}" if old else ''
+        peak = f"{entry['peak_mb']:.1f}" if 'peak_mb' in entry else ''
+        size = entry.get('bytes', '')
+        print(f"{name:44}{entry['seconds']:>10.3f}{peak:>11}{size:>12}{change:>13}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', type=float, nargs='+', default=[1],
+                        help="Multiples of the Spotify dataset size (114,000 tracks), e.g. 1 10 100")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save', action='store_true', help="Write the results as the new baseline")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true', help="Skip the (slower) peak memory runs")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f).get('results', {})
+
+    results = {}
+    for scale in args.scales:
+        key = f"{scale:g}x"
+        results[key] = run_scale(int(SPOTIFY_ROWS * scale), repeat=args.repeat, memory=not args.no_memory)
+        _print_results(key, results[key], baseline)
+
+    regressions = compare(results, baseline)
+    for scale, name, metric, old, new in regressions:
+        print(f"REGRESSION {scale} {name} {metric}: {old:g} -> {new:g} ({new / old - 1:+.0%})")
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({'environment': environment(), 'results': {**baseline, **results}}, f, indent=2)
+        print(f"\nbaseline written to {args.baseline}")
+    elif not baseline:
+        print("\nno baseline to compare with: run again with --save to record one")
+    return 1 if regressions and not args.save else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""
+Synthetic Spotify Tracks data for offline benchmarks and tests.
+
+The generated frame has the same columns and raw types as the Hugging Face
+dataset (as returned by ``pd.read_csv`` on the legacy export), so it can be
+fed to ``load_data`` or directly to the ``analyze_*`` functions.
+"""
+import numpy as np
+import pandas as pd
+
+GENRES = (
+    'acoustic afrobeat alt-rock alternative ambient anime black-metal bluegrass blues brazil '
+    'breakbeat british cantopop chicago-house children chill classical club comedy country '
+    'dance dancehall death-metal deep-house detroit-techno disco disney drum-and-bass dub '
+    'dubstep edm electro electronic emo folk forro french funk garage german gospel goth '
+    'grindcore groove grunge guitar happy hard-rock hardcore hardstyle heavy-metal hip-hop '
+    'honky-tonk house idm indian indie-pop indie industrial iranian j-dance j-idol j-pop '
+    'j-rock jazz k-pop kids latin latino malay mandopop metal metalcore minimal-techno mpb '
+    'new-age opera pagode party piano pop-film pop power-pop progressive-house psych-rock '
+    'punk-rock punk r-n-b reggae reggaeton rock-n-roll rock rockabilly romance sad salsa '
+    'samba sertanejo show-tunes singer-songwriter ska sleep songwriter soul spanish study '
+    'swedish synth-pop tango techno trance trip-hop turkish world-music'
+).split()
+
+_ALPHABET = np.array(list('0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+
+
+def _names(prefix, count):
+    return np.array([f"{prefix} {i}" for i in range(count)], dtype=object)
+
+
+def make_tracks(n_rows=114000, seed=0, n_genres=None):
+    """
+    Generates a synthetic tracks table.
+
+    Args:
+        n_rows: Number of tracks to generate.
+        seed: Seed of the random generator; the same seed always gives the same frame.
+        n_genres: Number of genres to use (defaults to all 114 Spotify genres).
+
+    Returns:
+        A DataFrame with the columns of the Spotify Tracks dataset.
+    """
+    rng = np.random.default_rng(seed)
+    genres = np.array(GENRES[:n_genres] if n_genres else GENRES, dtype=object)
+    genre_codes = np.arange(n_rows) % len(genres)
+
+    # Per-genre offsets make the group statistics differ like in the real data.
+    genre_shift = rng.normal(0.0, 1.0, size=(len(genres), 6))[genre_codes]
+
+    n_artists = max(1, n_rows // 4)
+    artists = _names('Artist', n_artists)
+    main_artist = np.minimum(rng.zipf(1.3, size=n_rows) - 1, n_artists - 1)
+    artist_col = artists[main_artist]
+    collab = rng.random(n_rows) < 0.15
+    partner = artists[rng.integers(0, n_artists, size=collab.sum())]
+    artist_col[collab] = [f"{a};{b}" for a, b in zip(artist_col[collab], partner)]
+
+    albums = _names('Album', max(1, n_rows // 2))
+    track_ids = [''.join(chars) for chars in _ALPHABET[rng.integers(0, len(_ALPHABET), size=(n_rows, 22))]]
+
+    def unit(a, b, shift):
+        return np.clip(rng.beta(a, b, size=n_rows) + 0.05 * shift, 0.0, 1.0)
+
+    df = pd.DataFrame({
+        'Unnamed: 0': np.arange(n_rows),
+        'track_id': track_ids,
+        'artists': artist_col,
+        'album_name': albums[rng.integers(0, len(albums), size=n_rows)],
+        'track_name': _names('Track', n_rows)[rng.permutation(n_rows)],
+        'popularity': np.clip(rng.normal(33 + 8 * genre_shift[:, 0], 22), 0, 100).astype(np.int64),
+        'duration_ms': np.clip(rng.lognormal(12.3, 0.35, size=n_rows), 8000, 5_200_000).astype(np.int64),
+        'explicit': rng.random(n_rows) < np.clip(0.085 + 0.05 * genre_shift[:, 1], 0.0, 1.0),
+        'danceability': unit(5.0, 3.5, genre_shift[:, 2]),
+        'energy': unit(3.0, 1.7, genre_shift[:, 3]),
+        'key': rng.integers(0, 12, size=n_rows),
+        'loudness': np.clip(rng.normal(-8.3 + 1.5 * genre_shift[:, 3], 5.0), -49.5, 4.5),
+        'mode': (rng.random(n_rows) < 0.64).astype(np.int64),
+        'speechiness': unit(1.2, 12.0, 0),
+        'acousticness': unit(0.5, 1.1, -genre_shift[:, 3]),
+        'instrumentalness': np.where(rng.random(n_rows) < 0.6, 0.0, rng.beta(0.4, 0.6, size=n_rows)),
+        'liveness': unit(1.5, 5.5, 0),
+        'valence': unit(2.0, 2.1, genre_shift[:, 4]),
+        'tempo': np.clip(rng.normal(122 + 6 * genre_shift[:, 5], 30), 0, 243),
+        'time_signature': rng.choice([1, 3, 4, 5], size=n_rows, p=[0.01, 0.08, 0.89, 0.02]),
+        'track_genre': genres[genre_codes],
+    })
+    return df
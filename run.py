@@ -1,6 +1,7 @@
 from app import create_app
 
-app = create_app()
+# Start loading the dataset in the background so the server accepts requests immediately
+app = create_app({'DATASET_WARM_UP': True})
 
 if __name__ == '__main__':
     app.run(debug=True)  # Set debug=False in production
\ No newline at end of file
@@ -0,0 +1,217 @@
+import json
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from flask import Flask
+
+from app import cache, create_app, storage
+from app.aggregates import (FEATURE_STATS, build_box_summary, build_distributions, build_genre_stats, density_grid,
+                            distribution_counts, genre_order, stratified_sample)
+from app.models import (analyze_duration_by_genre, analyze_energy_vs_danceability, analyze_explicit_content,
+                        analyze_genre_popularity, analyze_music_features_by_genre)
+from app.snapshot import DatasetSnapshot
+from benchmarks.synthetic import make_tracks
+
+
+class TestGenreStats(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.df = storage.apply_schema(make_tracks(2000, n_genres=7))
+        cls.stats = build_genre_stats(cls.df)
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        cache.init_app(self.app)
+
+    def test_matches_direct_groupby(self):
+        grouped = self.df.groupby('track_genre', observed=True)
+        expected = {
+            ('popularity', 'mean'): grouped['popularity'].mean(),
+            ('tempo', 'median'): grouped['tempo'].median().astype('float64'),
+            ('explicit', 'share'): grouped['explicit'].mean(),
+        }
+        self.assertEqual(len(self.stats), 7)
+        for column, series in expected.items():
+            series.index = series.index.astype(str)
+            pd.testing.assert_series_equal(self.stats[column], series, check_names=False)
+        self.assertEqual(self.stats[('tracks', 'count')].sum(), len(self.df))
+
+    def test_every_feature_has_every_stat(self):
+        for feature in ['popularity', 'duration_ms', 'danceability', 'tempo']:
+            self.assertEqual(self.stats[feature].columns.tolist(), FEATURE_STATS)
+
+    def test_genre_order(self):
+        order = genre_order(self.stats, 'duration_ms', 'median')
+        medians = self.stats.loc[order, ('duration_ms', 'median')]
+        self.assertTrue(medians.is_monotonic_decreasing)
+
+    def test_genre_charts_do_not_rescan_the_frame(self):
+        snapshot = DatasetSnapshot(self.df).prepare()
+        groupby = pd.DataFrame.groupby
+
+        def guarded_groupby(frame, *args, **kwargs):
+            # Plotly may group the small per-genre table, never the tracks themselves
+            self.assertLess(len(frame), len(self.df))
+            return groupby(frame, *args, **kwargs)
+
+        with self.app.app_context(), mock.patch.object(pd.DataFrame, 'groupby', guarded_groupby):
+            analyze_genre_popularity(snapshot)
+            analyze_explicit_content(snapshot)
+            graph_json, _ = analyze_music_features_by_genre(snapshot, 'energy')
+
+        bars = json.loads(graph_json)['data']
+        self.assertEqual(len(bars), 7)
+
+
+class TestBoxSummary(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.df = storage.apply_schema(make_tracks(3000, n_genres=3))
+        cls.stats = build_genre_stats(cls.df)
+
+    def test_whiskers_follow_tukey_rule(self):
+        summary = build_box_summary(self.df, 'duration_ms', self.stats)
+        for genre, row in summary.iterrows():
+            values = self.df.loc[self.df['track_genre'] == genre, 'duration_ms']
+            iqr = row['q3'] - row['q1']
+            inside = values[(values >= row['q1'] - 1.5 * iqr) & (values <= row['q3'] + 1.5 * iqr)]
+            self.assertEqual(row['lowerfence'], inside.min())
+            self.assertEqual(row['upperfence'], inside.max())
+
+    def test_outliers_are_capped_and_deterministic(self):
+        summary = build_box_summary(self.df, 'duration_ms', self.stats, max_outliers=5)
+        again = build_box_summary(self.df, 'duration_ms', self.stats, max_outliers=5)
+        for genre, row in summary.iterrows():
+            self.assertLessEqual(len(row['outliers']), 5)
+            self.assertTrue((row['outliers'] == again.loc[genre, 'outliers']).all())
+            values = self.df.loc[self.df['track_genre'] == genre, 'duration_ms']
+            if len(row['outliers']):
+                self.assertEqual(row['outliers'].max(), max(values.max(), row['outliers'].max()))
+
+    def test_box_chart_size_does_not_grow_with_rows(self):
+        app = Flask(__name__)
+        sizes = []
+        for n_rows in (3000, 30000):
+            cache.init_app(app)
+            df = storage.apply_schema(make_tracks(n_rows, n_genres=3))
+            with app.app_context():
+                cache.clear()
+                graph_json, _ = analyze_duration_by_genre(df)
+            boxes = [trace for trace in json.loads(graph_json)['data'] if trace['type'] == 'box']
+            self.assertTrue(all('y' not in trace for trace in boxes))
+            sizes.append(len(graph_json))
+        self.assertLess(sizes[1], 1.5 * sizes[0])
+
+
+class TestDensity(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.df = storage.apply_schema(make_tracks(5000, n_genres=10))
+
+    def test_density_grid_counts_every_track(self):
+        grid = density_grid(self.df, 'energy', 'danceability', bins=20)
+        self.assertEqual(grid['z'].shape, (20, 20))
+        self.assertEqual(grid['z'].sum(), len(self.df))
+
+    def test_viewport_only_counts_visible_tracks(self):
+        grid = density_grid(self.df, 'energy', 'danceability', bins=10, x_range=(0.5, 1.0), y_range=(0.0, 0.5))
+        visible = self.df['energy'].between(0.5, 1.0) & self.df['danceability'].between(0.0, 0.5)
+        self.assertEqual(grid['z'].sum(), visible.sum())
+        self.assertTrue((grid['x'] > 0.5).all())
+
+    def test_stratified_sample_is_capped_and_deterministic(self):
+        sample = stratified_sample(self.df, ['energy'], per_group=7)
+        self.assertEqual(sample.groupby('track_genre', observed=True).size().tolist(), [7] * 10)
+        pd.testing.assert_frame_equal(sample, stratified_sample(self.df, ['energy'], per_group=7))
+
+    def test_density_chart_size_does_not_grow_with_rows(self):
+        app = Flask(__name__)
+        cache.init_app(app)
+        sizes = []
+        for n_rows in (2000, 40000):
+            df = storage.apply_schema(make_tracks(n_rows, n_genres=10))
+            with app.app_context():
+                cache.clear()
+                sizes.append(len(analyze_energy_vs_danceability(df)[0]))
+        self.assertLess(sizes[1], 1.2 * sizes[0])
+
+
+class TestDistributions(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.df = storage.apply_schema(make_tracks(5000, n_genres=6))
+        cls.df.loc[cls.df.index[:20], 'tempo'] = np.nan
+        cls.snapshot = DatasetSnapshot(cls.df)
+
+    def test_fixed_bins_match_numpy(self):
+        for feature in self.snapshot.features:
+            values = self.df[feature].to_numpy(dtype='float64', na_value=np.nan)
+            values = values[~np.isnan(values)]
+            table = self.snapshot.distribution(feature, bins=20)
+            counts, _ = np.histogram(values, bins=table['edges'])
+            np.testing.assert_array_equal(table['counts'][0], counts)
+            self.assertEqual(table['counts'].sum(), len(values))
+
+    def test_adaptive_bins_hold_similar_counts(self):
+        table = self.snapshot.distribution('energy', bins=10, mode='adaptive')
+        self.assertEqual(len(table['edges']), 11)
+        self.assertLess(table['counts'].max() - table['counts'].min(), 0.02 * len(self.df))
+        counts, _ = np.histogram(self.df['energy'], bins=table['edges'])
+        np.testing.assert_array_equal(table['counts'][0], counts)
+
+    def test_groups_and_chunks(self):
+        table = build_distributions(self.df, ['energy', 'tempo'], bins=10)
+        with mock.patch('app.aggregates.DISTRIBUTION_CHUNK_ROWS', 700):
+            chunked = build_distributions(self.df, ['energy', 'tempo'], bins=10)
+        np.testing.assert_array_equal(chunked['counts'], table['counts'])
+
+        genre = table['genres'][2]
+        by_genre = distribution_counts(table, 'energy', by='genre', genres=[genre, 'unknown'])
+        expected, _ = np.histogram(self.df.loc[self.df['track_genre'] == genre, 'energy'], bins=by_genre['edges'])
+        self.assertEqual(by_genre['names'], [genre])
+        np.testing.assert_array_equal(by_genre['counts'][0], expected)
+
+        by_explicit = distribution_counts(table, 'energy', by='explicit')
+        explicit = self.df['explicit'].to_numpy(dtype=bool)
+        expected, _ = np.histogram(self.df.loc[explicit, 'energy'], bins=by_explicit['edges'])
+        np.testing.assert_array_equal(by_explicit['counts'][1], expected)
+
+    def test_append_adds_the_batch_counts(self):
+        snapshot = DatasetSnapshot(self.df)
+        table = snapshot.distributions(bins=20)
+        snapshot.distributions(bins=20, mode='adaptive')
+        batch = storage.apply_schema(make_tracks(300, seed=8, n_genres=9))
+        with mock.patch('app.snapshot.build_distributions', wraps=build_distributions) as build:
+            appended = snapshot.append(batch)
+            merged = appended.distributions(bins=20)
+            self.assertEqual(build.call_args.args[0].shape[0], 300)  # Only the batch was counted
+        self.assertNotIn(('distributions', 20, 'adaptive'), appended._derived)
+
+        expected = build_distributions(appended.frame, table['features'], bins=20)
+        self.assertEqual(list(merged['genres']), list(expected['genres']))
+        np.testing.assert_array_equal(merged['counts'], expected['counts'])
+
+    def test_route_size_does_not_grow_with_rows(self):
+        sizes = []
+        for n_rows in (2000, 40000):
+            df = storage.apply_schema(make_tracks(n_rows, n_genres=6))
+            app = create_app({'TESTING': True, 'ARTIFACT_CACHE_TYPE': None, 'DATASET_DELTA_DIR': None,
+                              'DATASET_LOADER': lambda: df})
+            client = app.test_client()
+            response = client.get('/api/distribution/energy', query_string={'by': 'explicit', 'bins': 20})
+            self.assertEqual(response.status_code, 200)
+            body = response.get_json()
+            self.assertEqual(len(body['edges']), 21)
+            self.assertEqual(sum(map(sum, (group['counts'] for group in body['groups']))), n_rows)
+            sizes.append(len(response.data))
+        self.assertLess(sizes[1], 1.2 * sizes[0])
+
+        self.assertEqual(client.get('/api/distribution/unknown').status_code, 404)
+        self.assertEqual(client.get('/api/distribution/energy', query_string={'bins': 7}).status_code, 400)
+        self.assertEqual(client.get('/api/distribution/energy', query_string={'genre': 'nope'}).status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
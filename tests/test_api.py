@@ -0,0 +1,114 @@
+import unittest
+
+from flask import url_for
+
+from app import create_app, storage
+from app.charts import DASHBOARD_CHARTS
+from benchmarks.synthetic import make_tracks
+
+
+class TestApi(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        df = storage.apply_schema(make_tracks(3000, n_genres=6))
+        cls.app = create_app({'TESTING': True, 'ARTIFACT_CACHE_TYPE': None, 'DATASET_LOADER': lambda: df})
+        cls.df = df
+
+    def setUp(self):
+        self.client = self.app.test_client()
+
+    def test_density_full_range(self):
+        response = self.client.get('/api/density?x=energy&y=danceability&bins=20')
+        self.assertEqual(response.status_code, 200)
+        grid = response.get_json()
+        self.assertEqual(len(grid['x']), 20)
+        self.assertEqual(sum(count or 0 for row in grid['z'] for count in row), len(self.df))
+
+    def test_density_viewport(self):
+        response = self.client.get('/api/density?x=energy&y=danceability&x_min=0.2&x_max=0.4&y_min=0&y_max=1')
+        grid = response.get_json()
+        self.assertEqual(grid['x_range'], [0.2, 0.4])
+        visible = self.df['energy'].between(0.2, 0.4) & self.df['danceability'].between(0, 1)
+        self.assertEqual(sum(count or 0 for row in grid['z'] for count in row), visible.sum())
+
+    def test_density_rejects_bad_parameters(self):
+        self.assertEqual(self.client.get('/api/density?x=track_name&y=energy').status_code, 400)
+        self.assertEqual(self.client.get('/api/density?x=energy&y=tempo&x_min=1&x_max=0').status_code, 400)
+        response = self.client.get('/api/density?x=energy&y=tempo&x_min=a&x_max=1')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['error'], 'x_min and x_max must be numbers')
+        response = self.client.get('/api/density?x=energy&y=tempo&y_max=1')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['error'], 'y_min and y_max must be given together')
+        response = self.client.get('/api/density?x=energy&y=tempo&bins=abc')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('bins', response.get_json()['error'])
+
+    def test_chart_index(self):
+        charts = self.client.get('/api/charts').get_json()
+        self.assertIn('music_features_by_genre', charts)
+        self.assertEqual(charts['music_features_by_genre'], ['feature', 'genres', 'top_n'])
+
+    def test_chart_with_parameters(self):
+        response = self.client.get('/api/charts/music_features_by_genre?feature=energy&top_n=3&genres=anime,acoustic')
+        self.assertEqual(response.status_code, 200)
+        payload = response.get_json()
+        self.assertEqual(payload['params'], {'feature': 'energy', 'genres': ['acoustic', 'anime'], 'top_n': 3})
+        self.assertEqual(len(payload['figure']['data']), 2)
+        self.assertIn('Energy', payload['figure']['layout']['title']['text'])
+
+    def test_chart_errors(self):
+        self.assertEqual(self.client.get('/api/charts/nope').status_code, 404)
+        self.assertEqual(self.client.get('/api/charts/genre_popularity?feature=energy').status_code, 400)
+        self.assertEqual(self.client.get('/api/charts/genre_popularity?top_n=0').status_code, 400)
+        self.assertEqual(self.client.get('/api/charts/genre_popularity?genres=polka').status_code, 400)
+        self.assertEqual(self.client.get('/api/charts/music_features_by_genre?feature=track_id').status_code, 400)
+
+    def test_filtered_chart(self):
+        response = self.client.get('/api/charts/tempo_by_genre?genre=acoustic,anime&explicit=false&popularity_min=20')
+        self.assertEqual(response.status_code, 200)
+        payload = response.get_json()
+        self.assertEqual(payload['filter'], {'genre': ['acoustic', 'anime'], 'explicit': False, 'popularity_min': 20.0})
+        expected = (self.df['track_genre'].isin(['acoustic', 'anime']) & ~self.df['explicit']
+                    & (self.df['popularity'] >= 20))
+        self.assertEqual(payload['tracks'], expected.sum())
+        boxes = [trace['name'] for trace in payload['figure']['data'] if trace['type'] == 'box']
+        self.assertEqual(sorted(boxes), ['acoustic', 'anime'])
+
+        unfiltered = self.client.get('/api/charts/tempo_by_genre').get_json()
+        self.assertNotEqual(unfiltered['version'], payload['version'])
+        self.assertEqual(unfiltered['filter'], {})
+
+    def test_filter_errors(self):
+        self.assertEqual(self.client.get('/api/charts/tempo_by_genre?genre=polka').status_code, 400)
+        self.assertEqual(self.client.get('/api/charts/tempo_by_genre?explicit=maybe').status_code, 400)
+        self.assertEqual(self.client.get('/api/charts/tempo_by_genre?track_name_min=1').status_code, 400)
+        self.assertEqual(self.client.get('/api/charts/tempo_by_genre?energy_max=high').status_code, 400)
+        response = self.client.get('/api/charts/tempo_by_genre?energy_min=inf')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('energy_min', response.get_json()['error'])
+        response = self.client.get('/api/charts/tempo_by_genre?popularity_min=101')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.get_json()['error'], 'no tracks match the filters')
+
+    def test_empty_artist_ranking(self):
+        response = self.client.get('/api/charts/top_artists_by_popularity', query_string={'min_tracks': 10000})
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+        self.assertIn('10000', body['interpretation'])
+
+    def test_filtered_density(self):
+        grid = self.client.get('/api/density?x=energy&y=danceability&bins=20&explicit=true').get_json()
+        self.assertEqual(sum(count or 0 for row in grid['z'] for count in row), self.df['explicit'].sum())
+
+    def test_dashboard_links_every_chart(self):
+        shell = self.client.get('/dashboard').get_data(as_text=True)
+        with self.app.test_request_context():
+            for name, params in DASHBOARD_CHARTS:
+                url = url_for('main.chart', name=name, **params)
+                self.assertIn(f'data-src="{url}"', shell)
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+import os
+import tempfile
+import time
+import unittest
+from fnmatch import fnmatch
+from unittest import mock
+
+from app import create_app, storage
+from app.artifacts import FileSystemArtifactCache, RedisArtifactCache
+from app.charts import DASHBOARD_CHARTS
+from app.models import analyze_genre_popularity
+from app.snapshot import DatasetSnapshot
+from benchmarks.synthetic import make_tracks
+
+
+class LocalRedis:
+    """
+    In-process stand-in for the subset of the redis client used by RedisArtifactCache.
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, nx=False, px=None):
+        if nx and key in self.data:
+            return None  # Expiry (px) is not simulated
+        self.data[key] = value
+        return True
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def eval(self, script, numkeys, key, token):
+        # Only the compare-and-delete script of RedisArtifactCache.release
+        if self.data.get(key) == token:
+            del self.data[key]
+            return 1
+        return 0
+
+    def scan_iter(self, match):
+        return [key for key in list(self.data) if fnmatch(key, match)]
+
+
+class TestFileSystemArtifactCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = FileSystemArtifactCache(self.tmp.name, max_bytes=250)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_roundtrip(self):
+        self.assertIsNone(self.store.get('a'))
+        self.store.set('a', b'payload')
+        self.assertEqual(self.store.get('a'), b'payload')
+        self.store.delete('a')
+        self.assertIsNone(self.store.get('a'))
+
+    def test_writes_leave_no_temporary_files(self):
+        self.store.set('a', b'x' * 10)
+        self.store.set('a', b'y' * 10)
+        self.assertEqual(len(os.listdir(self.tmp.name)), 1)
+        self.assertEqual(self.store.get('a'), b'y' * 10)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        for i, key in enumerate(['a', 'b', 'c']):
+            self.store.set(key, bytes(100))
+            os.utime(self.store._path(key), (time.time() - 100 + i, time.time() - 100 + i))
+            if key == 'b':
+                self.store.get('a')  # 'a' becomes more recent than 'b'
+        self.assertIsNotNone(self.store.get('a'))
+        self.assertIsNone(self.store.get('b'))
+        self.assertIsNotNone(self.store.get('c'))
+        self.assertLessEqual(self.store.size(), 250)
+
+    def test_writes_do_not_scan_the_directory(self):
+        store = FileSystemArtifactCache(self.tmp.name, max_bytes=10_000)
+        with mock.patch.object(store, '_entries', wraps=store._entries) as entries:
+            for i in range(50):
+                store.set(str(i), bytes(100))
+            self.assertEqual(entries.call_count, 1)  # The first write measures the directory
+            store.set('big', bytes(9_000))
+            self.assertEqual(entries.call_count, 2)
+        self.assertLessEqual(store.size(), 10_000)
+        self.assertIsNotNone(store.get('big'))
+
+    def test_locks(self):
+        token = self.store.acquire('lock:a', 60)
+        self.assertIsNotNone(token)
+        self.assertIsNone(self.store.acquire('lock:a', 60))
+        self.assertEqual(self.store.size(), 0)
+        self.store.release('lock:a', token)
+        first = self.store.acquire('lock:a', 60)
+        self.assertIsNotNone(first)
+
+        # A lock older than its timeout was left by a worker that died
+        path = self.store._path('lock:a') + '.lock'
+        os.utime(path, (time.time() - 120, time.time() - 120))
+        second = self.store.acquire('lock:a', 60)
+        self.assertIsNotNone(second)
+        self.assertIsNone(self.store.acquire('lock:a', 60))
+
+        # The first holder's release leaves the lock of the second one in place
+        self.store.release('lock:a', first)
+        self.assertIsNone(self.store.acquire('lock:a', 60))
+        self.store.release('lock:a', second)
+        self.assertIsNotNone(self.store.acquire('lock:a', 60))
+
+
+class TestRedisArtifactCache(unittest.TestCase):
+    def test_roundtrip_and_clear(self):
+        client = LocalRedis()
+        client.set('other', b'kept')
+        store = RedisArtifactCache(client, prefix='mi:')
+        store.set('a', b'1')
+        store.set('b', b'2')
+        self.assertEqual(store.get('a'), b'1')
+        store.clear()
+        self.assertIsNone(store.get('b'))
+        self.assertEqual(client.get('other'), b'kept')
+
+
+    def test_locks_are_released_by_their_owner(self):
+        client = LocalRedis()
+        store = RedisArtifactCache(client, prefix='mi:')
+        first = store.acquire('lock:a', 60)
+        self.assertIsNotNone(first)
+        self.assertIsNone(store.acquire('lock:a', 60))
+
+        # The lock expired and was taken by another worker: the first holder keeps off it
+        del client.data['mi:lock:a']
+        second = store.acquire('lock:a', 60)
+        store.release('lock:a', first)
+        self.assertEqual(client.data['mi:lock:a'], second)
+        store.release('lock:a', second)
+        self.assertEqual(client.data, {})
+
+
+class TestSharedChartCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.df = storage.apply_schema(make_tracks(2000, n_genres=5))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_app(self):
+        return create_app({'TESTING': True, 'DATASET_LOADER': lambda: self.df,
+                           'ARTIFACT_CACHE_TYPE': 'filesystem', 'ARTIFACT_CACHE_DIR': self.tmp.name})
+
+    def test_chart_computed_by_one_worker_is_reused_by_another(self):
+        with self.make_app().app_context():
+            expected = analyze_genre_popularity(DatasetSnapshot(self.df))
+
+        # A second app shares only the artifact directory, like another gunicorn worker
+        with self.make_app().app_context(), \
+                mock.patch('app.snapshot.build_genre_stats', side_effect=AssertionError("recomputed")):
+            self.assertEqual(analyze_genre_popularity(DatasetSnapshot(self.df)), expected)
+
+    def test_warm_cache_command_fills_every_dashboard_chart(self):
+        result = self.make_app().test_cli_runner().invoke(args=['warm-cache'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(len(os.listdir(self.tmp.name)), len(DASHBOARD_CHARTS))
+
+    def test_redis_backend_with_local_stand_in(self):
+        app = create_app({'TESTING': True, 'DATASET_LOADER': lambda: self.df, 'ARTIFACT_CACHE_TYPE': None})
+        app.extensions['artifact_cache'] = RedisArtifactCache(LocalRedis())
+        with app.app_context():
+            analyze_genre_popularity(DatasetSnapshot(self.df))
+        self.assertEqual(len(app.extensions['artifact_cache'].client.data), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
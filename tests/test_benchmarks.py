@@ -0,0 +1,27 @@
+import unittest
+
+from app.charts import DASHBOARD_CHARTS
+from benchmarks.suite import compare, run_scale
+
+
+class TestBenchmarkSuite(unittest.TestCase):
+    def test_run_scale_records_every_stage(self):
+        results = run_scale(1500, repeat=1, memory=False)
+        expected = {'load_data:csv', 'load_data:cache', 'dashboard:cold', 'dashboard:warm'}
+        expected |= {f"{stage}:{name}" for name, _ in DASHBOARD_CHARTS for stage in ('chart', 'serialize')}
+        self.assertEqual(set(results), expected)
+        self.assertTrue(all(entry['seconds'] > 0 for entry in results.values()))
+        self.assertEqual(results['dashboard:cold']['bytes'], results['dashboard:warm']['bytes'])
+        self.assertLess(results['serialize:genre_popularity']['seconds'],
+                        results['chart:genre_popularity']['seconds'])
+
+    def test_compare_flags_regressions_beyond_tolerance(self):
+        baseline = {'1x': {'chart:a': {'seconds': 1.0, 'peak_mb': 100.0, 'bytes': 10000},
+                           'chart:b': {'seconds': 0.001}}}
+        results = {'1x': {'chart:a': {'seconds': 1.2, 'peak_mb': 150.0, 'bytes': 20000},
+                          'chart:b': {'seconds': 0.004},   # 4x slower, but below the noise floor
+                          'chart:c': {'seconds': 9.0}},    # Not in the baseline
+                   '10x': {'chart:a': {'seconds': 9.0}}}
+        self.assertEqual(compare(results, baseline), [('1x', 'chart:a', 'peak_mb', 100.0, 150.0),
+                                                      ('1x', 'chart:a', 'bytes', 10000, 20000)])
+        self.assertEqual(compare(results, baseline, {'seconds': 0.1})[0], ('1x', 'chart:a', 'seconds', 1.0, 1.2))
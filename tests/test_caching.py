@@ -0,0 +1,142 @@
+import json
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from flask import Flask
+
+from app import cache, storage
+from app.artifacts import FileSystemArtifactCache
+from app.caching import EXPIRY_JITTER, chart_cache_key, chart_flights, jittered, load_chart, normalize_params
+from app.singleflight import SingleFlight, shared_flight
+from app.models import analyze_genre_popularity, analyze_music_features_by_genre
+from app.snapshot import DatasetSnapshot
+from benchmarks.synthetic import make_tracks
+
+
+class TestChartCache(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        cache.init_app(self.app)
+        self.snapshot = DatasetSnapshot(storage.apply_schema(make_tracks(1000, n_genres=5)))
+
+    def test_arguments_are_part_of_the_key(self):
+        with self.app.app_context():
+            danceability, _ = analyze_music_features_by_genre(self.snapshot, 'danceability')
+            energy, _ = analyze_music_features_by_genre(self.snapshot, 'energy')
+            default, _ = analyze_music_features_by_genre(self.snapshot)
+        self.assertNotEqual(danceability, energy)
+        self.assertIn('Energy', json.loads(energy)['layout']['title']['text'])
+        self.assertEqual(default, danceability)
+
+    def test_dataset_version_is_part_of_the_key(self):
+        other = DatasetSnapshot(storage.apply_schema(make_tracks(1000, seed=1, n_genres=5)))
+        with self.app.app_context():
+            first, _ = analyze_genre_popularity(self.snapshot)
+            second, _ = analyze_genre_popularity(other)
+        self.assertNotEqual(first, second)
+
+    def test_results_are_cached(self):
+        with self.app.app_context():
+            analyze_genre_popularity(self.snapshot, top_n=3)
+            key = chart_cache_key('analyze_genre_popularity', self.snapshot.fingerprint,
+                                  {'genres': None, 'top_n': 3})
+            self.assertIsNotNone(cache.get(key))
+
+    def test_equivalent_parameters_normalise_identically(self):
+        self.assertEqual(normalize_params({'genres': ['pop', 'rock', 'pop'], 'top_n': 5}),
+                         normalize_params({'top_n': 5, 'genres': ('rock', 'pop')}))
+
+    def test_jittered_expiry(self):
+        lifetimes = [jittered(3600) for _ in range(100)]
+        self.assertTrue(all(3600 * (1 - EXPIRY_JITTER) <= lifetime <= 3600 for lifetime in lifetimes))
+        self.assertGreater(len(set(lifetimes)), 1)
+        self.assertEqual(jittered(0), 0)
+
+    def test_entries_read_late_are_refreshed_in_the_background(self):
+        with self.app.app_context():
+            with mock.patch('app.caching.REFRESH_AHEAD', 0), mock.patch.object(chart_flights, 'refresh') as refresh:
+                first = analyze_genre_popularity(self.snapshot)
+                refresh.assert_not_called()
+                self.assertEqual(analyze_genre_popularity(self.snapshot), first)
+            key = analyze_genre_popularity.cache_key(self.snapshot)
+            self.assertEqual(refresh.call_args[0][0], key)
+
+            # The refresh stores the chart again, for a new lifetime
+            refresh.call_args[0][1]()
+            self.assertEqual(cache.get(key)[0], first)
+
+    def test_concurrent_misses_compute_once(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'graph', 'interpretation'
+
+        results = []
+
+        def request():
+            with self.app.app_context():
+                results.append(load_chart('chart:test', compute))
+
+        threads = [threading.Thread(target=request) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [('graph', 'interpretation')] * 8)
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_waiters_get_the_error(self):
+        flights = SingleFlight('test')
+        started = threading.Event()
+        errors = []
+
+        def fail():
+            started.set()
+            time.sleep(0.1)
+            raise ValueError("failed")
+
+        def wait():
+            started.wait()
+            try:
+                flights.run('key', lambda: 'computed again')
+            except ValueError as e:
+                errors.append(e)
+
+        waiter = threading.Thread(target=wait)
+        waiter.start()
+        with self.assertRaises(ValueError):
+            flights.run('key', fail)
+        waiter.join()
+        self.assertEqual(len(errors), 1)
+        self.assertFalse(flights.running('key'))
+
+    def test_other_workers_wait_for_the_shared_result(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = FileSystemArtifactCache(tmp)
+            token = store.acquire('lock:key', 60)  # Another worker is computing
+            self.assertIsNotNone(token)
+
+            def finish():
+                time.sleep(0.2)
+                store.set('key', b'result')
+                store.release('lock:key', token)
+
+            threading.Thread(target=finish).start()
+            result = shared_flight(store, 'key', lambda: store.get('key'),
+                                   mock.Mock(side_effect=AssertionError("computed twice")), 60)
+            self.assertEqual(result, b'result')
+
+            # The holder is stuck: the waiter computes after the lock timeout
+            store.acquire('lock:stuck', 60)
+            self.assertEqual(shared_flight(store, 'stuck', lambda: None, lambda: b'own', 0.1), b'own')
+
+
+if __name__ == '__main__':
+    unittest.main()
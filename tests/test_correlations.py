@@ -0,0 +1,79 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from flask import Flask
+
+from app import cache, storage
+from app.correlations import CorrelationStats, spearman
+from app.models import analyze_feature_correlation_heatmap, analyze_sales_correlations
+from app.snapshot import DatasetSnapshot
+from benchmarks.synthetic import make_tracks
+
+
+class TestCorrelationStats(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.df = storage.apply_schema(make_tracks(4000, n_genres=5))
+        cls.columns = cls.df.select_dtypes(include=['number']).columns
+
+    def assertMatrixEqual(self, actual, expected):
+        pd.testing.assert_frame_equal(actual, expected, check_exact=False, atol=1e-10)
+
+    def test_matches_pandas(self):
+        self.assertMatrixEqual(CorrelationStats.from_frame(self.df).pearson(), self.df[self.columns].corr())
+
+    def test_missing_values_use_pairwise_complete_rows(self):
+        df = self.df.copy()
+        df.loc[df.index[:300], 'energy'] = np.nan
+        df.loc[df.index[200:500], 'tempo'] = np.nan
+        self.assertMatrixEqual(CorrelationStats.from_frame(df).pearson(), df[self.columns].corr())
+
+    def test_incremental_update(self):
+        history, batch = self.df.iloc[:3000], self.df.iloc[3000:]
+        stats = CorrelationStats.from_frame(history)
+        updated = stats.updated(batch)
+        self.assertMatrixEqual(updated.pearson(), self.df[self.columns].corr())
+        self.assertMatrixEqual(stats.pearson(), history[self.columns].corr())  # Left unchanged
+
+    def test_merge(self):
+        parts = [CorrelationStats.from_frame(self.df.iloc[start:start + 1500]) for start in (0, 1500, 3000)]
+        merged = parts[0].merge(parts[1]).merge(parts[2])
+        self.assertMatrixEqual(merged.pearson(), self.df[self.columns].corr())
+
+    def test_constant_column(self):
+        df = pd.DataFrame({'a': [1.0, 2.0, 3.0], 'b': [5.0, 5.0, 5.0]})
+        corr = CorrelationStats.from_frame(df).pearson()
+        self.assertEqual(corr.loc['a', 'a'], 1.0)
+        self.assertTrue(np.isnan(corr.loc['a', 'b']))
+
+    def test_spearman(self):
+        self.assertMatrixEqual(spearman(self.df), self.df[self.columns].corr(method='spearman'))
+
+
+class TestCorrelationCharts(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        cache.init_app(self.app)
+        self.snapshot = DatasetSnapshot(storage.apply_schema(make_tracks(2000, n_genres=4)))
+
+    def test_charts_share_one_matrix(self):
+        with self.app.app_context(), mock.patch.object(CorrelationStats, 'pearson',
+                                                       autospec=True, side_effect=CorrelationStats.pearson) as pearson:
+            cache.clear()
+            analyze_sales_correlations(self.snapshot)
+            analyze_feature_correlation_heatmap(self.snapshot)
+        self.assertEqual(pearson.call_count, 1)
+
+    def test_spearman_chart(self):
+        with self.app.app_context():
+            pearson, _ = analyze_sales_correlations(self.snapshot)
+            ranked, _ = analyze_sales_correlations(self.snapshot, method='spearman')
+        self.assertNotEqual(pearson, ranked)
+        with self.assertRaises(ValueError):
+            self.snapshot.correlations('kendall')
+
+
+if __name__ == '__main__':
+    unittest.main()
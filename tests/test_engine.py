@@ -0,0 +1,82 @@
+import time
+import unittest
+from unittest import mock
+
+from app import cache, create_app, storage
+from app.caching import cached_chart
+from app.charts import CHARTS, DASHBOARD_CHARTS, Chart, render_chart
+from app.engine import ChartEngine
+from benchmarks.synthetic import make_tracks
+
+
+@cached_chart()
+def analyze_broken(data):
+    raise KeyError('missing column')
+
+
+@cached_chart()
+def analyze_slow(data):
+    time.sleep(2)
+    return '{}', ''
+
+
+TEST_CHARTS = {'broken': Chart(analyze_broken, {}), 'slow': Chart(analyze_slow, {})}
+
+
+class TestChartEngine(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        df = storage.apply_schema(make_tracks(2000, n_genres=5))
+        cls.app = create_app({'TESTING': True, 'ARTIFACT_CACHE_TYPE': None, 'DATASET_LOADER': lambda: df})
+
+    def setUp(self):
+        self.context = self.app.app_context()
+        self.context.push()
+        cache.clear()
+        self.snapshot = self.app.extensions['dataset_registry'].get()
+
+    def tearDown(self):
+        self.context.pop()
+
+    def test_threads_match_serial_rendering(self):
+        results = ChartEngine(max_workers=4).render(self.snapshot, DASHBOARD_CHARTS)
+        self.assertEqual([result.name for result in results], [name for name, _ in DASHBOARD_CHARTS])
+        self.assertTrue(all(result.error is None for result in results))
+
+        # The results were stored in the cache shared with render_chart
+        with mock.patch.object(ChartEngine, '_compute') as compute:
+            ChartEngine().render(self.snapshot, DASHBOARD_CHARTS)
+        compute.assert_not_called()
+        for result, (name, params) in zip(results, DASHBOARD_CHARTS):
+            self.assertEqual(render_chart(name, self.snapshot, params)[0], result.graph_json)
+
+    def test_processes(self):
+        jobs = [('genre_popularity', {'top_n': 3}), ('energy_by_genre', {})]
+        results = ChartEngine(max_workers=2, executor='process').render(self.snapshot, jobs)
+        self.assertTrue(all(result.error is None for result in results), results)
+        self.assertEqual(results[0].graph_json, CHARTS['genre_popularity'].function.uncached(self.snapshot, top_n=3)[0])
+
+    def test_failure_is_isolated(self):
+        with mock.patch.dict(CHARTS, TEST_CHARTS):
+            results = ChartEngine(max_workers=2).render(
+                self.snapshot, [('broken', {}), ('genre_popularity', {}), ('unknown', {})])
+        self.assertIn('KeyError', results[0].error)
+        self.assertIsNone(results[1].error)
+        self.assertIn('unknown chart', results[2].error)
+
+    def test_timeout(self):
+        with mock.patch.dict(CHARTS, TEST_CHARTS):
+            start = time.perf_counter()
+            results = ChartEngine(max_workers=2, timeout=0.2).render(
+                self.snapshot, [('slow', {}), ('genre_popularity', {})])
+        self.assertLess(time.perf_counter() - start, 1.5)
+        self.assertIn('timed out', results[0].error)
+        self.assertIsNone(results[1].error)
+
+    def test_unknown_executor(self):
+        with self.assertRaises(ValueError):
+            ChartEngine(executor='gpu')
+
+
+if __name__ == '__main__':
+    unittest.main()
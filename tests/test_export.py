@@ -0,0 +1,79 @@
+import gzip
+import json
+import os
+import tempfile
+import unittest
+
+from app import create_app, storage
+from app.charts import DASHBOARD_CHARTS
+from app.engine import ChartEngine
+from app.export import export_dashboard, read_manifest
+from benchmarks.synthetic import make_tracks
+
+
+class TestStaticExport(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.output = self.tmp.name
+        self.df = storage.apply_schema(make_tracks(1500, seed=5, n_genres=5))
+        self.app = create_app({'TESTING': True, 'ARTIFACT_CACHE_TYPE': None, 'DATASET_DELTA_DIR': None,
+                               'DATASET_LOADER': lambda: self.df})
+        self.engine = ChartEngine(2, 'thread')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def export(self, **kwargs):
+        with self.app.app_context():
+            snapshot = self.app.extensions['dataset_registry'].get()
+            return export_dashboard(snapshot, self.output, self.engine, **kwargs)
+
+    def test_export_matches_api(self):
+        manifest = self.export()
+        self.assertEqual(len(manifest['exported']), len(DASHBOARD_CHARTS))
+        self.assertEqual(manifest['failed'], [])
+        self.assertEqual(read_manifest(self.output)['charts'], manifest['charts'])
+
+        client = self.app.test_client()
+        shell = open(os.path.join(self.output, manifest['shell'])).read()
+        for entry in manifest['charts']:
+            path = os.path.join(self.output, entry['files']['identity'])
+            with open(path, 'rb') as f:
+                body = f.read()
+            with open(os.path.join(self.output, entry['files']['gzip']), 'rb') as f:
+                self.assertEqual(gzip.decompress(f.read()), body)
+            self.assertIn(f'data-src="{entry["files"]["identity"]}"', shell)
+
+            response = client.get(f"/api/charts/{entry['name']}", query_string=entry['params'])
+            self.assertEqual(json.loads(body), response.get_json())
+        self.assertNotIn('data-src="/api/charts', shell)
+        self.assertTrue(os.path.exists(os.path.join(self.output, 'static', 'js', 'scripts.js')))
+
+    def test_unchanged_charts_are_skipped(self):
+        first = self.export()
+        second = self.export()
+        self.assertEqual(second['exported'], [])
+        self.assertEqual(len(second['unchanged']), len(DASHBOARD_CHARTS))
+        self.assertEqual(second['charts'], first['charts'])
+
+        # A deleted file is exported again
+        os.remove(os.path.join(self.output, first['charts'][0]['files']['identity']))
+        third = self.export()
+        self.assertEqual(third['exported'], [first['charts'][0]['id']])
+
+        self.assertEqual(len(self.export(force=True)['exported']), len(DASHBOARD_CHARTS))
+
+    def test_new_data_version_and_prune(self):
+        first = self.export()
+        self.app.extensions['dataset_registry'].append(
+            storage.apply_schema(make_tracks(50, seed=9, n_genres=5)))
+        second = self.export(prune=True)
+        self.assertEqual(len(second['exported']), len(DASHBOARD_CHARTS))
+        self.assertNotEqual(second['dataset'], first['dataset'])
+
+        files = {os.path.join('charts', name) for name in os.listdir(os.path.join(self.output, 'charts'))}
+        self.assertEqual(files, {path for entry in second['charts'] for path in entry['files'].values()})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import math
+import pickle
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from app import storage
+from app.indexes import ArtistIndex, FilterIndex, RowFilter
+from app.snapshot import DatasetSnapshot
+from benchmarks.synthetic import make_tracks
+
+
+class TestFilterIndex(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.df = storage.apply_schema(make_tracks(5000, n_genres=8))
+        cls.df.loc[::7, 'energy'] = np.nan
+        cls.index = FilterIndex(cls.df)
+        cls.genres = sorted(cls.df['track_genre'].astype(str).unique())
+
+    def assert_matches_scan(self, row_filter):
+        np.testing.assert_array_equal(self.index.rows(row_filter), np.flatnonzero(row_filter.mask(self.df)))
+
+    def test_single_conditions(self):
+        self.assert_matches_scan(RowFilter())
+        self.assert_matches_scan(RowFilter(genres=self.genres[:3]))
+        self.assert_matches_scan(RowFilter(explicit=True))
+        self.assert_matches_scan(RowFilter(explicit=False))
+        self.assert_matches_scan(RowFilter(ranges=[('popularity', 71, math.inf)]))
+        self.assert_matches_scan(RowFilter(ranges=[('energy', -math.inf, 0.3)]))  # Missing values are dropped
+        self.assert_matches_scan(RowFilter(ranges=[('tempo', 200, 100)]))
+
+    def test_random_combinations(self):
+        rng = np.random.default_rng(0)
+        for _ in range(100):
+            ranges = [(feature, *sorted(rng.uniform(low, high, 2)))
+                      for feature, (low, high) in [('popularity', (0, 100)), ('energy', (0, 1)), ('key', (-1, 11))]
+                      if rng.random() < 0.5]
+            genres = list(rng.choice(self.genres, rng.integers(1, 4))) if rng.random() < 0.5 else None
+            self.assert_matches_scan(RowFilter(genres, [None, True, False][rng.integers(3)], ranges))
+
+    def test_unknown_genre_matches_nothing(self):
+        self.assertEqual(self.index.count(RowFilter(genres=['polka'])), 0)
+
+    def test_filter_key_is_canonical(self):
+        first = RowFilter(['rock', 'pop'], True, [('tempo', 100, 120), ('energy', 0, 1)])
+        second = RowFilter(['pop', 'rock', 'pop'], True, [('energy', 0.0, 1.0), ('tempo', 100, 120)])
+        self.assertEqual(first.key, second.key)
+        self.assertEqual(second.as_params(), {'genre': ['pop', 'rock'], 'explicit': True, 'energy_min': 0.0,
+                                              'energy_max': 1.0, 'tempo_min': 100.0, 'tempo_max': 120.0})
+
+
+class TestFilteredSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.df = storage.apply_schema(make_tracks(3000, n_genres=5))
+        self.genres = sorted(self.df['track_genre'].astype(str).unique())
+        self.snapshot = DatasetSnapshot(self.df)
+
+    def test_filtered_snapshot(self):
+        row_filter = RowFilter(self.genres[:2], False, [('popularity', 30, math.inf)])
+        filtered = self.snapshot.filtered(row_filter)
+        self.assertIs(self.snapshot.filtered(row_filter), filtered)
+        self.assertEqual(len(filtered), row_filter.mask(self.df).sum())
+        self.assertEqual(sorted(filtered.genre_stats.index), self.genres[:2])
+        self.assertNotEqual(filtered.fingerprint, self.snapshot.fingerprint)
+        self.assertEqual(sorted(filtered.genre_versions), self.genres[:2])
+
+    def test_genre_versions_follow_appends(self):
+        row_filter = RowFilter(explicit=True)
+        batch = storage.validate_batch(make_tracks(30, seed=1, n_genres=1).drop(columns=['Unnamed: 0']))
+        before = self.snapshot.filtered(row_filter)
+        after = self.snapshot.append(batch).filtered(row_filter)
+        self.assertNotEqual(after.genres_version(self.genres[:1]), before.genres_version(self.genres[:1]))
+        self.assertEqual(after.genres_version(self.genres[1:]), before.genres_version(self.genres[1:]))
+
+    def test_snapshot_with_index_can_be_pickled(self):
+        self.snapshot.filtered(RowFilter(explicit=True))
+        copy = pickle.loads(pickle.dumps(self.snapshot))
+        self.assertEqual(copy.filtered(RowFilter(explicit=True)).fingerprint,
+                         self.snapshot.filtered(RowFilter(explicit=True)).fingerprint)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+class TestArtistIndex(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.df = storage.apply_schema(make_tracks(4000, n_genres=6))
+        cls.index = ArtistIndex(cls.df)
+        cls.genres = sorted(cls.df['track_genre'].astype(str).unique())
+
+    def reference(self, genres=None):
+        # One row per (track, artist) of a collaboration, grouped by artist
+        df = self.df if genres is None else self.df[self.df['track_genre'].astype(str).isin(genres)]
+        pairs = df.assign(artist=df['artists'].astype(str).str.split(';')).explode('artist')
+        pairs['artist'] = pairs['artist'].str.strip()
+        return pairs[pairs['artist'] != ''].groupby('artist')['popularity'].agg(['count', 'mean', 'max'])
+
+    def assert_top(self, k, min_tracks=1, genres=None):
+        top = self.index.top(k, min_tracks=min_tracks, genres=genres)
+        expected = self.reference(genres)
+        expected = expected[expected['count'] >= min_tracks].reset_index()
+        expected = expected.sort_values(['mean', 'count', 'artist'], ascending=[False, False, True]).head(k)
+        self.assertEqual(top.index.tolist(), expected['artist'].tolist())
+        np.testing.assert_array_equal(top['count'], expected['count'])
+        np.testing.assert_allclose(top['mean'], expected['mean'])
+        np.testing.assert_array_equal(top['max'], expected['max'])
+
+    def test_top_matches_groupby(self):
+        self.assert_top(20)
+        self.assert_top(15, min_tracks=5)
+        self.assert_top(10, genres=self.genres[:1])
+        self.assert_top(10, min_tracks=3, genres=self.genres[2:5])
+        self.assert_top(10 ** 6)
+        self.assertTrue(self.index.top(5, genres=['polka']).empty)
+
+    def test_collaborations_credit_every_artist(self):
+        df = pd.DataFrame({'artists': ['A;B', 'B', ' C ; A', None], 'popularity': [80, 40, 60, 90],
+                           'track_genre': ['pop', 'pop', 'rock', 'rock']})
+        index = ArtistIndex(df)
+        top = index.top(3)
+        self.assertEqual(top.index.tolist(), ['A', 'B', 'C'])  # B and C tie: B has more tracks
+        self.assertEqual(top['count'].tolist(), [2, 2, 1])
+        self.assertEqual(top['max'].tolist(), [80, 80, 60])
+        np.testing.assert_array_equal(index.rows('A'), [0, 2])
+        self.assertEqual(index.top(3, genres=['rock']).index.tolist(), ['A', 'C'])
+
+    def test_appended_matches_a_rebuilt_index(self):
+        batch = make_tracks(300, seed=5, n_genres=8)
+        batch.loc[:4, 'artists'] = 'New Artist;Other'
+        batch = storage.apply_schema(batch)
+        appended = self.index.appended(batch, len(self.df))
+        rebuilt = ArtistIndex(storage.concat_frames(self.df, batch))
+        pd.testing.assert_frame_equal(appended.top(30, min_tracks=2), rebuilt.top(30, min_tracks=2))
+        genres = list(rebuilt.genres[-3:])
+        pd.testing.assert_frame_equal(appended.top(10, genres=genres), rebuilt.top(10, genres=genres))
+        for artist in ['New Artist', self.df['artists'].iloc[0].split(';')[0]]:
+            np.testing.assert_array_equal(appended.rows(artist), rebuilt.rows(artist))
+        self.assertEqual(len(self.index.names), len(ArtistIndex(self.df).names))  # Left unchanged
+
+    def test_genre_totals_round_trip(self):
+        totals = self.index.genre_totals()
+        halves = pd.concat([totals.iloc[::2], totals.iloc[1::2]])
+        pd.testing.assert_frame_equal(ArtistIndex.from_genre_totals(halves).top(25, min_tracks=2),
+                                      self.index.top(25, min_tracks=2))
@@ -0,0 +1,180 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from app import cache, create_app, storage
+from app.models import analyze_genre_popularity
+from app.registry import DatasetRegistry
+from app.snapshot import DatasetSnapshot
+from benchmarks.synthetic import GENRES, make_tracks
+
+
+def make_batch(n_rows, genres, seed=1):
+    batch = make_tracks(n_rows, seed=seed, n_genres=len(GENRES))
+    batch['track_genre'] = [genres[i % len(genres)] for i in range(n_rows)]
+    return batch.drop(columns=['Unnamed: 0'])
+
+
+class TestValidateBatch(unittest.TestCase):
+    def test_valid_batch_is_cast(self):
+        batch = storage.validate_batch(make_batch(10, ['pop']))
+        self.assertEqual(batch['popularity'].dtype, 'int16')
+        self.assertIsInstance(batch['track_genre'].dtype, pd.CategoricalDtype)
+
+    def test_problems_are_listed(self):
+        batch = make_batch(10, ['pop']).drop(columns=['tempo'])
+        batch['rating'] = 1
+        batch.loc[0, 'track_id'] = None
+        with self.assertRaises(storage.SchemaError) as error:
+            storage.validate_batch(batch)
+        message = str(error.exception)
+        self.assertIn('missing columns: tempo', message)
+        self.assertIn('unexpected columns: rating', message)
+        self.assertIn('track_id: 1 missing values', message)
+
+    def test_bad_types(self):
+        batch = make_batch(10, ['pop'])
+        batch['popularity'] = 'high'
+        with self.assertRaisesRegex(storage.SchemaError, 'popularity: cannot be read as int16'):
+            storage.validate_batch(batch)
+
+    def test_read_batch_formats(self):
+        batch = make_batch(20, ['pop', 'rock'])
+        with tempfile.TemporaryDirectory() as tmp:
+            batch.to_csv(os.path.join(tmp, 'batch.csv'), index=False)
+            batch.to_parquet(os.path.join(tmp, 'batch.parquet'), index=False)
+            from_csv = storage.read_batch(os.path.join(tmp, 'batch.csv'))
+            from_parquet = storage.read_batch(os.path.join(tmp, 'batch.parquet'))
+            with self.assertRaises(storage.SchemaError):
+                storage.read_batch(os.path.join(tmp, 'batch.json'))
+        pd.testing.assert_frame_equal(from_csv, from_parquet, check_exact=False)
+
+
+class TestSnapshotAppend(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.base = storage.apply_schema(make_tracks(3000, n_genres=5))
+        cls.genres = sorted(cls.base['track_genre'].astype(str).unique())
+
+    def prepared(self):
+        snapshot = DatasetSnapshot(self.base).prepare()
+        snapshot.correlation_stats
+        snapshot.box_summary('tempo')
+        snapshot.density('energy', 'danceability')
+        return snapshot
+
+    def test_incremental_structures_match_a_rebuild(self):
+        batch = storage.validate_batch(make_batch(200, self.genres[:2]))
+        appended = self.prepared().append(batch)
+        rebuilt = DatasetSnapshot(appended.frame)
+
+        self.assertEqual(len(appended), 3200)
+        pd.testing.assert_frame_equal(appended.genre_stats, rebuilt.genre_stats)
+        pd.testing.assert_frame_equal(appended.correlations(), rebuilt.correlations(), atol=1e-10)
+        summary, expected = appended.box_summary('tempo'), rebuilt.box_summary('tempo')
+        pd.testing.assert_frame_equal(summary.drop(columns='outliers'), expected.drop(columns='outliers'))
+        for actual, wanted in zip(summary['outliers'], expected['outliers']):
+            np.testing.assert_array_equal(actual, wanted)
+        np.testing.assert_array_equal(appended.density('energy', 'danceability')['z'],
+                                      rebuilt.density('energy', 'danceability')['z'])
+
+    def test_derived_entries_are_carried_over(self):
+        snapshot = self.prepared()
+        snapshot.artist_index
+        appended = snapshot.append(storage.validate_batch(make_batch(50, self.genres[:1])))
+        self.assertIn('artist_index', appended.__dict__)
+        self.assertEqual(set(appended._derived), set(snapshot._derived))
+
+        builders = ['build_genre_stats', 'build_box_summary', 'density_grid', 'build_distributions', 'ArtistIndex']
+        with mock.patch.multiple('app.snapshot', **{name: mock.DEFAULT for name in builders}) as patched:
+            appended.prepare()
+            appended.box_summary('tempo')
+            appended.density('energy', 'danceability')
+            appended.artist_index
+        for name in builders:
+            patched[name].assert_not_called()
+
+    def test_new_genre(self):
+        appended = self.prepared().append(storage.validate_batch(make_batch(30, ['zydeco'])))
+        self.assertIn('zydeco', appended.genre_stats.index)
+        self.assertEqual(appended.genre_stats.loc['zydeco', ('tracks', 'count')], 30)
+        self.assertEqual(appended.frame['track_genre'].tolist()[-30:], ['zydeco'] * 30)
+        pd.testing.assert_frame_equal(appended.genre_stats, DatasetSnapshot(appended.frame).genre_stats)
+
+    def test_versions(self):
+        batch = storage.validate_batch(make_batch(50, self.genres[:1]))
+        first, second = DatasetSnapshot(self.base).append(batch), self.prepared().append(batch)
+        self.assertEqual(first.fingerprint, second.fingerprint)
+
+        base = DatasetSnapshot(self.base)
+        self.assertNotEqual(first.fingerprint, base.fingerprint)
+        self.assertNotEqual(first.genres_version(self.genres[:1]), base.genres_version(self.genres[:1]))
+        self.assertEqual(first.genres_version(self.genres[1:3]), base.genres_version(self.genres[1:3]))
+
+
+class TestIngestion(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.delta_dir = os.path.join(self.tmp.name, 'deltas')
+        self.base = storage.apply_schema(make_tracks(2000, n_genres=4))
+        self.genres = sorted(self.base['track_genre'].astype(str).unique())
+        self.config = {'TESTING': True, 'DATASET_LOADER': lambda: self.base, 'DATASET_DELTA_DIR': self.delta_dir,
+                       'DATASET_DELTA_POLL': 0, 'ARTIFACT_CACHE_DIR': os.path.join(self.tmp.name, 'artifacts')}
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_other_workers_pick_up_batches(self):
+        first = DatasetRegistry(lambda: self.base, self.delta_dir, poll_interval=0)
+        second = DatasetRegistry(lambda: self.base, self.delta_dir, poll_interval=0)
+        second.get()
+        appended = first.append(make_batch(100, self.genres[:1]))
+        self.assertEqual(len(appended), 2100)
+        self.assertEqual(second.get().fingerprint, appended.fingerprint)
+        self.assertEqual(second.status()['batches'], 1)
+
+        # A fresh process loads the base data and the batches
+        self.assertEqual(DatasetRegistry(lambda: self.base, self.delta_dir).get().fingerprint, appended.fingerprint)
+
+    def test_unaffected_charts_stay_cached(self):
+        app = create_app(self.config)
+        registry = app.extensions['dataset_registry']
+        with app.app_context():
+            cache.clear()
+            before = registry.get()
+            untouched = analyze_genre_popularity.cache_key(before, genres=self.genres[1:])
+            touched = analyze_genre_popularity.cache_key(before, genres=self.genres[:2])
+            everything = analyze_genre_popularity.cache_key(before)
+            analyze_genre_popularity(before, genres=self.genres[1:])
+
+            after = registry.append(make_batch(100, self.genres[:1]))
+            self.assertEqual(analyze_genre_popularity.cache_key(after, genres=self.genres[1:]), untouched)
+            self.assertNotEqual(analyze_genre_popularity.cache_key(after, genres=self.genres[:2]), touched)
+            self.assertNotEqual(analyze_genre_popularity.cache_key(after), everything)
+            self.assertIsNotNone(cache.get(untouched))
+
+    def test_ingest_command(self):
+        path = os.path.join(self.tmp.name, 'batch.csv')
+        make_batch(50, self.genres[:2]).to_csv(path, index=False)
+        app = create_app(self.config)
+        result = app.test_cli_runner().invoke(args=['ingest', path])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('50 tracks in 2 genres', result.output)
+        self.assertEqual(len(storage.list_deltas(self.delta_dir)), 1)
+        self.assertEqual(len(app.extensions['dataset_registry'].get()), 2050)
+
+    def test_ingest_command_rejects_invalid_files(self):
+        path = os.path.join(self.tmp.name, 'batch.csv')
+        make_batch(5, self.genres[:1]).drop(columns=['energy']).to_csv(path, index=False)
+        result = create_app(self.config).test_cli_runner().invoke(args=['ingest', '--no-warm', path])
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn('missing columns: energy', result.output)
+        self.assertEqual(storage.list_deltas(self.delta_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import os
+import tempfile
+import time
+import unittest
+
+from app.locks import acquire_lock_file, release_lock_file
+
+
+class TestLockFile(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'publish.lock')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_only_the_owner_releases(self):
+        token = acquire_lock_file(self.path, 60)
+        self.assertIsNotNone(token)
+        self.assertIsNone(acquire_lock_file(self.path, 60))
+        release_lock_file(self.path, 'not-the-owner')
+        self.assertTrue(os.path.exists(self.path))
+        release_lock_file(self.path, token)
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+    def test_stale_lock_is_taken_over(self):
+        first = acquire_lock_file(self.path, 60)
+        os.utime(self.path, (time.time() - 120, time.time() - 120))
+        second = acquire_lock_file(self.path, 60)
+        self.assertNotIn(second, (None, first))
+
+        # The first holder, back late, does not release the lock of the second one
+        release_lock_file(self.path, first)
+        self.assertIsNone(acquire_lock_file(self.path, 60))
+        release_lock_file(self.path, second)
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import time
+import unittest
+
+from app import create_app, storage
+from app.metrics import Metrics, SamplingProfiler, metrics
+from benchmarks.synthetic import make_tracks
+
+
+class TestMetrics(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.df = storage.apply_schema(make_tracks(2000, seed=18, n_genres=5))
+
+    def setUp(self):
+        self.app = create_app({'TESTING': True, 'ARTIFACT_CACHE_TYPE': None, 'METRICS_ENABLED': True,
+                               'DATASET_LOADER': lambda: self.df})
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        metrics.configure(enabled=False)
+
+    def server_timing(self, response):
+        return [entry.strip() for entry in response.headers['Server-Timing'].split(',')]
+
+    def test_server_timing_splits_chart_stages(self):
+        first = self.server_timing(self.client.get('/api/charts/music_features_by_genre?feature=tempo&top_n=3'))
+        names = [entry.split(';')[0] for entry in first]
+        self.assertIn('cache-memory;desc="chart miss"', first)
+        for stage in ('aggregate', 'figure', 'serialize', 'compress', 'total'):
+            self.assertIn(stage, names)
+        self.assertTrue(any(entry.startswith('aggregate') and entry.endswith('desc="analyze_music_features_by_genre"')
+                            for entry in first))
+
+        second = self.server_timing(self.client.get('/api/charts/music_features_by_genre?feature=tempo&top_n=3'))
+        self.assertIn('cache-memory;desc="response hit"', second)
+        self.assertNotIn('aggregate', [entry.split(';')[0] for entry in second])
+
+    def test_metrics_endpoint(self):
+        self.client.get('/api/charts/tempo_by_genre?genres=acoustic')
+        self.client.get('/api/charts/tempo_by_genre?genres=acoustic')
+        text = self.client.get('/metrics').get_data(as_text=True)
+        self.assertIn('# TYPE chart_stage_seconds histogram', text)
+        self.assertIn('chart_stage_seconds_count{chart="analyze_tempo_by_genre",stage="figure"} 1', text)
+        self.assertIn('cache_requests_total{cache="response",result="hit",tier="memory"}', text)
+        self.assertIn('http_request_duration_seconds_bucket{method="GET",route="/api/charts/<name>",status="200",'
+                      'le="+Inf"} 2', text)
+
+    def test_disabled(self):
+        app = create_app({'TESTING': True, 'ARTIFACT_CACHE_TYPE': None, 'DATASET_LOADER': lambda: self.df})
+        client = app.test_client()
+        response = client.get('/api/charts/energy_by_genre')
+        self.assertNotIn('Server-Timing', response.headers)
+        self.assertEqual(client.get('/metrics').status_code, 404)
+        self.assertEqual(client.get('/metrics/profile').status_code, 404)
+        with metrics.stage('aggregate'), metrics.chart('x'):
+            pass
+        self.assertEqual(metrics.render(), '\n')
+
+
+class TestRegistry(unittest.TestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        registry = Metrics(enabled=True, buckets=(0.1, 1.0))
+        for seconds in (0.05, 0.5, 0.7, 3.0):
+            registry.observe('chart_seconds', seconds, chart='a"b')
+        lines = registry.render().splitlines()
+        self.assertIn('chart_seconds_bucket{chart="a\\"b",le="0.1"} 1', lines)
+        self.assertIn('chart_seconds_bucket{chart="a\\"b",le="1.0"} 3', lines)
+        self.assertIn('chart_seconds_bucket{chart="a\\"b",le="+Inf"} 4', lines)
+        self.assertIn('chart_seconds_count{chart="a\\"b"} 4', lines)
+
+    def test_counters_are_typed(self):
+        registry = Metrics(enabled=True)
+        registry.increment('cache_coalesced_total', cache='chart', tier='shared')
+        lines = registry.render().splitlines()
+        self.assertIn('# TYPE cache_coalesced_total counter', lines)
+        self.assertIn('cache_coalesced_total{cache="chart",tier="shared"} 1', lines)
+
+    def test_sampling_profiler(self):
+        profiler = SamplingProfiler(interval=0.001).start()
+
+        def busy():
+            end = time.perf_counter() + 0.1
+            while time.perf_counter() < end:
+                pass
+
+        busy()
+        profiler.stop()
+        self.assertIn('busy (test_metrics.py', profiler.collapsed(reset=True))
+        self.assertEqual(profiler.collapsed(), '')
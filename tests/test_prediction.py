@@ -0,0 +1,135 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import statsmodels.api as sm
+
+from app import create_app, storage
+from app.prediction import PREDICTORS, ModelUnavailable, PopularityModel, PredictionService, fit_popularity_model
+from app.snapshot import DatasetSnapshot
+from benchmarks.synthetic import make_tracks
+
+
+class TestPopularityModel(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.df = storage.apply_schema(make_tracks(3000, seed=2, n_genres=6))
+        cls.model = fit_popularity_model(cls.df, 'v1')
+
+    def test_matches_regression_with_genre_dummies(self):
+        dummies = pd.get_dummies(self.df['track_genre'].astype(str), dtype=float)
+        features = self.df[list(PREDICTORS)].astype(float)
+        expected = sm.OLS(self.df['popularity'].astype(float), pd.concat([features, dummies], axis=1)).fit()
+
+        np.testing.assert_allclose(self.model.coefficients, expected.params[list(PREDICTORS)], rtol=1e-6)
+        np.testing.assert_allclose(self.model.genre_effects, expected.params[dummies.columns], rtol=1e-6)
+        self.assertAlmostEqual(self.model.stats['r_squared'], expected.rsquared)
+        np.testing.assert_allclose(self.model.predict(self.df), expected.fittedvalues.clip(0, 100), rtol=1e-6)
+
+    def test_predict_unknown_genre_and_missing_values(self):
+        tracks = self.df.head(3).copy()
+        tracks['track_genre'] = ['unknown', None, tracks['track_genre'].iloc[2]]
+        tracks.loc[tracks.index[2], 'energy'] = np.nan
+        predictions = self.model.predict(tracks)
+        expected = self.model.design_matrix(tracks[:1]) @ self.model.coefficients + self.model.mean_effect
+        self.assertAlmostEqual(predictions[0], float(np.clip(expected[0], 0, 100)))
+        self.assertTrue(np.isnan(predictions[2]))
+        with self.assertRaises(ValueError):
+            self.model.predict(tracks.drop(columns='tempo'))
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'model.json')
+            self.model.save(path)
+            loaded = PopularityModel.load(path)
+        self.assertEqual(loaded.fingerprint, 'v1')
+        np.testing.assert_allclose(loaded.predict(self.df), self.model.predict(self.df))
+
+
+class TestPredictionService(unittest.TestCase):
+    def test_background_refit(self):
+        df = storage.apply_schema(make_tracks(2000, seed=3, n_genres=4))
+        first = DatasetSnapshot(df)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'model.json')
+            service = PredictionService(path)
+            with self.assertRaises(ModelUnavailable):
+                service.model(first)
+            service.refit(first).join()
+            self.assertEqual(service.model(first).fingerprint, first.fingerprint)
+
+            # The previous model keeps serving while the new version is fitted
+            second = first.append(storage.apply_schema(make_tracks(100, seed=4, n_genres=4)))
+            self.assertEqual(service.model(second).fingerprint, first.fingerprint)
+            service._thread.join()
+            self.assertEqual(service.model(second).fingerprint, second.fingerprint)
+
+            # Another worker loads the saved model instead of fitting it
+            other = PredictionService(path)
+            self.assertEqual(other.model(second).fingerprint, second.fingerprint)
+            self.assertIsNone(other._thread)
+
+
+    def test_failed_fit_is_retried(self):
+        snapshot = DatasetSnapshot(storage.apply_schema(make_tracks(1000, seed=3, n_genres=4)))
+        service = PredictionService()
+        calls = []
+
+        def fails_once(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise MemoryError()
+            return fit_popularity_model(*args)
+
+        with mock.patch('app.prediction.fit_popularity_model', side_effect=fails_once):
+            with self.assertRaises(ModelUnavailable):
+                service.model(snapshot)
+            service._thread.join()
+            with self.assertRaisesRegex(ModelUnavailable, 'could not be fitted'):
+                service.model(snapshot)  # Within the backoff: not fitted again
+            self.assertEqual(len(calls), 1)
+
+            service._retry_at = 0.0  # The backoff has elapsed
+            with self.assertRaises(ModelUnavailable):
+                service.model(snapshot)
+            service._thread.join()
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(service.model(snapshot).fingerprint, snapshot.fingerprint)
+
+
+class TestPredictRoute(unittest.TestCase):
+    def test_predict(self):
+        df = storage.apply_schema(make_tracks(2000, seed=5, n_genres=4))
+        app = create_app({'TESTING': True, 'ARTIFACT_CACHE_TYPE': None, 'DATASET_DELTA_DIR': None,
+                          'DATASET_LOADER': lambda: df, 'PREDICTION_MODEL_PATH': None})
+        client = app.test_client()
+        response = client.get('/api/predict')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        app.extensions['prediction_service']._thread.join()
+
+        model = client.get('/api/predict').get_json()
+        self.assertEqual(set(model['coefficients']), set(PREDICTORS))
+        tracks = df[list(PREDICTORS) + ['track_genre']].head(500).astype({'track_genre': str})
+        response = client.post('/api/predict', json={'tracks': tracks.to_dict('records')})
+        self.assertEqual(response.status_code, 200)
+        predictions = response.get_json()['predictions']
+        self.assertEqual(len(predictions), 500)
+        expected = app.extensions['prediction_service']._model.predict(tracks)
+        np.testing.assert_allclose(predictions, expected, atol=1e-3)
+
+        self.assertEqual(client.post('/api/predict', json={'tracks': []}).status_code, 400)
+        self.assertEqual(client.post('/api/predict', json={'tracks': [{'energy': 1}]}).status_code, 400)
+        # json.dumps writes Infinity, which the request parser accepts
+        track = {**tracks.iloc[0].to_dict(), 'energy': float('inf')}
+        infinite = client.post('/api/predict', data=json.dumps({'tracks': [track]}), content_type='application/json')
+        self.assertEqual(infinite.status_code, 400)
+        self.assertIn('energy', infinite.get_json()['error'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import threading
+import unittest
+
+from app import create_app, storage
+from app.registry import DatasetRegistry, DatasetUnavailable
+from benchmarks.synthetic import make_tracks
+
+
+class CountingLoader:
+    def __init__(self, n_rows=300):
+        self.calls = 0
+        self.n_rows = n_rows
+
+    def __call__(self):
+        self.calls += 1
+        return storage.apply_schema(make_tracks(self.n_rows, seed=self.calls, n_genres=4))
+
+
+class TestDatasetRegistry(unittest.TestCase):
+    def test_create_app_does_not_load(self):
+        loader = CountingLoader()
+        app = create_app({'TESTING': True, 'ARTIFACT_CACHE_TYPE': None, 'DATASET_LOADER': loader})
+        self.assertEqual(loader.calls, 0)
+
+        response = app.test_client().get('/ready')
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(response.get_json()['ready'])
+
+    def test_ready_after_first_use(self):
+        loader = CountingLoader()
+        app = create_app({'TESTING': True, 'ARTIFACT_CACHE_TYPE': None, 'DATASET_LOADER': loader})
+        snapshot = app.extensions['dataset_registry'].get()
+
+        response = app.test_client().get('/ready')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['version'], snapshot.fingerprint)
+        self.assertEqual(response.get_json()['rows'], 300)
+
+    def test_concurrent_first_use_loads_once(self):
+        loader = CountingLoader()
+        registry = DatasetRegistry(loader)
+        threads = [threading.Thread(target=registry.get) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(loader.calls, 1)
+
+    def test_warm_up_loads_in_background(self):
+        loader = CountingLoader()
+        registry = DatasetRegistry(loader)
+        registry.warm_up().join(timeout=30)
+        self.assertTrue(registry.ready)
+        self.assertEqual(loader.calls, 1)
+
+    def test_reload_swaps_snapshot(self):
+        registry = DatasetRegistry(CountingLoader())
+        first = registry.get()
+        second = registry.reload()
+        self.assertIs(registry.get(), second)
+        self.assertNotEqual(first.fingerprint, second.fingerprint)
+        self.assertEqual(len(first), 300)
+
+    def test_snapshot_frame_is_not_shared(self):
+        snapshot = DatasetRegistry(CountingLoader()).get()
+        frame = snapshot.frame
+        frame['release_year'] = 2020
+        self.assertNotIn('release_year', snapshot.frame.columns)
+
+    def test_unavailable_dataset(self):
+        app = create_app({'TESTING': True, 'ARTIFACT_CACHE_TYPE': None, 'DATASET_LOADER': lambda: None})
+        with self.assertRaises(DatasetUnavailable):
+            app.extensions['dataset_registry'].get()
+        self.assertEqual(app.test_client().get('/api/charts/genre_popularity').status_code, 503)
+
+    def test_dashboard_shell_does_not_load(self):
+        loader = CountingLoader()
+        app = create_app({'TESTING': True, 'ARTIFACT_CACHE_TYPE': None, 'DATASET_LOADER': loader})
+        response = app.test_client().get('/dashboard')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(loader.calls, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
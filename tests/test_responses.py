@@ -0,0 +1,88 @@
+import gzip
+import json
+import tempfile
+import unittest
+from unittest import mock
+
+import brotli
+
+from app import cache, create_app, storage
+from benchmarks.synthetic import make_tracks
+
+
+class TestPrecompressedResponses(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.df = storage.apply_schema(make_tracks(3000, n_genres=6))
+        self.app = create_app({'TESTING': True, 'DATASET_LOADER': lambda: self.df,
+                               'ARTIFACT_CACHE_DIR': self.tmp.name})
+        self.client = self.app.test_client()
+        with self.app.app_context():
+            cache.clear()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def df_fingerprint(self):
+        return self.app.extensions['dataset_registry'].get().fingerprint
+
+    def test_gzip_variant(self):
+        plain = self.client.get('/api/charts/duration_by_genre')
+        compressed = self.client.get('/api/charts/duration_by_genre', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertEqual(compressed.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(compressed.headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(compressed.data), plain.data)
+        self.assertLess(len(compressed.data), len(plain.data) / 3)
+        self.assertNotEqual(compressed.headers['ETag'], plain.headers['ETag'])
+        self.assertEqual(json.loads(plain.data)['name'], 'duration_by_genre')
+
+    def test_brotli_variant(self):
+        plain = self.client.get('/api/charts/duration_by_genre')
+        compressed = self.client.get('/api/charts/duration_by_genre', headers={'Accept-Encoding': 'gzip, br'})
+        self.assertEqual(compressed.headers['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(compressed.data), plain.data)
+        gzipped = self.client.get('/api/charts/duration_by_genre', headers={'Accept-Encoding': 'gzip'})
+        self.assertLess(len(compressed.data), len(gzipped.data))
+
+    def test_not_modified(self):
+        first = self.client.get('/api/charts/genre_popularity?top_n=5', headers={'Accept-Encoding': 'gzip'})
+        self.assertTrue(first.headers['ETag'].startswith(f'"{self.df_fingerprint()}-'))
+        repeat = self.client.get('/api/charts/genre_popularity?top_n=5', headers={
+            'Accept-Encoding': 'gzip', 'If-None-Match': first.headers['ETag']})
+        self.assertEqual(repeat.status_code, 304)
+        self.assertEqual(repeat.data, b'')
+
+        # Other parameters are another resource
+        other = self.client.get('/api/charts/genre_popularity?top_n=6', headers={
+            'If-None-Match': first.headers['ETag']})
+        self.assertEqual(other.status_code, 200)
+
+    def test_revalidation_does_not_compute(self):
+        etag = self.client.get('/api/charts/tempo_by_genre').headers['ETag']
+        with self.app.app_context():
+            cache.clear()
+        self.app.extensions['artifact_cache'].clear()
+        response = self.client.get('/api/charts/tempo_by_genre', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.app.extensions['artifact_cache'].size(), 0)
+
+    def test_variants_are_shared_by_workers(self):
+        first = self.client.get('/api/charts/energy_by_genre', headers={'Accept-Encoding': 'gzip'})
+        other = create_app({'TESTING': True, 'DATASET_LOADER': lambda: self.df, 'ARTIFACT_CACHE_DIR': self.tmp.name})
+        with other.app_context():
+            cache.clear()
+        with mock.patch('app.routes.render_chart', side_effect=AssertionError('recomputed')):
+            response = other.test_client().get('/api/charts/energy_by_genre', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.data, first.data)
+
+    def test_dashboard_shell(self):
+        first = self.client.get('/dashboard', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(first.headers['Content-Encoding'], 'gzip')
+        self.assertIn(b'Tableau de Bord', gzip.decompress(first.data))
+        repeat = self.client.get('/dashboard', headers={'If-None-Match': first.headers['ETag']})
+        self.assertEqual(repeat.status_code, 304)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import json
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+import plotly.graph_objects as go
+
+from app.serialization import FigureEncoder, decode_typed_array
+
+
+class TestFigureEncoder(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.values = rng.random(1000)
+        self.counts = rng.integers(10**6, 10**9, size=(20, 30))
+        self.fig = go.Figure([go.Scatter(x=self.values, y=self.values * 2, text=['a'] * 1000),
+                              go.Heatmap(z=self.counts)])
+
+    def test_large_arrays_become_typed_arrays(self):
+        data = json.loads(FigureEncoder('float64').encode(self.fig))['data']
+        self.assertEqual(data[0]['x']['dtype'], 'f8')
+        np.testing.assert_array_equal(decode_typed_array(data[0]['x']), self.values)
+        self.assertEqual(data[0]['text'], ['a'] * 1000)
+
+        # 64-bit integers are not supported by plotly.js
+        self.assertEqual(data[1]['z']['dtype'], 'i4')
+        np.testing.assert_array_equal(decode_typed_array(data[1]['z']), self.counts)
+
+    def test_float_precision(self):
+        data = json.loads(FigureEncoder('float32').encode(self.fig))['data']
+        self.assertEqual(data[0]['x']['dtype'], 'f4')
+        np.testing.assert_allclose(decode_typed_array(data[0]['x']), self.values, rtol=1e-7)
+        with self.assertRaises(ValueError):
+            FigureEncoder('float16')
+
+    def test_text_output_matches_to_json(self):
+        fig = go.Figure(go.Bar(x=['a', 'b'], y=[1.5, 2.5]))
+        self.assertEqual(json.loads(FigureEncoder(binary=False).encode(fig)), json.loads(fig.to_json()))
+        data = json.loads(FigureEncoder('float64', binary=False).encode(self.fig))['data']
+        self.assertEqual(data[0]['x'], self.values.tolist())
+
+    def test_figure_with_frames_matches_to_json(self):
+        fig = go.Figure(go.Scatter(x=np.arange(30), y=np.linspace(0, 1, 30)), layout={'title': 'frames'},
+                        frames=[go.Frame(data=[go.Scatter(y=np.arange(30) * 2.5)], name='second')])
+        expected = json.loads(fig.to_json())
+        encoder = FigureEncoder('float64', binary=False)
+        self.assertEqual(json.loads(encoder.encode(fig)), expected)
+        # A plotly without the private attributes read by the encoder: the public path
+        public = SimpleNamespace(to_plotly_json=fig.to_plotly_json)
+        self.assertEqual(json.loads(encoder.encode(public)), expected)
+
+    def test_short_text_is_kept(self):
+        # Mostly missing and short decimal values are smaller as JSON text
+        z = np.full((50, 50), np.nan)
+        z[0, 0] = 3
+        fig = go.Figure(go.Heatmap(x=np.arange(50) / 10, z=z))
+        trace = json.loads(FigureEncoder().encode(fig))['data'][0]
+        self.assertIsInstance(trace['z'], list)
+        self.assertIsInstance(trace['x'], list)
+
+    def test_figure_is_not_modified(self):
+        before = self.fig.to_json()
+        FigureEncoder('float32').encode(self.fig)
+        self.assertEqual(self.fig.to_json(), before)
+
+    def test_payload_is_smaller(self):
+        self.assertLess(len(FigureEncoder('float32').encode(self.fig)), 0.7 * len(self.fig.to_json()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from app import create_app, storage
+from app.charts import CHARTS, DASHBOARD_CHARTS
+from app.shared import SharedDataset, is_shared_fresh, map_shared
+from app.similarity import INDEX_ARRAYS, SimilarityIndex
+from app.snapshot import DatasetSnapshot
+from benchmarks.synthetic import make_tracks
+
+
+class CountingLoader:
+    def __init__(self, df):
+        self.calls = 0
+        self.df = df
+
+    def __call__(self):
+        self.calls += 1
+        time.sleep(0.2)
+        return self.df
+
+
+class TestSharedDataset(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'dataset.arrow')
+        self.df = storage.apply_schema(make_tracks(2000, seed=3, n_genres=5))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        loader = CountingLoader(self.df)
+        snapshot = SharedDataset(self.path, loader)()
+        expected = DatasetSnapshot(self.df).prepare()
+
+        self.assertEqual(snapshot.fingerprint, expected.fingerprint)
+        self.assertEqual(snapshot.genre_versions, expected.genre_versions)
+        pd.testing.assert_frame_equal(snapshot.frame, expected.frame)
+        pd.testing.assert_frame_equal(snapshot.genre_stats, expected.genre_stats)
+        for name, params in DASHBOARD_CHARTS:
+            self.assertEqual(CHARTS[name].function.uncached(snapshot, **params),
+                             CHARTS[name].function.uncached(expected, **params), name)
+
+        # The next worker maps the file without loading anything
+        SharedDataset(self.path, loader)()
+        self.assertEqual(loader.calls, 1)
+
+    def test_workers_starting_together_publish_once(self):
+        loader = CountingLoader(self.df)
+        snapshots = []
+        workers = [threading.Thread(target=lambda: snapshots.append(SharedDataset(self.path, loader)()))
+                   for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(loader.calls, 1)
+        self.assertEqual(len(snapshots), 4)
+        self.assertEqual(len({snapshot.fingerprint for snapshot in snapshots}), 1)
+        self.assertFalse(os.path.exists(self.path + '.lock'))
+
+    def test_similarity_index_is_mapped(self):
+        SharedDataset(self.path, CountingLoader(self.df))()
+        snapshot = map_shared(self.path)
+        self.assertIn('similarity_index', snapshot.__dict__)
+        self.assertNotIn('__similarity_matrix__', snapshot.frame.columns)
+        index, expected = snapshot.similarity_index, SimilarityIndex(self.df)
+        self.assertFalse(index.matrix.flags.writeable)
+        for name in INDEX_ARRAYS:
+            np.testing.assert_array_equal(getattr(index, name), getattr(expected, name))
+
+        track_ids = self.df['track_id'].iloc[:3].tolist()
+        for (rows, _), (expected_rows, _) in zip(index.similar(track_ids, 5), expected.similar(track_ids, 5)):
+            np.testing.assert_array_equal(rows, expected_rows)
+
+    def test_columns_are_read_only(self):
+        SharedDataset(self.path, CountingLoader(self.df))()
+        snapshot = map_shared(self.path)
+        values = snapshot._frame['energy'].to_numpy()
+        self.assertFalse(values.flags.writeable)
+        with self.assertRaises(ValueError):
+            values[0] = 0.0
+
+        # Writes through the public frame copy the column (PANDAS_COPY_ON_WRITE)
+        with pd.option_context('mode.copy_on_write', True):
+            frame = snapshot.frame
+            frame.loc[0, 'energy'] = 2.0
+        self.assertNotEqual(snapshot._frame['energy'].iloc[0], 2.0)
+
+    def test_rewritten_when_source_changes(self):
+        source_path = os.path.join(self.tmp.name, 'tracks.csv')
+        self.df.head(10).to_csv(source_path)
+        loader = CountingLoader(self.df)
+        shared = SharedDataset(self.path, loader, source_path)
+        shared()
+        self.assertTrue(is_shared_fresh(self.path, shared.source()))
+
+        with open(source_path, 'a') as f:
+            f.write('\n')
+        os.utime(source_path, (0, 0))
+        self.assertFalse(is_shared_fresh(self.path, shared.source()))
+        shared()
+        self.assertEqual(loader.calls, 2)
+
+    def test_app_serves_shared_dataset(self):
+        app = create_app({'TESTING': True, 'ARTIFACT_CACHE_TYPE': None, 'DATASET_DELTA_DIR': None,
+                          'DATASET_LOADER': lambda: self.df, 'DATASET_SHARED_PATH': self.path})
+        name, params = DASHBOARD_CHARTS[0]
+        response = app.test_client().get(f"/api/charts/{name}", query_string=params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(os.path.exists(self.path))
+
+        result = app.test_cli_runner().invoke(args=['publish-dataset'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn(app.extensions['dataset_registry'].get().fingerprint, result.output)
+
+    def test_publish_command_waits_for_a_publishing_worker(self):
+        loader = CountingLoader(self.df)
+        app = create_app({'TESTING': True, 'ARTIFACT_CACHE_TYPE': None, 'DATASET_DELTA_DIR': None,
+                          'DATASET_WARM_UP': False, 'DATASET_LOADER': loader, 'DATASET_SHARED_PATH': self.path})
+        worker = SharedDataset(self.path, CountingLoader(self.df))
+        holding = threading.Event()
+
+        def publish():
+            with worker.publish_lock():
+                holding.set()
+                worker.publish()
+
+        thread = threading.Thread(target=publish)
+        thread.start()
+        holding.wait()
+        result = app.test_cli_runner().invoke(args=['publish-dataset'])
+        thread.join()
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('was just written by a worker', result.output)
+        self.assertEqual((worker.loader.calls, loader.calls), (1, 0))
+        self.assertFalse(os.path.exists(self.path + '.lock'))
+
+
+if __name__ == '__main__':
+    unittest.main()
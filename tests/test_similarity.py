@@ -0,0 +1,107 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from app import create_app, storage
+from app.indexes import RowFilter
+from app.similarity import SimilarityIndex, brute_force_neighbours
+from app.snapshot import DatasetSnapshot
+from benchmarks.synthetic import make_tracks
+
+
+class TestSimilarityIndex(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.df = storage.apply_schema(make_tracks(20000, seed=4, n_genres=8))
+        cls.index = SimilarityIndex(cls.df)
+
+    def test_tree_matches_brute_force(self):
+        self.assertIsNotNone(self.index.tree)
+        queries = self.index.matrix[:40]
+        distances, rows = self.index.neighbours(queries, 15)
+        expected_distances, _ = brute_force_neighbours(self.index.matrix, queries, 15, block_rows=3000)
+        np.testing.assert_allclose(distances, expected_distances, atol=2e-3)
+
+        allowed = np.flatnonzero(self.df['explicit'].to_numpy())
+        distances, rows = self.index.neighbours(queries, 15, allowed)
+        expected_distances, _ = brute_force_neighbours(self.index.matrix, queries, 15, allowed)
+        np.testing.assert_allclose(distances, expected_distances, atol=2e-3)
+        self.assertTrue(np.isin(rows, allowed).all())
+
+    def test_brute_force_index(self):
+        index = SimilarityIndex(self.df, use_tree=False)
+        self.assertIsNone(index.tree)
+        ids = self.df['track_id'].iloc[:5].tolist()
+        for with_tree, without_tree in zip(self.index.similar(ids, 8), index.similar(ids, 8)):
+            np.testing.assert_allclose(with_tree[1], without_tree[1], atol=2e-3)
+
+    def test_similar_excludes_the_track_and_its_copies(self):
+        # The first track listed again under another genre, with the same features
+        copy = self.df.iloc[[0]].copy()
+        copy['track_genre'] = self.df['track_genre'].iloc[-1]
+        df = storage.concat_frames(self.df, copy)
+        index = SimilarityIndex(df)
+        track_id = df['track_id'].iloc[0]
+
+        (rows, distances), unknown = index.similar([track_id, 'unknown'], 10)
+        self.assertIsNone(unknown)
+        self.assertEqual(len(rows), 10)
+        self.assertNotIn(track_id, df['track_id'].to_numpy()[rows])
+        self.assertTrue((np.diff(distances) >= 0).all())
+
+        expected = np.sqrt(((index.matrix - index.matrix[0]) ** 2).sum(axis=1))
+        expected = np.sort(expected[df['track_id'].to_numpy() != track_id])[:10]
+        np.testing.assert_allclose(distances, expected, atol=2e-3)
+
+    def test_built_on_first_query(self):
+        snapshot = DatasetSnapshot(self.df).prepare()
+        self.assertNotIn('similarity_index', snapshot.__dict__)
+        snapshot.similar_tracks([self.df['track_id'].iloc[0]], k=3)
+        index = snapshot.similarity_index
+        self.assertIn('tree', index.__dict__)
+        # No Python object per track: ids are looked up in the frame's Arrow column
+        self.assertEqual([array.dtype.kind for array in index.arrays.values()], ['f', 'i', 'i'])
+        self.assertEqual(index.rows_of([self.df['track_id'].iloc[7], 'unknown']).tolist(), [7, -1])
+
+    def test_snapshot_similar_tracks_with_filter(self):
+        snapshot = DatasetSnapshot(self.df)
+        track_id = self.df['track_id'].iloc[3]
+        genre = self.df['track_genre'].iloc[0]
+        [similar] = snapshot.similar_tracks([track_id], k=5, row_filter=RowFilter(genres=[genre], explicit=False))
+        self.assertEqual(len(similar), 5)
+        self.assertTrue((similar['track_genre'] == genre).all())
+        pd.testing.assert_series_equal(similar['distance'], similar['distance'].sort_values())
+
+
+class TestSimilarRoutes(unittest.TestCase):
+    def setUp(self):
+        self.df = storage.apply_schema(make_tracks(2000, seed=6, n_genres=4))
+        app = create_app({'TESTING': True, 'ARTIFACT_CACHE_TYPE': None, 'DATASET_DELTA_DIR': None,
+                          'DATASET_LOADER': lambda: self.df})
+        self.client = app.test_client()
+
+    def test_single_and_batch(self):
+        track_id = self.df['track_id'].iloc[0]
+        response = self.client.get(f"/api/similar/{track_id}", query_string={'k': 3, 'explicit': 'true'})
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+        self.assertEqual(len(body['similar']), 3)
+        self.assertEqual(body['filter'], {'explicit': True})
+
+        response = self.client.get('/api/similar', query_string={'track_ids': f"{track_id},missing", 'k': 2})
+        results = response.get_json()['results']
+        single = self.client.get(f"/api/similar/{track_id}", query_string={'k': 2}).get_json()
+        self.assertEqual(results[0]['similar'], single['similar'])
+        self.assertEqual(len(results[0]['similar']), 2)
+        self.assertIsNone(results[1]['similar'])
+
+    def test_errors(self):
+        self.assertEqual(self.client.get('/api/similar/missing').status_code, 404)
+        self.assertEqual(self.client.get('/api/similar', query_string={'track_ids': 'a', 'k': 0}).status_code, 400)
+        self.assertEqual(self.client.get('/api/similar').status_code, 400)
+        self.assertEqual(self.client.get('/api/similar/a', query_string={'genre': 'nope'}).status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
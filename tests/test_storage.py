@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from app import storage
+from app.models import load_data
+from benchmarks.synthetic import make_tracks
+
+
+class TestStorage(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.csv_path = os.path.join(self.tmp.name, 'tracks.csv')
+        self.cache_path = storage.cache_path_for(self.csv_path)
+        make_tracks(500, n_genres=5).to_csv(self.csv_path, index=False)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_load_data_applies_schema_and_builds_cache(self):
+        df = load_data(self.csv_path)
+        self.assertTrue(os.path.exists(self.cache_path))
+        self.assertIsInstance(df['track_genre'].dtype, pd.CategoricalDtype)
+        self.assertEqual(df['danceability'].dtype, 'float32')
+        self.assertEqual(df['popularity'].dtype, 'int16')
+
+    def test_fresh_cache_skips_csv_parse(self):
+        expected = load_data(self.csv_path)
+        with mock.patch.object(storage, 'read_csv_typed') as read_csv:
+            df = load_data(self.csv_path)
+        read_csv.assert_not_called()
+        pd.testing.assert_frame_equal(df, expected)
+
+    def test_modified_source_rebuilds_cache(self):
+        load_data(self.csv_path)
+        make_tracks(200, seed=1, n_genres=5).to_csv(self.csv_path, index=False)
+        os.utime(self.csv_path, ns=(0, 0))
+        df = load_data(self.csv_path)
+        self.assertEqual(len(df), 200)
+        self.assertEqual(len(storage.read_cache(self.cache_path)), 200)
+
+    def test_schema_version_mismatch_is_stale(self):
+        load_data(self.csv_path)
+        fingerprint = storage.source_fingerprint(self.csv_path)
+        self.assertTrue(storage.is_cache_fresh(self.cache_path, fingerprint))
+        with mock.patch.object(storage, 'SCHEMA_VERSION', storage.SCHEMA_VERSION + 1):
+            self.assertFalse(storage.is_cache_fresh(self.cache_path, fingerprint))
+
+    def test_compact_representation(self):
+        df = load_data(self.csv_path)
+        self.assertEqual(list(df.columns), [column for column in storage.ANALYSIS_COLUMNS])
+        self.assertEqual(df['artists'].cat.categories.dtype, storage.ARROW_STRING)
+        # Left-out columns stay in the cache and the CSV parse gives the same values
+        lazy = storage.read_cache(self.cache_path, columns=storage.LAZY_COLUMNS)
+        self.assertEqual(list(lazy.columns), list(storage.LAZY_COLUMNS))
+        pd.testing.assert_frame_equal(df, storage.read_csv_typed(self.csv_path, storage.ANALYSIS_COLUMNS))
+        legacy = pd.read_csv(self.csv_path)
+        self.assertEqual(df['artists'].astype(str).tolist(), legacy['artists'].tolist())
+        np.testing.assert_allclose(df['energy'], legacy['energy'], rtol=1e-6)  # float32: 7 significant digits
+
+        report = storage.memory_report(legacy, df)
+        self.assertEqual(report.loc['Unnamed: 0', 'after'], 0)
+        self.assertEqual(report.loc['total', 'before'], legacy.memory_usage(deep=True, index=False).sum())
+        self.assertGreater(report.loc['total', 'ratio'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+import os
+import pickle
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from app import cache, create_app, storage
+from app.aggregates import FEATURE_RANGES
+from app.charts import DASHBOARD_CHARTS
+from app.engine import ChartEngine
+from app.snapshot import DatasetSnapshot
+from app.streaming import QUANTILE_BINS, StreamingAggregate, aggregate_file, iter_chunks
+from benchmarks.synthetic import make_tracks
+from tests.test_ingest import make_batch
+
+
+class TestStreamingAggregate(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.path = os.path.join(cls.tmp.name, 'tracks.csv')
+        make_tracks(6000, n_genres=5).to_csv(cls.path, index=False)
+        cls.streamed = aggregate_file(cls.path, chunksize=700, sample_size=200)
+        cls.loaded = DatasetSnapshot(storage.read_csv_typed(cls.path, storage.ANALYSIS_COLUMNS))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_exact_statistics(self):
+        streamed, loaded = self.streamed.genre_stats, self.loaded.genre_stats
+        self.assertEqual(len(self.streamed), 6000)
+        pd.testing.assert_index_equal(streamed.columns, loaded.columns)
+        for stat in ['count', 'mean', 'min', 'max']:
+            pd.testing.assert_frame_equal(streamed.xs(stat, axis=1, level=1), loaded.xs(stat, axis=1, level=1),
+                                          check_dtype=False, rtol=1e-6)
+        pd.testing.assert_frame_equal(streamed[['tracks', 'explicit']], loaded[['tracks', 'explicit']],
+                                      check_dtype=False)
+        pd.testing.assert_frame_equal(self.streamed.correlations(), self.loaded.correlations(), atol=1e-10)
+        pd.testing.assert_frame_equal(self.streamed.top_artists(50), self.loaded.top_artists(50))
+        pd.testing.assert_frame_equal(self.streamed.top_artists(10, min_tracks=3, genres=['pop']),
+                                      self.loaded.top_artists(10, min_tracks=3, genres=['pop']))
+        self.assertEqual(self.streamed.top_tracks(10)['track_name'].tolist(),
+                         self.loaded.top_tracks(10)['track_name'].tolist())
+
+    def test_versions_match_the_loaded_frame(self):
+        self.assertEqual(self.streamed.fingerprint, self.loaded.fingerprint)
+        self.assertEqual(self.streamed.genre_versions, self.loaded.genre_versions)
+
+    def test_quantiles_within_one_bin(self):
+        for feature, (low, high) in FEATURE_RANGES.items():
+            for stat in ['q1', 'median', 'q3']:
+                error = (self.streamed.genre_stats[(feature, stat)] - self.loaded.genre_stats[(feature, stat)]).abs()
+                self.assertLessEqual(error.max(), (high - low) / QUANTILE_BINS, (feature, stat))
+
+    def test_histograms_and_densities(self):
+        histogram = self.streamed.histogram('acousticness')
+        self.assertEqual(histogram['counts'].sum(), 6000)
+        np.testing.assert_array_equal(histogram['edges'], self.loaded.histogram('acousticness')['edges'])
+        by_genre = self.streamed.distribution('energy', bins=20, by='genre', genres=['ambient', 'acoustic'])
+        loaded = self.loaded.distribution('energy', bins=20, by='genre', genres=['ambient', 'acoustic'])
+        self.assertEqual(by_genre['names'], ['ambient', 'acoustic'])
+        self.assertEqual(loaded['names'], by_genre['names'])
+        np.testing.assert_array_equal(by_genre['counts'].sum(axis=1), loaded['counts'].sum(axis=1))
+        with self.assertRaises(ValueError):
+            self.streamed.distribution('energy', mode='adaptive')
+        density = self.streamed.density('energy', 'danceability')
+        self.assertEqual(density['z'].sum(), 6000)
+        self.assertEqual(density['x_range'], [0.0, 1.0])
+
+    def test_prepare_builds_no_sample_distributions(self):
+        snapshot = aggregate_file(self.path, chunksize=700, sample_size=200)
+        self.assertIs(snapshot.prepare(), snapshot)
+        self.assertEqual(snapshot.fingerprint, self.loaded.fingerprint)
+        self.assertFalse([key for key in snapshot._derived if key[0] == 'distributions'])
+
+    def test_sample_is_bounded(self):
+        self.assertLessEqual(self.streamed.frame['track_genre'].value_counts().max(), 200)
+        self.assertEqual(len(self.streamed.sample(50)), 250)
+
+    def test_merge_matches_one_pass(self):
+        chunks = list(iter_chunks(self.path, chunksize=1500))
+        first, second = StreamingAggregate(), StreamingAggregate()
+        for chunk in chunks[:2]:
+            first.update(chunk)
+        for chunk in chunks[2:]:
+            second.update(chunk)
+        merged = first.merge(second)
+        whole = StreamingAggregate()
+        for chunk in chunks:
+            whole.update(chunk)
+        pd.testing.assert_frame_equal(merged.genre_stats(), whole.genre_stats(), rtol=1e-9)
+        self.assertEqual(merged.top.index.tolist(), whole.top.index.tolist())
+        self.assertEqual(merged.sample['track_id'].tolist(), whole.sample['track_id'].tolist())
+
+    def test_parquet_source(self):
+        path = os.path.join(self.tmp.name, 'tracks.parquet')
+        storage.read_csv_typed(self.path).to_parquet(path, index=False, row_group_size=1000)
+        streamed = aggregate_file(path, chunksize=1000, sample_size=200)
+        pd.testing.assert_frame_equal(streamed.genre_stats, self.streamed.genre_stats, rtol=1e-9)
+
+    def test_append_matches_the_in_memory_versions(self):
+        batch = storage.validate_batch(make_batch(100, ['acoustic', 'zydeco']))
+        streamed, loaded = self.streamed.append(batch), self.loaded.append(batch)
+        self.assertEqual(len(streamed), 6100)
+        self.assertEqual(streamed.fingerprint, loaded.fingerprint)
+        self.assertEqual(streamed.genre_versions, loaded.genre_versions)
+        self.assertEqual(streamed.genre_stats.loc['zydeco', ('tracks', 'count')], 50)
+        self.assertEqual(len(self.streamed), 6000)
+
+    def test_snapshot_can_be_sent_to_process_workers(self):
+        copy = pickle.loads(pickle.dumps(self.streamed))
+        self.assertEqual(copy.fingerprint, self.streamed.fingerprint)
+        pd.testing.assert_frame_equal(copy.genre_stats, self.streamed.genre_stats)
+
+
+class TestStreamingDashboard(unittest.TestCase):
+    def test_every_dashboard_chart_renders(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'tracks.csv')
+            make_tracks(3000, n_genres=5).to_csv(path, index=False)
+            app = create_app({'TESTING': True, 'ARTIFACT_CACHE_TYPE': None, 'DATASET_PATH': path,
+                              'DATASET_STREAMING': True, 'DATASET_CHUNK_SIZE': 500, 'DATASET_DELTA_DIR': None})
+            with app.app_context():
+                cache.clear()
+                snapshot = app.extensions['dataset_registry'].get()
+                results = ChartEngine(max_workers=2).render(snapshot, DASHBOARD_CHARTS)
+            # Similar tracks would only be searched among the sample
+            response = app.test_client().get(f"/api/similar/{snapshot.frame['track_id'].iloc[0]}")
+        self.assertEqual([result.error for result in results], [None] * len(DASHBOARD_CHARTS))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('DATASET_STREAMING', response.get_json()['error'])
+
+
+if __name__ == '__main__':
+    unittest.main()